@@ -0,0 +1,256 @@
+"""
+benchmarks/physics.py
+
+physics benchmarks, runs headless:
+    python -m benchmarks.physics [--output results.json]
+
+builds synthetic maps (Maps/*.json format) with N walls, spawns M balls
+with random shots and measures ticks per second, per-tick latency
+percentiles and memory allocations. micro benchmarks time the single
+building blocks (Vec2 maths, Walls.collide, Targets.collide)
+
+Author:
+Nilusink
+"""
+from dataclasses import dataclass, asdict
+from time import perf_counter
+import typing as tp
+import statistics
+import tracemalloc
+import platform
+import argparse
+import random
+import json
+import math
+import sys
+
+from core.objects import Walls, Balls, Targets, Ball, MAX_SPEED, load_map
+from core.classes import Vec2
+
+
+@dataclass(frozen=True)
+class Scenario:
+    name: str
+    walls: int              # number of random walls
+    balls: int              # number of balls
+    moving: int             # number of balls that get shot
+    speed: float            # shot speed (times MAX_SPEED)
+    tick_rate: float = 60
+    reshoot: bool = True    # shoot balls again once they came to rest
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (
+        Scenario("map1_like", walls=20, balls=8, moving=8, speed=1),
+        Scenario("dense_walls", walls=400, balls=50, moving=50, speed=1),
+        Scenario("idle_balls", walls=50, balls=1000, moving=5, speed=1),
+        Scenario("high_speed", walls=100, balls=50, moving=50, speed=6, tick_rate=20),
+    )
+}
+
+
+def synthetic_map(walls: int, rng: random.Random, max_length: float = .1) -> dict:
+    """
+    create a map in the Maps/*.json format with random walls
+    (x from 0..1, gets stretched to 0..2 when loaded)
+    """
+    config: dict[str, tp.Any] = {
+        "total": walls,
+        "target": [.5, .5],
+        "spawn_pos": [.15, .5],
+    }
+
+    for i in range(1, walls + 1):
+        x = rng.uniform(0, 1)
+        y = rng.uniform(0, 1)
+        angle = rng.uniform(0, 2 * math.pi)
+        length = rng.uniform(.005, max_length)
+
+        config[str(i)] = {
+            "p1_x": x,
+            "p1_y": y,
+            "p2_x": min(1., max(0., x + math.cos(angle) * length / 2)),  # x gets stretched
+            "p2_y": min(1., max(0., y + math.sin(angle) * length)),
+        }
+
+    return config
+
+
+def _clear() -> None:
+    Balls.empty()
+    Walls.empty()
+    Targets.empty()
+
+
+def _shoot(ball: Ball, speed: float, rng: random.Random) -> None:
+    ball.hit(Vec2.from_polar(rng.uniform(0, 2 * math.pi), rng.uniform(.2, 1) * speed * MAX_SPEED))
+
+
+def _percentiles(samples: list[float]) -> dict[str, float]:
+    ordered = sorted(samples)
+
+    def pick(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+    return {
+        "p50_us": pick(.5) * 1e6,
+        "p90_us": pick(.9) * 1e6,
+        "p99_us": pick(.99) * 1e6,
+        "max_us": ordered[-1] * 1e6,
+        "mean_us": statistics.fmean(ordered) * 1e6,
+    }
+
+
+def run_scenario(scenario: Scenario, ticks: int, seed: int) -> dict:
+    """
+    simulate a scenario and return its results
+    """
+    rng = random.Random(seed)
+    _clear()
+    load_map(synthetic_map(scenario.walls, rng))
+
+    balls = [
+        Ball(Vec2.from_cartesian(rng.uniform(.1, 1.9), rng.uniform(.1, .9)), user_id=f"user_{i:03d}")
+        for i in range(scenario.balls)
+    ]
+    shooters = balls[:scenario.moving]
+    for ball in shooters:
+        _shoot(ball, scenario.speed, rng)
+
+    delta = 1 / scenario.tick_rate
+
+    def tick() -> None:
+        Balls.update(delta)
+
+        if scenario.reshoot:
+            for shooter in shooters:
+                if shooter.velocity.length == 0:
+                    _shoot(shooter, scenario.speed, rng)
+
+    # warm up
+    for _ in range(min(ticks // 10, 60)):
+        tick()
+
+    durations = []
+    active = []
+    start = perf_counter()
+    for _ in range(ticks):
+        t0 = perf_counter()
+        tick()
+        durations.append(perf_counter() - t0)
+        active.append(Balls.world.active_count)
+
+    total = perf_counter() - start
+
+    # allocations (separate run, tracemalloc slows everything down)
+    alloc_ticks = min(ticks, 200)
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    blocks_before = sys.getallocatedblocks()
+    for _ in range(alloc_ticks):
+        tick()
+
+    after, peak = tracemalloc.get_traced_memory()
+    blocks_after = sys.getallocatedblocks()
+    tracemalloc.stop()
+
+    _clear()
+
+    return {
+        "scenario": asdict(scenario),
+        "ticks": ticks,
+        "ticks_per_second": ticks / total,
+        "realtime_factor": ticks / total / scenario.tick_rate,
+        "latency": _percentiles(durations),
+        "mean_active_balls": statistics.fmean(active),
+        "alloc": {
+            "ticks": alloc_ticks,
+            "net_kib": (after - before) / 1024,
+            "peak_kib": (peak - before) / 1024,
+            "blocks_per_tick": (blocks_after - blocks_before) / alloc_ticks,
+        },
+    }
+
+
+def _time_call(func: tp.Callable[[], tp.Any], repeat: int) -> dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = perf_counter()
+        func()
+        samples.append(perf_counter() - t0)
+
+    return _percentiles(samples)
+
+
+def run_micro(repeat: int, seed: int) -> dict:
+    """
+    time the single building blocks of the physics
+    """
+    rng = random.Random(seed)
+    _clear()
+    load_map(synthetic_map(400, rng))
+
+    ball = Ball(Vec2.from_cartesian(1, .5), user_id="user_000")
+    a = Vec2.from_cartesian(.3, .4)
+    b = Vec2.from_cartesian(-.2, .1)
+
+    results = {
+        "vec2_add": _time_call(lambda: a + b, repeat),
+        "vec2_scale": _time_call(lambda: a * .5, repeat),
+        "vec2_iadd": _time_call(lambda: a.copy().__iadd__(b), repeat),
+        "vec2_length": _time_call(lambda: a.copy().length, repeat),
+        "vec2_reflect": _time_call(lambda: a.copy().reflect(b), repeat),
+        "walls_collide_400": _time_call(lambda: Walls.collide(ball), repeat),
+        "walls_sweep_400": _time_call(
+            lambda: Walls.sweep_circle(ball.center, ball.radius, Vec2.from_cartesian(1, 0), .05),
+            repeat,
+        ),
+        "targets_collide": _time_call(lambda: Targets.collide(ball), repeat),
+    }
+
+    _clear()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MiniGolf physics benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="default: all")
+    parser.add_argument("--ticks", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=2000, help="repetitions of the micro benchmarks")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-micro", action="store_true")
+    parser.add_argument("--output", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "scenarios": {},
+    }
+
+    for name in args.scenario or SCENARIOS:
+        res = run_scenario(SCENARIOS[name], args.ticks, args.seed)
+        results["scenarios"][name] = res
+
+        print(
+            f"{name:>12}: {res['ticks_per_second']:10.0f} ticks/s  "
+            f"p50 {res['latency']['p50_us']:8.1f}us  "
+            f"p99 {res['latency']['p99_us']:8.1f}us  "
+            f"active {res['mean_active_balls']:7.1f}  "
+            f"blocks/tick {res['alloc']['blocks_per_tick']:6.1f}"
+        )
+
+    if not args.no_micro:
+        results["micro"] = run_micro(args.repeat, args.seed)
+
+        for name, res in results["micro"].items():
+            print(f"{name:>18}: p50 {res['p50_us']:8.2f}us  p99 {res['p99_us']:8.2f}us")
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(results, out, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+benchmarks/soak.py
+
+connection soak test, runs headless:
+    python -m benchmarks.soak [--cycles 1000] [--output results.json]
+
+starts a server and connects and disconnects clients over and over,
+handling the events like server.py does (a ball per client). some
+clients vanish without closing their connection (dead peers) and have
+to be reaped by the heartbeat. open file descriptors, threads, traced
+memory, connections and balls are sampled and must stay flat
+
+Author:
+Nilusink
+"""
+from time import perf_counter, sleep
+import tracemalloc
+import threading
+import platform
+import argparse
+import socket
+import json
+import os
+
+from core.server import Server, UserAdd, UserRem
+from core.client import Client, NotReceivedJet
+from core.objects import Balls, Ball
+from core.classes import Vec2
+
+
+def open_fds() -> int:
+    """
+    number of open file descriptors (-1 if unknown)
+    """
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+
+        except OSError:
+            continue
+
+    return -1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def handle_events(server: Server) -> None:
+    for event in server.events:
+        match event:
+            case UserAdd(user_id=_, time=_):
+                Ball(Vec2.from_cartesian(.15, .5), user_id=event.user_id)
+
+            case UserRem(user_id=_, time=_):
+                Balls.rem_user(event.user_id)
+
+
+def closed_by_server(peer: socket.socket) -> bool:
+    """
+    if the server closed a (dead) peer, the data it sent is discarded
+    """
+    try:
+        while peer.recv(1 << 16, socket.MSG_DONTWAIT):
+            pass
+
+    except BlockingIOError:
+        return False
+
+    except OSError:
+        return True
+
+    return True
+
+
+def has_ball(client: Client) -> bool:
+    try:
+        return Balls.get_user(client.ID) is not None
+
+    except NotReceivedJet:
+        return False
+
+
+def wait_for(condition, server: Server, timeout: float) -> bool:
+    deadline = perf_counter() + timeout
+    while perf_counter() < deadline:
+        handle_events(server)
+        if condition():
+            return True
+
+        sleep(.005)
+
+    return False
+
+
+def sample(server: Server, cycle: int) -> dict:
+    current, _peak = tracemalloc.get_traced_memory()
+    return {
+        "cycle": cycle,
+        "fds": open_fds(),
+        "threads": threading.active_count(),
+        "memory_kib": current / 1024,
+        "connections": len(server.clients),
+        "balls": len(Balls),
+    }
+
+
+def run(cycles: int, batch: int, dead_every: int, heartbeat_timeout: float, samples: int) -> dict:
+    port = free_port()
+    server = Server(
+        game_map={"spawn_pos": [.15, .5]},
+        host="127.0.0.1",
+        port=port,
+        ping_interval=heartbeat_timeout / 4,
+        heartbeat_timeout=heartbeat_timeout,
+    )
+
+    tracemalloc.start()
+    history = []
+    every = max(cycles // samples, 1)
+    dead: list[socket.socket] = []
+    start = perf_counter()
+
+    for cycle in range(cycles):
+        clients = [Client("127.0.0.1", port, map_cache=None) for _ in range(batch)]
+        if not wait_for(lambda: all(has_ball(client) for client in clients), server, 5):
+            raise RuntimeError(f"cycle {cycle}: clients didn't connect")
+
+        for client in clients:
+            client.end()
+
+        # a peer that disappears without closing (never sends anything again)
+        if dead_every and cycle % dead_every == 0:
+            peer = socket.create_connection(("127.0.0.1", port))
+            dead.append(peer)
+
+        if not wait_for(lambda: not any(has_ball(client) for client in clients), server, 5):
+            raise RuntimeError(f"cycle {cycle}: clients weren't removed")
+
+        # peers are only closed locally once the server reaped them
+        for peer in [peer for peer in dead if closed_by_server(peer)]:
+            peer.close()
+            dead.remove(peer)
+
+        if cycle % every == 0 or cycle == cycles - 1:
+            history.append(sample(server, cycle))
+            print(
+                f"cycle {cycle:6d}: "
+                f"fds {history[-1]['fds']:4d}  "
+                f"threads {history[-1]['threads']:3d}  "
+                f"memory {history[-1]['memory_kib']:8.1f}KiB  "
+                f"connections {history[-1]['connections']:3d}  "
+                f"balls {history[-1]['balls']:3d}"
+            )
+
+    # let the heartbeat reap the remaining dead peers
+    wait_for(lambda: not server.clients and not len(Balls), server, heartbeat_timeout * 2 + 1)
+    for peer in dead:
+        peer.close()
+
+    sleep(.1)
+    history.append(sample(server, cycles))
+    total = perf_counter() - start
+    tracemalloc.stop()
+
+    results = {
+        "cycles": cycles,
+        "batch": batch,
+        "connects_per_second": cycles * batch / total,
+        "connected": server.connected,
+        "disconnected": server.disconnected,
+        "reaped": server.reaped,
+        "history": history,
+    }
+    server.end()
+
+    # compare the second with the last sample (the first one includes warm up)
+    first = history[min(1, len(history) - 1)]
+    last = history[-1]
+    results["growth"] = {
+        key: last[key] - first[key] for key in ("fds", "threads", "memory_kib", "connections", "balls")
+    }
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="MiniGolf connection soak test")
+    parser.add_argument("--cycles", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=4, help="clients connected per cycle")
+    parser.add_argument("--dead-every", type=int, default=50, help="leave a dead peer every n cycles (0: never)")
+    parser.add_argument("--heartbeat-timeout", type=float, default=1)
+    parser.add_argument("--samples", type=int, default=20)
+    parser.add_argument("--output", help="write the results as json to this file")
+    args = parser.parse_args()
+
+    results = run(args.cycles, args.batch, args.dead_every, args.heartbeat_timeout, args.samples)
+    results["python"] = platform.python_version()
+
+    print(
+        f"{results['connected']} connections ({results['connects_per_second']:.0f}/s), "
+        f"{results['reaped']} reaped, growth: "
+        + ", ".join(f"{key} {value:+.1f}" for key, value in results["growth"].items())
+    )
+
+    if args.output:
+        with open(args.output, "w") as out:
+            json.dump(results, out, indent=4)
+
+
+if __name__ == "__main__":
+    main()
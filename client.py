@@ -9,7 +9,9 @@ Nilusink
 MelonenBuby
 """
 from core.client import Client, Thread, NotReceivedJet
+from core.prediction import ShotPredictor
 from traceback import format_exc
+from threading import Lock
 from contextlib import suppress
 from core.classes import Vec2
 from time import sleep
@@ -28,6 +30,10 @@ SERVER_PORT: int = 8888
 MAX_SPEED: float = 1    # the maximum player speed
 MAX_TIME: float = 4     # the maximum time a ball is on the move
 
+# rendering settings
+RENDER_DELAY: float = .1        # balls are drawn this far behind the server (seconds)
+MAX_EXTRAPOLATION: float = .25  # maximum time to continue balls without new snapshots
+
 
 pygame.init()
 pygame.font.init()
@@ -38,7 +44,18 @@ PERM_SHOW: list[tuple[tp.Callable, list, dict]] = []
 
 
 class _Balls(pygame.sprite.Group):
-    ...
+    _lock = Lock()
+
+    def by_id(self, ball_id: str) -> "Ball":
+        """
+        get the ball of a user, creates it if it doesn't exist yet
+        """
+        with self._lock:
+            for ball in self.sprites():
+                if ball.ball_id == ball_id:
+                    return ball
+
+            return Ball((0, 0), ball_id)
 
 
 # create ONLY instance
@@ -50,8 +67,10 @@ class Ball(pygame.sprite.Sprite):
     velocity: Vec2 = ...
     tries: int = 0
 
-    def __init__(self, pos: tuple[float, float]) -> None:
+    def __init__(self, pos: tuple[float, float], ball_id: str = "") -> None:
         super().__init__(Balls)
+        self.ball_id = ball_id
+        self.velocity = Vec2()
         self.color = (255, 0, 0, 255)
         self.player_color = (0, 255, 0, 255)
         self.position = Vec2.from_cartesian(pos[0] * 2, pos[1])
@@ -110,23 +129,12 @@ class Ball(pygame.sprite.Sprite):
         tries_text = FONT.render(str(self.tries), True, (0, 0, 0, 255))
         self.image.blit(tries_text, (6, 6))
 
-        # simulate
-        if self.velocity.length == 0:
-            return
-
-        self.position += self.velocity * delta
-
-        if self.velocity.length > 0:
-            self.velocity.length -= (MAX_SPEED / MAX_TIME) * delta
-
-        else:
-            self.velocity.length = 0
-
-        self.update_rect()
-
 
 # create client
 client = Client(server_ip=SERVER_IP, port=SERVER_PORT, debug_mode=True)
+client.interpolation.delay = RENDER_DELAY
+client.interpolation.max_extrapolation = MAX_EXTRAPOLATION
+client.interpolation.deceleration = MAX_SPEED / MAX_TIME
 
 print("getting map")
 while True:
@@ -165,13 +173,13 @@ def main() -> None:
                     sleep(0.01)
                     continue
 
-                while len(Balls.sprites()) < len(ball_pos["balls"]):
-                    Ball((0, 0))
+                if "balls" not in ball_pos:
+                    continue
 
-                for j, ball in enumerate(ball_pos["balls"]):
+                for ball in ball_pos["balls"]:
                     PERM_SHOW.clear()
 
-                    current_ball: Ball | pygame.sprite.Sprite = Balls.sprites()[j]
+                    current_ball = Balls.by_id(ball["id"])
                     if client.ID == ball["id"]:  # check if the currently updated ball is the player
                         current_ball.is_player = True
                         player = current_ball
@@ -195,11 +203,7 @@ def main() -> None:
                     else:
                         current_ball.is_player = False
 
-                    x = ball["x"]
-                    y = ball["y"]
-
-                    current_ball.update_pos(x, y)
-                    current_ball.velocity = Vec2.from_cartesian(*ball["vel"])
+                    # positions come from the interpolation buffer
                     current_ball.tries = ball["tries"]
 
             except (Exception,):
@@ -208,6 +212,7 @@ def main() -> None:
     Thread(target=update_handler).start()
 
     player: Ball = ...
+    predictor: ShotPredictor | None = None
     last_time = time.perf_counter()
     while active:
         window_size = (screen_info.current_w, screen_info.current_h)
@@ -309,10 +314,37 @@ def main() -> None:
                             "vector": [delta.x, delta.y]
                         })
 
+                        # start moving the ball right away
+                        if predictor is None:
+                            predictor = ShotPredictor(client.ID, data)
+
+                        newest = client.interpolation.newest
+                        if newest is not None:
+                            predictor.shoot((delta.x, delta.y), newest)
+
         now = time.perf_counter()
         delta = now - last_time
         last_time = now
 
+        # move the balls to their (interpolated) server positions,
+        # the own ball is predicted after a shot
+        state = client.interpolation.sample()
+        newest = client.interpolation.newest
+        if predictor is not None and newest is not None:
+            predictor.reconcile(newest, client.interpolation.offset)
+            state = predictor.apply(state)
+
+        if state is not None:
+            for ball_id, (x, y), velocity in zip(state.ids, state.positions.tolist(), state.velocities.tolist()):
+                ball = Balls.by_id(ball_id)
+                ball.update_pos(x / 2, y)
+                ball.velocity = Vec2.from_cartesian(*velocity)
+
+            # balls that just joined aren't in the (delayed) state yet
+            for ball in Balls.sprites():
+                if ball.ball_id not in state.ids and (newest is None or ball.ball_id not in newest.ids):
+                    ball.kill()
+
         Balls.update(delta)
         Balls.draw(top_layer)
 
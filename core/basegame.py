@@ -1,7 +1,7 @@
 import pygame as pg
 
 
-class _BaseGame:
+class BaseGame:
     def __init__(self, window_size: tuple[int, int] = ...) -> None:
         # initialize pygame
         pg.init()
@@ -27,6 +27,3 @@ class _BaseGame:
         self.font = pg.font.SysFont(None, 24)
         pg.display.set_caption("MiniGolf")
 
-
-# initialize game
-BaseGame = _BaseGame((1500, 750))
@@ -0,0 +1,168 @@
+"""
+core/broadcaster.py
+
+sends snapshots of the balls to the clients at a controlled rate:
+fast while balls are moving, backing off to a slow keep-alive rate
+while everything is at rest
+
+Author:
+Nilusink
+"""
+from threading import Condition
+from time import perf_counter
+import typing as tp
+import numpy as np
+
+
+if tp.TYPE_CHECKING:
+    from .snapshot import Snapshot
+
+
+class SnapshotBroadcaster:
+    """
+    a snapshot counts as active if a ball moves or anything changed
+    since the last one. while active, snapshots are sent with active_rate,
+    afterwards the interval grows by backoff per snapshot until idle_rate
+    """
+    sent: int           # number of sent snapshots
+    active_sent: int    # ... of which were sent while balls were moving
+
+    def __init__(
+            self,
+            take: tp.Callable[[], "Snapshot"],
+            send: tp.Callable[["Snapshot"], tp.Any],
+            active_rate: float = 30,
+            idle_rate: float = 1,
+            backoff: float = 2,
+    ) -> None:
+        """
+        :param take: returns the current snapshot
+        :param send: sends a snapshot to the clients
+        :param active_rate: snapshots per second while balls are moving
+        :param idle_rate: snapshots per second while everything is at rest
+        :param backoff: factor the interval grows by per idle snapshot
+        """
+        if not 0 < idle_rate <= active_rate:
+            raise ValueError("rates must satisfy 0 < idle_rate <= active_rate")
+
+        if backoff < 1:
+            raise ValueError("backoff must be at least 1")
+
+        self.take = take
+        self.send = send
+        self.active_rate = active_rate
+        self.idle_rate = idle_rate
+        self.backoff = backoff
+
+        self.sent = 0
+        self.active_sent = 0
+
+        self.__interval = 1 / active_rate
+        self.__last: "Snapshot | None" = None
+        self.__poked = False
+        self.__poke_on_publish = False
+        self.__wakeup = Condition()
+
+    @property
+    def interval(self) -> float:
+        """
+        current time between two snapshots
+        """
+        return self.__interval
+
+    def poke(self, after_publish: bool = False) -> None:
+        """
+        something happened (e.g. a ball got hit), send the next snapshot now
+        and switch back to the active rate
+
+        :param after_publish: wait until the change was published (see published)
+        """
+        with self.__wakeup:
+            if after_publish:
+                self.__poke_on_publish = True
+                return
+
+            self.__poked = True
+            self.__wakeup.notify()
+
+    def published(self, _snapshot: "Snapshot | None" = None) -> None:
+        """
+        a new state was published (e.g. BallWorld.on_publish), sends it
+        right away if there was a poke waiting for it
+        """
+        with self.__wakeup:
+            if not self.__poke_on_publish:
+                return
+
+            self.__poke_on_publish = False
+            self.__poked = True
+            self.__wakeup.notify()
+
+    def _is_active(self, snapshot: "Snapshot") -> bool:
+        moving = snapshot.velocities.any(axis=1) & ~snapshot.on_target
+        if moving.any():
+            return True
+
+        last = self.__last
+        if last is None or last.ids != snapshot.ids:
+            return True
+
+        return not (
+            np.array_equal(last.positions, snapshot.positions)
+            and np.array_equal(last.tries, snapshot.tries)
+            and np.array_equal(last.on_target, snapshot.on_target)
+        )
+
+    def broadcast(self, poked: bool = False) -> bool:
+        """
+        take and send one snapshot, adjusts the interval
+
+        :param poked: sent because something happened, doesn't back off
+        :return: if the snapshot was active
+        """
+        snapshot = self.take()
+        active = self._is_active(snapshot)
+        self.__last = snapshot
+
+        self.send(snapshot)
+        self.sent += 1
+
+        if active:
+            self.active_sent += 1
+
+        if active or poked:
+            self.__interval = 1 / self.active_rate
+
+        else:
+            self.__interval = min(self.__interval * self.backoff, 1 / self.idle_rate)
+
+        return active
+
+    def run(self, running: tp.Callable[[], bool] = ...) -> None:
+        """
+        broadcast until running returns False
+        """
+        if running is ...:
+            def running() -> bool:
+                return True
+
+        deadline = perf_counter()
+        while running():
+            with self.__wakeup:
+                timeout = deadline - perf_counter()
+                if timeout > 0 and not self.__poked:
+                    self.__wakeup.wait(timeout)
+
+                poked = self.__poked
+                self.__poked = False
+
+            now = perf_counter()
+            if not poked and now < deadline:
+                continue
+
+            self.broadcast(poked)
+
+            # keep the rate steady, but don't try to catch up after a stall
+            deadline = max(deadline + self.__interval, now)
+            if poked:
+                deadline = now + self.__interval
@@ -5,100 +5,126 @@ Author:
 Nilusink
 """
 import typing as tp
-import numpy as np
+import math
 
 
 class Vec2:
+    """
+    2d vector, stored as cartesian coordinates.
+    the polar coordinates are only calculated when needed (and cached)
+    """
+    __slots__ = ("__x", "__y", "__angle", "__length")
+
     x: float
     y: float
     angle: float
     length: float
 
-    def __init__(self) -> None:
-        self.__x: float = 0
-        self.__y: float = 0
-        self.__angle: float = 0
-        self.__length: float = 0
+    def __init__(self, x: float = 0, y: float = 0) -> None:
+        self.__x: float = x
+        self.__y: float = y
+        self.__angle: float | None = 0 if x == y == 0 else None
+        self.__length: float | None = None
 
     # variable getters / setters
     @property
-    def x(self):
+    def x(self) -> float:
         return self.__x
 
     @x.setter
-    def x(self, value):
+    def x(self, value: float) -> None:
         self.__x = value
-        self.__update("c")
+        self.__invalidate()
 
     @property
-    def y(self):
+    def y(self) -> float:
         return self.__y
 
     @y.setter
-    def y(self, value):
+    def y(self, value: float) -> None:
         self.__y = value
-        self.__update("c")
+        self.__invalidate()
 
     @property
-    def xy(self):
+    def xy(self) -> tuple[float, float]:
         return self.__x, self.__y
 
     @xy.setter
-    def xy(self, xy):
+    def xy(self, xy: tuple[float, float]) -> None:
         self.__x = xy[0]
         self.__y = xy[1]
-        self.__update("c")
+        self.__invalidate()
 
     @property
-    def angle(self):
+    def angle(self) -> float:
         """
         value in radian
         """
+        if self.__angle is None:
+            self.__angle = math.atan2(self.__y, self.__x)
+
         return self.__angle
 
     @angle.setter
-    def angle(self, value):
+    def angle(self, value: float) -> None:
         """
         value in radian
         """
-        value = self.normalize_angle(value)
-
-        self.__angle = value
-        self.__update("p")
+        self.polar = self.normalize_angle(value), self.length
 
     @property
-    def length(self):
+    def length(self) -> float:
+        if self.__length is None:
+            self.__length = math.hypot(self.__x, self.__y)
+
         return self.__length
 
     @length.setter
-    def length(self, value):
+    def length(self, value: float) -> None:
+        current = self.length
+
+        # keep the direction, even if the vector currently has no length
+        if current == 0:
+            self.polar = self.angle, value
+            return
+
+        scale = value / current
+        self.__x *= scale
+        self.__y *= scale
         self.__length = value
-        self.__update("p")
 
     @property
-    def polar(self):
-        return self.__angle, self.__length
+    def polar(self) -> tuple[float, float]:
+        return self.angle, self.length
 
     @polar.setter
-    def polar(self, polar):
-        self.__angle = polar[0]
-        self.__length = polar[1]
-        self.__update("p")
+    def polar(self, polar: tuple[float, float]) -> None:
+        angle, length = polar
+        self.__x = math.cos(angle) * length
+        self.__y = math.sin(angle) * length
+        self.__angle = angle
+        self.__length = length
 
     # interaction
-    def split_vector(self, direction):
+    def dot(self, other: "Vec2") -> float:
+        return self.__x * other.x + self.__y * other.y
+
+    def split_vector(self, direction: "Vec2") -> tuple["Vec2", "Vec2"]:
         """
         :param direction: A vector facing in the wanted direction
         :return: tuple[Vector in only that direction, everything else]
         """
-        a = (direction.angle - self.angle)
-        facing = Vec2.from_polar(angle=direction.angle, length=self.length * np.cos(a))
-        other = Vec2.from_polar(angle=direction.angle - np.pi / 2, length=self.length * np.sin(a))
+        d_len = direction.length
+        ux = direction.x / d_len
+        uy = direction.y / d_len
+
+        along = self.__x * ux + self.__y * uy
+        facing = Vec2(ux * along, uy * along)
 
-        return facing, other
+        return facing, self - facing
 
-    def copy(self):
-        return Vec2().from_cartesian(x=self.x, y=self.y)
+    def copy(self) -> "Vec2":
+        return Vec2(self.__x, self.__y)
 
     def to_dict(self) -> dict:
         return {
@@ -122,56 +148,110 @@ class Vec2:
         return self
 
     def reflect(self, reflect_by: "Vec2") -> "Vec2":
-        t1, t2 = self.split_vector(reflect_by)
-        self.xy = (t1 - t2).xy
+        """
+        keep the part facing in the direction of reflect_by and
+        invert everything else (bounce off a surface facing reflect_by)
+        """
+        r_len_sq = reflect_by.x ** 2 + reflect_by.y ** 2
+        scale = 2 * (self.__x * reflect_by.x + self.__y * reflect_by.y) / r_len_sq
+
+        self.xy = reflect_by.x * scale - self.__x, reflect_by.y * scale - self.__y
         return self
 
     # maths
-    def __add__(self, other):
-        if issubclass(type(other), Vec2):
-            return Vec2.from_cartesian(x=self.x + other.x, y=self.y + other.y)
+    def __add__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            return Vec2(self.__x + other.x, self.__y + other.y)
 
-        return Vec2.from_cartesian(x=self.x + other, y=self.y + other)
+        return Vec2(self.__x + other, self.__y + other)
 
-    def __sub__(self, other):
-        if issubclass(type(other), Vec2):
-            return Vec2.from_cartesian(x=self.x - other.x, y=self.y - other.y)
+    def __sub__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            return Vec2(self.__x - other.x, self.__y - other.y)
 
-        return Vec2.from_cartesian(x=self.x - other, y=self.y - other)
+        return Vec2(self.__x - other, self.__y - other)
 
-    def __mul__(self, other):
-        if issubclass(type(other), Vec2):
-            return Vec2.from_polar(angle=self.angle + other.angle, length=self.length * other.length)
+    def __mul__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            # rotate and scale (like complex numbers)
+            return Vec2(
+                self.__x * other.x - self.__y * other.y,
+                self.__x * other.y + self.__y * other.x,
+            )
 
-        return Vec2.from_polar(angle=self.angle, length=self.length * other)
+        return Vec2(self.__x * other, self.__y * other)
 
-    def __truediv__(self, other):
-        if issubclass(type(other), Vec2):
-            return Vec2.from_cartesian(x=self.x / other, y=self.y / other)
+    def __truediv__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            # inverse of __mul__
+            d = other.x ** 2 + other.y ** 2
+            return Vec2(
+                (self.__x * other.x + self.__y * other.y) / d,
+                (self.__y * other.x - self.__x * other.y) / d,
+            )
 
-        return Vec2.from_polar(angle=self.angle, length=self.length / other)
+        return Vec2(self.__x / other, self.__y / other)
 
-    # internal functions
-    def __update(self, calc_from):
-        """
-        :param calc_from: polar (p) | cartesian (c)
-        """
-        if calc_from in ("p", "polar"):
-            self.__x = np.cos(self.angle) * self.length
-            self.__y = np.sin(self.angle) * self.length
+    def __neg__(self) -> "Vec2":
+        return Vec2(-self.__x, -self.__y)
+
+    # in-place maths, don't allocate a new vector
+    def __iadd__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            self.xy = self.__x + other.x, self.__y + other.y
 
-        elif calc_from in ("c", "cartesian"):
-            self.__length = np.sqrt(self.x**2 + self.y**2)
-            if not self.x == self.y == 0:
-                self.__angle = np.arctan2(self.y, self.x)
+        else:
+            self.xy = self.__x + other, self.__y + other
+
+        return self
+
+    def __isub__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            self.xy = self.__x - other.x, self.__y - other.y
 
         else:
-            raise ValueError("Invalid value for \"calc_from\"")
+            self.xy = self.__x - other, self.__y - other
 
-    def __abs__(self):
-        return np.sqrt(self.x**2 + self.y**2)
+        return self
 
-    def __repr__(self):
+    def __imul__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            return self.__set(self * other)
+
+        self.__x *= other
+        self.__y *= other
+        if self.__length is not None:
+            self.__length *= abs(other)
+
+        if other < 0:
+            self.__angle = None
+
+        return self
+
+    def __itruediv__(self, other: tp.Union["Vec2", float]) -> "Vec2":
+        if isinstance(other, Vec2):
+            return self.__set(self / other)
+
+        return self.__imul__(1 / other)
+
+    # internal functions
+    def __set(self, other: "Vec2") -> "Vec2":
+        self.xy = other.xy
+        return self
+
+    def __invalidate(self) -> None:
+        """
+        the cartesian values changed, polar values need to be recalculated.
+        (a zero vector keeps its last angle)
+        """
+        self.__length = None
+        if not self.__x == self.__y == 0:
+            self.__angle = None
+
+    def __abs__(self) -> float:
+        return self.length
+
+    def __repr__(self) -> str:
         return f"<\n" \
                f"\tVec2:\n" \
                f"\tx:{self.x}\ty:{self.y}\n" \
@@ -181,14 +261,11 @@ class Vec2:
     # static methods.
     # creation of new instances
     @staticmethod
-    def from_cartesian(x, y) -> "Vec2":
-        p = Vec2()
-        p.xy = x, y
-
-        return p
+    def from_cartesian(x: float, y: float) -> "Vec2":
+        return Vec2(x, y)
 
     @staticmethod
-    def from_polar(angle, length) -> "Vec2":
+    def from_polar(angle: float, length: float) -> "Vec2":
         p = Vec2()
         p.polar = angle, length
 
@@ -207,10 +284,4 @@ class Vec2:
 
     @staticmethod
     def normalize_angle(value: float) -> float:
-        while value > 2 * np.pi:
-            value -= 2 * np.pi
-
-        while value < -2 * np.pi:
-            value += 2 * np.pi
-
-        return value
\ No newline at end of file
+        return math.fmod(value, 2 * math.pi)
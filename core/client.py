@@ -12,8 +12,14 @@ Date:   29.06.2022
 #                                Import Modules                                #
 ################################################################################
 
+from core.framing import FrameDecoder, FrameError, FrameKind, encode_frame, READ_SIZE
+from core.snapshot import Snapshot, SnapshotDecoder, SnapshotError, MissingBaseline, FORMATS
+from core.interpolation import InterpolationBuffer
+from core.clocksync import ClockSync, ClockSample
+from core.mapcache import MapCache, MapError, decompress_map, map_hash, MAP_CACHE
 from core.debug import debug, all_callables
-from threading import Thread
+from collections import deque
+from threading import Thread, Lock, Event
 from time import time
 import socket
 import json
@@ -42,20 +48,49 @@ class NotReceivedJet(Exception):
 
 @all_callables(debug)
 class Client(socket.socket):
-    __received_msg: list[dict]
-    __ping_trigger: int
+    __received_msg: deque[dict]
+    __latest_snapshot: dict | None
+    __inbox_lock: Lock
+    snapshots_received: int
+    snapshots_superseded: int
+    messages_dropped: int
+    clock: ClockSync
+    ping_interval: float
+    __pong: Event
+    __ping_t0: float | None
+    __last_sample: ClockSample | None
+    __stopped: Event
+    __snapshots: SnapshotDecoder
+    interpolation: InterpolationBuffer
+    __send_lock: Lock
+    snapshot_format: str
     debug_mode: int
     __running: bool
     __game_map: dict
+    map_id: str | None
+    __maps: MapCache | None
     __ID: str
 
-    def __init__(self, server_ip: str, port: int, debug_mode: int | None = 0) -> None:
+    def __init__(
+            self,
+            server_ip: str,
+            port: int,
+            debug_mode: int | None = 0,
+            formats: tuple[str, ...] | None = FORMATS,
+            max_messages: int | None = 256,
+            ping_interval: float | None = 1,
+            map_cache: str | None = MAP_CACHE,
+    ) -> None:
         """
         Client for communicating between game calculating and game GUI
 
         :param server_ip: IP of the server
         :param port: Port
         :param debug_mode: 0 - NoDebug, 1 - OnlyImportantInformations, 2 - LightDebug, 3 - FullDebug
+        :param formats: Supported snapshot formats ("binary", "json"), the server picks one
+        :param max_messages: Maximum number of unread messages (not counting snapshots)
+        :param ping_interval: Seconds between the pings synchronizing the clock with the server
+        :param map_cache: Directory to cache received maps in, None for no caching
         """
         super().__init__(socket.AF_INET, socket.SOCK_STREAM)
         self.debug_mode = debug_mode
@@ -68,14 +103,39 @@ class Client(socket.socket):
         self._print()
         self._print(f"<<<<<<<<<<<<<<<<<<<<>>>>>>>>>>>>>>>>>>>>")
 
-        self.__received_msg = []
-        self.__ping_trigger = 0
+        self.__received_msg = deque(maxlen=max_messages)
+        self.__latest_snapshot = None
+        self.__inbox_lock = Lock()
+        self.snapshots_received = 0
+        self.snapshots_superseded = 0
+        self.messages_dropped = 0
+        self.clock = ClockSync()
+        self.ping_interval = ping_interval
+        self.__pong = Event()
+        self.__ping_t0 = None
+        self.__last_sample = None
+        self.__stopped = Event()
         self.__running = True
         self.__game_map = {}
+        self.map_id = None
+        self.__maps = None
+        if map_cache is not None:
+            try:
+                self.__maps = MapCache(map_cache)
+
+            except OSError as error:
+                self._print(f"Map cache not available: {error}")
         self.__ID = ""
+        self.snapshot_format = "json"
+        self.__snapshots = SnapshotDecoder()
+        self.interpolation = InterpolationBuffer()
+        self.__send_lock = Lock()
 
         self.connect((server_ip, port))
         Thread(target=self.__receive, args=()).start()
+        maps = self.__maps.hashes if self.__maps is not None else []
+        self.send_msg({"formats": list(formats), "maps": maps}, "hello")
+        Thread(target=self.__pinger, args=(), daemon=True).start()
 
     @property
     def game_map(self) -> dict:
@@ -89,70 +149,199 @@ class Client(socket.socket):
             return self.__ID
         raise NotReceivedJet("Server haven't sent a ID or it's just empty")
 
+    @property
+    def rtt(self) -> float:
+        """
+        Median round trip time to the server in seconds (nan before the first pong)
+        """
+        return self.clock.rtt
+
+    @property
+    def jitter(self) -> float:
+        return self.clock.jitter
+
+    @property
+    def clock_offset(self) -> float:
+        """
+        Server time - local time in seconds
+        """
+        return self.clock.offset
+
+    def server_time(self, local_time: float | None = None) -> float:
+        """
+        Converts a local time (default: now) to the server clock
+        """
+        return self.clock.peer_time(time() if local_time is None else local_time)
+
     @property
     def received_msg(self) -> dict | None:
         """
-        Returns the oldest received message and deletes it's caching
+        Returns the oldest received message and deletes it's caching,
+        if there are none the newest snapshot (older ones are skipped)
         :return: Dictonary of the message or none if there is no new messages
         """
         try:
-            rec_data = self.__received_msg[0]
-            del self.__received_msg[0]
-            return rec_data
+            return self.__received_msg.popleft()
 
         except IndexError:
-            return None
+            return self.latest_snapshot
+
+    @property
+    def latest_snapshot(self) -> dict | None:
+        """
+        Returns the newest snapshot (only once)
+        :return: Dictonary of the snapshot or none if there is no new one
+        """
+        with self.__inbox_lock:
+            snapshot = self.__latest_snapshot
+            self.__latest_snapshot = None
+
+        return snapshot
+
+    def __store_message(self, msg: dict) -> None:
+        if len(self.__received_msg) == self.__received_msg.maxlen:
+            self.messages_dropped += 1
+
+        self.__received_msg.append(msg)
+
+    def __store_snapshot(self, snapshot: dict) -> None:
+        with self.__inbox_lock:
+            if self.__latest_snapshot is not None:
+                self.snapshots_superseded += 1
+
+            self.__latest_snapshot = snapshot
+            self.snapshots_received += 1
 
     def __receive(self) -> None:
         """
         Receives messages from the server in packages and saves them
         """
-        recv: bool = False
-        data = bytearray()
+        decoder = FrameDecoder()
 
         while self.__running:
             try:
-                msg_byte = self.recv(1)
-                if not recv and msg_byte == b'@':
-                    recv = True
-
-                elif recv and msg_byte != b"#":
-                    data.extend(msg_byte)
-
-                elif recv:
-                    msg_str = data.decode(ENCRYPTION)
-                    msg = json.loads(msg_str)
-                    recv = False
-                    data = bytearray()
-
-                    msg_content = msg["content"]
-                    match msg["type"]:
-                        case "msg":
-                            self._print("GOT MSG", msg_content, min_debug=2)
-                            self.__received_msg.append(msg_content)
-                        case "ID":
-                            self._print("GOT ID", msg_content)
-                            self.__ID = msg_content
-                        case "map":
-                            self._print("GOT MAP", msg_content)
-                            self.__game_map = msg_content
-                        case "PONG":
-                            self._print("GOT PONGED", msg_content, min_debug=2)
-                            self.__ping_trigger = 0
-                        case "_":
-                            raise NotImplementedError("Invalid message received with type={msg['type']}")
-
-            except (ConnectionResetError, socket.timeout):
-                continue
+                data = self.recv(READ_SIZE)
 
-            except json.decoder.JSONDecodeError:
-                self._print("Failed receiving message: JSONDecodeError")
+            except socket.timeout:
                 continue
 
-            except ConnectionAbortedError:
+            except OSError:
                 self._print("Connection closed")
                 return
 
+            if data == b"":
+                self._print("Connection closed")
+                return
+
+            received = time()
+            try:
+                frames = decoder.feed(data)
+
+            except FrameError as error:
+                self._print(f"Failed receiving message: {error}")
+                return
+
+            for frame in frames:
+                try:
+                    match frame.kind:
+                        case FrameKind.JSON:
+                            self.__handle_message(json.loads(str(frame.payload, ENCRYPTION)), received)
+
+                        case FrameKind.SNAPSHOT:
+                            snapshot = self.__snapshots.decode(frame.payload)
+                            self._print("GOT SNAPSHOT", len(snapshot), min_debug=3)
+                            self.interpolation.push(snapshot)
+                            self.__store_snapshot(snapshot.to_dict())
+                            self.send_msg({"sequence": self.__snapshots.sequence}, "ack")
+
+                        case FrameKind.MAP:
+                            self.__receive_map(bytes(frame.payload))
+
+                except json.decoder.JSONDecodeError:
+                    self._print("Failed receiving message: JSONDecodeError")
+                    continue
+
+                except MissingBaseline as error:
+                    # ask for a keyframe
+                    self._print(f"Failed receiving message: {error}", min_debug=2)
+                    self.send_msg({"sequence": None}, "ack")
+                    continue
+
+                except (SnapshotError, MapError) as error:
+                    self._print(f"Failed receiving message: {error}")
+                    continue
+
+    def __handle_message(self, msg: dict, received: float) -> None:
+        """
+        Handles a single message received from the server
+
+        :param msg: decoded message
+        :param received: time the message was received at
+        """
+        msg_content = msg["content"]
+        match msg["type"]:
+            case "msg":
+                self._print("GOT MSG", msg_content, min_debug=2)
+                if isinstance(msg_content, dict) and "balls" in msg_content:
+                    self.interpolation.push(Snapshot.from_dict(msg_content))
+                    self.__store_snapshot(msg_content)
+
+                else:
+                    self.__store_message(msg_content)
+            case "ID":
+                self._print("GOT ID", msg_content)
+                self.__ID = msg_content
+            case "map":
+                self._print("GOT MAP", msg_content)
+                self.map_id = map_hash(msg_content)
+                self.__game_map = msg_content
+            case "map_hash":
+                game_map = self.__maps.get(msg_content) if self.__maps is not None else None
+                if game_map is None:
+                    # not cached (anymore)
+                    self._print("MAP NOT CACHED", msg_content)
+                    self.send_msg({"hash": msg_content}, "get_map")
+
+                else:
+                    self._print("GOT CACHED MAP", msg_content)
+                    self.map_id = msg_content
+                    self.__game_map = game_map
+            case "PING":
+                try:
+                    self.send_msg(ClockSync.reply(msg_content, received, time()), "PONG")
+
+                except OSError:
+                    return
+            case "PONG":
+                self._print("GOT PONGED", msg_content, min_debug=2)
+                sample = self.clock.response(msg_content, received)
+                if sample is not None:
+                    self.interpolation.clock_offset = self.clock.offset
+
+                    # only the answer to ping() itself, not to the background pings
+                    if msg_content["t0"] == self.__ping_t0:
+                        self.__last_sample = sample
+                        self.__pong.set()
+            case "hello":
+                self._print("SNAPSHOT FORMAT", msg_content["format"])
+                self.snapshot_format = msg_content["format"]
+            case _:
+                self._print(f"Invalid message received with type={msg['type']}")
+
+    def __receive_map(self, data: bytes) -> None:
+        """
+        Loads a compressed map and caches it
+        """
+        if self.__maps is not None:
+            map_id, game_map = self.__maps.put(data)
+
+        else:
+            map_id, game_map = decompress_map(data)
+
+        self._print("GOT MAP", map_id, f"({len(data)} bytes)")
+        self.map_id = map_id
+        self.__game_map = game_map
+
     def send_msg(self, msg: dict, msg_type: str | None = "shoot") -> None:
         """
         Send a message to the server
@@ -162,9 +351,10 @@ class Client(socket.socket):
         """
         msg_dict = {"type": msg_type, "content": msg, "time": time()}
         msg_str = json.dumps(msg_dict)
-        msg_byte = msg_str.encode(ENCRYPTION)
+        msg_byte = encode_frame(msg_str.encode(ENCRYPTION), FrameKind.JSON)
 
-        self.send(msg_byte)
+        with self.__send_lock:
+            self.sendall(msg_byte)
 
     def shoot(self, msg: dict) -> None:
         """
@@ -182,23 +372,34 @@ class Client(socket.socket):
 
     def ping(self, timeout: float | None = 1) -> int:
         """
-        Returns the ping
+        Pings the server now and waits for the answer
 
         :param timeout: Timeout in seconds
         :return: Ping in milliseconds
         """
+        request = self.clock.request(time())
+        self.__pong.clear()
+        self.__ping_t0 = request["t0"]
+        self.send_msg(request, "PING")
 
-        self.send_msg({}, "PING")
-        self.__ping_trigger = 1
-        time_start = time()
+        if not self.__pong.wait(timeout):
+            raise TimeoutError("Ping-Pong was not sucessfull in time")
 
-        while self.__ping_trigger == 1:
-            if time()-time_start > timeout:
-                raise TimeoutError("Ping-Pong was not sucessfull in time")
-        ping: int = int((time()-time_start)*1000)
+        ping: int = int(self.__last_sample.rtt*1000)
         self._print(f"PING: {ping}")
         return ping
 
+    def __pinger(self) -> None:
+        """
+        Pings the server in the background to keep the clock synchronized
+        """
+        while not self.__stopped.wait(self.ping_interval):
+            try:
+                self.send_msg(self.clock.request(time()), "PING")
+
+            except OSError:
+                return
+
     def _print(self, *msg: any, min_debug: int | None = 1) -> None:
         """
         Only print if debug mode is on
@@ -214,6 +415,15 @@ class Client(socket.socket):
         End the Communication-Thread and close the connection
         """
         self.__running = False
+        self.__stopped.set()
+
+        # wakes up the receiving thread (close alone doesn't)
+        try:
+            self.shutdown(socket.SHUT_RDWR)
+
+        except OSError:
+            pass
+
         self.close()
 
 
@@ -222,7 +432,7 @@ if __name__ == "__main__":
     print("\n>>> Client - CMD - Control <<<")
     print("Commands: ")
     print(" - send_data(msg)    |   Send a message to the server")
-    print(" - received_msg      |   Returns the oldest received message")
+    print(" - received_msg      |   Returns the oldest received message (or the newest snapshot)")
     while True:
         cmd_input = input(">>> ")
         exec(f"cl.{cmd_input}")
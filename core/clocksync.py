@@ -0,0 +1,162 @@
+"""
+core/clocksync.py
+
+round trip time and clock offset estimation, NTP style.
+
+a ping carries the time it was sent (t0), the peer answers with the
+time it received it (t1) and the time it answered (t2), the pong
+arrives at t3. from the last samples in a sliding window the one with
+the lowest round trip time gives the best offset, since it had the
+least (asymmetric) queueing delay
+
+Author:
+Nilusink
+"""
+from collections import deque
+from threading import Lock
+import typing as tp
+import math
+
+
+class ClockSample(tp.NamedTuple):
+    rtt: float      # round trip time without the peers processing time
+    offset: float   # peer clock - own clock
+    time: float     # own time the sample was taken at
+
+
+class ClockSync:
+    window: int
+    samples: int    # number of samples taken
+    lost: int       # pings that weren't answered (or answered too late)
+
+    def __init__(self, window: int = 16, max_pending: int = 8) -> None:
+        """
+        :param window: number of samples the stats are calculated from
+        :param max_pending: number of unanswered pings remembered
+        """
+        self.window = window
+        self.samples = 0
+        self.lost = 0
+
+        self._samples: deque[ClockSample] = deque(maxlen=window)
+        self._pending: deque[float] = deque(maxlen=max_pending)
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def request(self, now: float) -> dict:
+        """
+        content of a ping sent now
+        """
+        with self._lock:
+            if len(self._pending) == self._pending.maxlen:
+                self.lost += 1
+
+            self._pending.append(now)
+
+        return {"t0": now}
+
+    @staticmethod
+    def reply(request: dict, received: float, now: float) -> dict:
+        """
+        content of the pong to a ping
+
+        :param received: time the ping was received at
+        :param now: time the pong is sent at
+        """
+        return {"t0": request.get("t0"), "t1": received, "t2": now}
+
+    def response(self, reply: dict, now: float) -> ClockSample | None:
+        """
+        add the sample of a received pong
+
+        :param now: time the pong was received at
+        :return: the new sample, None if the ping wasn't sent (or is too old)
+        """
+        if reply.get("t0") is None:
+            return None
+
+        t0, t1, t2 = float(reply["t0"]), float(reply["t1"]), float(reply["t2"])
+
+        with self._lock:
+            if t0 not in self._pending:
+                return None
+
+            # older pings won't be answered anymore
+            while self._pending[0] != t0:
+                self._pending.popleft()
+                self.lost += 1
+
+            self._pending.popleft()
+
+            sample = ClockSample(
+                rtt=max((now - t0) - (t2 - t1), 0),
+                offset=((t1 - t0) + (t2 - now)) / 2,
+                time=now,
+            )
+            self._samples.append(sample)
+            self.samples += 1
+
+        return sample
+
+    @property
+    def synchronized(self) -> bool:
+        return bool(self._samples)
+
+    @property
+    def rtt(self) -> float:
+        """
+        median round trip time in seconds (nan without samples)
+        """
+        rtts = sorted(sample.rtt for sample in self._samples)
+        if not rtts:
+            return math.nan
+
+        middle = len(rtts) // 2
+        return rtts[middle] if len(rtts) % 2 else (rtts[middle - 1] + rtts[middle]) / 2
+
+    @property
+    def min_rtt(self) -> float:
+        return min((sample.rtt for sample in self._samples), default=math.nan)
+
+    @property
+    def jitter(self) -> float:
+        """
+        mean difference between consecutive round trip times
+        """
+        samples = list(self._samples)
+        if len(samples) < 2:
+            return 0. if samples else math.nan
+
+        return sum(abs(b.rtt - a.rtt) for a, b in zip(samples, samples[1:])) / (len(samples) - 1)
+
+    @property
+    def offset(self) -> float:
+        """
+        peer clock - own clock (0 without samples)
+        """
+        best = min(self._samples, key=lambda sample: sample.rtt, default=None)
+        return 0. if best is None else best.offset
+
+    def peer_time(self, now: float) -> float:
+        """
+        convert an own time to the peers clock
+        """
+        return now + self.offset
+
+    def local_time(self, peer_time: float) -> float:
+        """
+        convert a time of the peer to the own clock
+        """
+        return peer_time - self.offset
+
+    def stats(self) -> dict[str, float | int]:
+        return {
+            "rtt": self.rtt,
+            "min_rtt": self.min_rtt,
+            "jitter": self.jitter,
+            "offset": self.offset,
+            "samples": self.samples,
+            "lost": self.lost,
+        }
@@ -0,0 +1,366 @@
+"""
+core/collision.py
+
+geometric collision tests between balls (circles) and walls,
+everything is calculated in map units (x: 0..2, y: 0..1)
+
+Author:
+Nilusink
+"""
+from dataclasses import dataclass
+from .classes import Vec2
+import math
+
+
+@dataclass(frozen=True)
+class Contact:
+    """
+    result of a collision test
+    """
+    point: Vec2     # closest point on the wall
+    normal: Vec2    # unit vector pointing from the wall towards the ball
+    depth: float    # how far the ball reaches into the wall
+
+    @property
+    def tangent(self) -> Vec2:
+        """
+        direction of the wall surface at the contact point
+        """
+        return Vec2.from_cartesian(-self.normal.y, self.normal.x)
+
+
+def _contact(
+        cx: float,
+        cy: float,
+        radius: float,
+        px: float,
+        py: float,
+        fallback_normal: tuple[float, float],
+) -> Contact | None:
+    """
+    build a contact from a circle and the closest point on a wall
+
+    :param fallback_normal: used if the circle center lies exactly on the wall
+    """
+    dx = cx - px
+    dy = cy - py
+    dist_sq = dx * dx + dy * dy
+
+    if dist_sq >= radius * radius:
+        return None
+
+    dist = math.sqrt(dist_sq)
+    if dist > 0:
+        nx, ny = dx / dist, dy / dist
+
+    else:
+        nx, ny = fallback_normal
+
+    return Contact(
+        point=Vec2.from_cartesian(px, py),
+        normal=Vec2.from_cartesian(nx, ny),
+        depth=radius - dist,
+    )
+
+
+def closest_point_on_segment(
+        px: float,
+        py: float,
+        x0: float,
+        y0: float,
+        x1: float,
+        y1: float,
+) -> tuple[float, float]:
+    """
+    closest point to (px, py) on the segment (x0, y0) -> (x1, y1)
+    """
+    sx = x1 - x0
+    sy = y1 - y0
+    len_sq = sx * sx + sy * sy
+
+    # zero length walls are handled like points
+    if len_sq == 0:
+        return x0, y0
+
+    t = ((px - x0) * sx + (py - y0) * sy) / len_sq
+    t = min(1., max(0., t))
+
+    return x0 + t * sx, y0 + t * sy
+
+
+def closest_point_on_ellipse(
+        px: float,
+        py: float,
+        a: float,
+        b: float,
+        iterations: int = 4,
+) -> tuple[float, float]:
+    """
+    closest point to (px, py) on the outline of an axis aligned ellipse
+    centered on (0, 0) with the half axes a and b
+
+    iterates along the evolute of the ellipse, a few iterations
+    are enough to get well below a pixel of error
+    """
+    if a == 0 or b == 0:
+        return (
+            min(a, max(-a, px)),
+            min(b, max(-b, py)),
+        )
+
+    qx0 = abs(px)
+    qy0 = abs(py)
+
+    tx = ty = math.sqrt(.5)
+    for _ in range(iterations):
+        x = a * tx
+        y = b * ty
+
+        ex = (a * a - b * b) * tx ** 3 / a
+        ey = (b * b - a * a) * ty ** 3 / b
+
+        r = math.hypot(x - ex, y - ey)
+        qx = qx0 - ex
+        qy = qy0 - ey
+        q = math.hypot(qx, qy)
+
+        if q == 0:
+            break
+
+        tx = min(1., max(0., (qx * r / q + ex) / a))
+        ty = min(1., max(0., (qy * r / q + ey) / b))
+        t = math.hypot(tx, ty)
+        tx /= t
+        ty /= t
+
+    return math.copysign(a * tx, px), math.copysign(b * ty, py)
+
+
+def circle_segment(
+        center: Vec2,
+        radius: float,
+        p0: Vec2,
+        p1: Vec2,
+) -> Contact | None:
+    """
+    check if a circle touches a line segment
+    """
+    cx, cy = center.xy
+    px, py = closest_point_on_segment(cx, cy, p0.x, p0.y, p1.x, p1.y)
+
+    # circle center on the segment: push out perpendicular to the wall
+    sx = p1.x - p0.x
+    sy = p1.y - p0.y
+    s_len = math.hypot(sx, sy)
+    fallback = (-sy / s_len, sx / s_len) if s_len > 0 else (0., -1.)
+
+    return _contact(cx, cy, radius, px, py, fallback)
+
+
+def circle_ellipse(
+        center: Vec2,
+        radius: float,
+        ellipse_center: Vec2,
+        a: float,
+        b: float,
+) -> Contact | None:
+    """
+    check if a circle touches the outline of an axis aligned ellipse
+
+    :param a: half width of the ellipse
+    :param b: half height of the ellipse
+    """
+    cx, cy = center.xy
+    ox, oy = ellipse_center.xy
+
+    lx, ly = closest_point_on_ellipse(cx - ox, cy - oy, a, b)
+
+    # circle center on the outline: push out along the ellipse gradient
+    gx = lx / (a * a) if a else 0.
+    gy = ly / (b * b) if b else 0.
+    g_len = math.hypot(gx, gy)
+    fallback = (gx / g_len, gy / g_len) if g_len > 0 else (0., -1.)
+
+    return _contact(cx, cy, radius, lx + ox, ly + oy, fallback)
+
+
+def _first_approach(
+        direction: Vec2,
+        contact: Contact | None,
+) -> tuple[float, Contact] | None:
+    """
+    an overlap at the start of a sweep only counts if the circle moves into the wall
+    """
+    if contact is None:
+        return None
+
+    if direction.x * contact.normal.x + direction.y * contact.normal.y < 0:
+        return 0., contact
+
+    return None
+
+
+def sweep_circle_segment(
+        center: Vec2,
+        radius: float,
+        direction: Vec2,
+        distance: float,
+        p0: Vec2,
+        p1: Vec2,
+) -> tuple[float, Contact] | None:
+    """
+    move a circle along a straight line and find the first contact with a segment
+
+    :param direction: unit vector the circle moves along
+    :param distance: how far the circle moves
+    :return: travelled distance until the contact and the contact itself
+    """
+    cx, cy = center.xy
+    dx, dy = direction.xy
+    x0, y0 = p0.xy
+    x1, y1 = p1.xy
+
+    # already touching
+    static = circle_segment(center, radius, p0, p1)
+    if static is not None:
+        return _first_approach(direction, static)
+
+    best = math.inf
+
+    # the flat sides of the (segment + radius) capsule
+    sx = x1 - x0
+    sy = y1 - y0
+    s_len = math.hypot(sx, sy)
+    if s_len > 0:
+        nx = -sy / s_len
+        ny = sx / s_len
+
+        h = (cx - x0) * nx + (cy - y0) * ny
+        side = 1 if h > 0 else -1
+        approach = (dx * nx + dy * ny) * side
+
+        # closer to the line than the radius (but not touching) means
+        # the circle is next to an end, the round ends handle that
+        if approach < 0 and abs(h) >= radius:
+            t = (abs(h) - radius) / -approach
+
+            # does the circle hit the segment or the line next to it
+            u = ((cx + dx * t - x0) * sx + (cy + dy * t - y0) * sy) / (s_len * s_len)
+            if 0 <= u <= 1:
+                best = t
+
+    # the round ends of the capsule
+    for px, py in ((x0, y0), (x1, y1)):
+        mx = cx - px
+        my = cy - py
+        b = mx * dx + my * dy
+        c = mx * mx + my * my - radius * radius
+
+        if b >= 0:
+            continue
+
+        disc = b * b - c
+        if disc < 0:
+            continue
+
+        best = min(best, -b - math.sqrt(disc))
+
+    if best > distance:
+        return None
+
+    best = max(best, 0.)
+    hit_x = cx + dx * best
+    hit_y = cy + dy * best
+    px, py = closest_point_on_segment(hit_x, hit_y, x0, y0, x1, y1)
+
+    n_len = math.hypot(hit_x - px, hit_y - py)
+    if n_len == 0:
+        return None
+
+    return best, Contact(
+        point=Vec2.from_cartesian(px, py),
+        normal=Vec2.from_cartesian((hit_x - px) / n_len, (hit_y - py) / n_len),
+        depth=0.,
+    )
+
+
+def sweep_circle_ellipse(
+        center: Vec2,
+        radius: float,
+        direction: Vec2,
+        distance: float,
+        ellipse_center: Vec2,
+        a: float,
+        b: float,
+        tolerance: float = 1e-7,
+        max_iterations: int = 32,
+) -> tuple[float, Contact] | None:
+    """
+    move a circle along a straight line and find the first contact with
+    the outline of an ellipse.
+
+    the offset curve of an ellipse has no simple closed form, so this
+    advances the circle by its distance to the outline until it touches
+    (conservative advancement). a circle moving (almost) along the outline
+    may not converge, it then stops at the last safe distance
+
+    :return: travelled distance until the contact and the contact itself
+    """
+    cx, cy = center.xy
+    dx, dy = direction.xy
+    ox, oy = ellipse_center.xy
+
+    # already touching
+    static = circle_ellipse(center, radius, ellipse_center, a, b)
+    if static is not None:
+        first = _first_approach(direction, static)
+        if first is not None:
+            return first
+
+    def contact_at(t: float) -> tuple[float, Contact | None]:
+        """
+        gap between the circle and the outline and the contact if it moves towards it
+        """
+        hit_x = cx + dx * t
+        hit_y = cy + dy * t
+
+        lx, ly = closest_point_on_ellipse(hit_x - ox, hit_y - oy, a, b)
+        gap_x = hit_x - ox - lx
+        gap_y = hit_y - oy - ly
+        dist = math.hypot(gap_x, gap_y)
+        if dist == 0:
+            return dist - radius, None
+
+        nx = gap_x / dist
+        ny = gap_y / dist
+        if dx * nx + dy * ny >= 0:
+            return dist - radius, None
+
+        return dist - radius, Contact(
+            point=Vec2.from_cartesian(lx + ox, ly + oy),
+            normal=Vec2.from_cartesian(nx, ny),
+            depth=0.,
+        )
+
+    t = 0.
+    for _ in range(max_iterations):
+        gap, contact = contact_at(t)
+
+        if gap <= tolerance:
+            if contact is not None:
+                return t, contact
+
+            # touching but moving away, slide along
+            gap = radius
+
+        if t + max(gap, tolerance) > distance:
+            return None
+
+        t += max(gap, tolerance)
+
+    # not converged: the circle is still approaching, stop where it is
+    _gap, contact = contact_at(t)
+    if contact is not None:
+        return t, contact
+
+    return None
@@ -0,0 +1,214 @@
+"""
+core/connection.py
+
+server side state of a single client connection with its outbound queue.
+
+control messages (id, map, pong, ...) are queued in order and never
+dropped, snapshots use a single slot where the newest one wins: a client
+that can't keep up skips snapshots instead of delaying everyone else.
+the queue is drained by its own task, so a slow client only blocks itself.
+
+a connection goes through CONNECTING (until the hello), ACTIVE, CLOSING
+(closed by the server, e.g. too slow or no heartbeat) and CLOSED
+
+Author:
+Nilusink
+"""
+from .clocksync import ClockSync
+from collections import deque
+from enum import Enum
+import asyncio
+
+
+class QueueFull(Exception):
+    """
+    too many control messages are waiting for a client
+    """
+
+
+class ConnectionState(Enum):
+    CONNECTING = "connecting"   # connected, waiting for the hello
+    ACTIVE = "active"
+    CLOSING = "closing"         # closed by the server, the peer may not know yet
+    CLOSED = "closed"
+
+
+class Connection:
+    user_id: str
+    state: ConnectionState
+    last_seen: float        # loop time data was last received at
+    writer: asyncio.StreamWriter
+    format: str             # negotiated snapshot format
+    ack: int | None         # last acknowledged snapshot
+    keyframe: int | None    # sequence of the last keyframe sent
+    max_queue: int
+    max_lag: float
+    clock: ClockSync        # round trip time and clock offset of the client
+    maps: set[str]          # hashes of the maps the client has
+
+    sent: int               # number of written messages
+    sent_bytes: int
+    dropped: int            # snapshots replaced before they were sent
+
+    def __init__(
+            self,
+            user_id: str,
+            writer: asyncio.StreamWriter,
+            max_queue: int = 64,
+            max_lag: float = 5,
+            write_buffer: int = 1 << 16,
+    ) -> None:
+        """
+        :param max_queue: maximum number of queued control messages
+        :param max_lag: seconds a client may be unable to receive before it gets disconnected
+        :param write_buffer: bytes buffered by the transport before writing waits
+        """
+        self.user_id = user_id
+        self.writer = writer
+        self.state = ConnectionState.CONNECTING
+        self.last_seen = asyncio.get_running_loop().time()
+        self.format = "json"
+        self.ack = None
+        self.keyframe = None
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.clock = ClockSync()
+        self.maps = set()
+
+        self.sent = 0
+        self.sent_bytes = 0
+        self.dropped = 0
+
+        self._control: deque[bytes] = deque()
+        self._snapshot: bytes | None = None
+        self._wakeup = asyncio.Event()
+        self._stalled_since: float | None = None
+
+        writer.transport.set_write_buffer_limits(high=write_buffer)
+
+    @property
+    def closed(self) -> bool:
+        return self.state in (ConnectionState.CLOSING, ConnectionState.CLOSED) or self.writer.is_closing()
+
+    @property
+    def idle(self) -> float:
+        """
+        seconds since anything was received
+        """
+        return asyncio.get_running_loop().time() - self.last_seen
+
+    def seen(self) -> None:
+        """
+        data was received, the peer is alive
+        """
+        self.last_seen = asyncio.get_running_loop().time()
+
+    @property
+    def queued(self) -> int:
+        return len(self._control) + (self._snapshot is not None)
+
+    @property
+    def stats(self) -> dict[str, float | int]:
+        return {
+            **self.clock.stats(),
+            "sent": self.sent,
+            "sent_bytes": self.sent_bytes,
+            "dropped": self.dropped,
+            "queued": self.queued,
+        }
+
+    @property
+    def lag(self) -> float:
+        """
+        seconds the client hasn't been able to take any data
+        """
+        if self._stalled_since is None:
+            return 0
+
+        return asyncio.get_running_loop().time() - self._stalled_since
+
+    def send(self, data: bytes) -> None:
+        """
+        queue a control message
+
+        :raises QueueFull: if the client doesn't receive its messages
+        """
+        if self.closed:
+            return
+
+        if len(self._control) >= self.max_queue:
+            raise QueueFull(f"{len(self._control)} messages queued")
+
+        self._control.append(data)
+        self._wakeup.set()
+
+    def send_snapshot(self, data: bytes) -> None:
+        """
+        queue a snapshot, replaces a snapshot that wasn't sent yet
+
+        :raises TimeoutError: if the client lags more than max_lag seconds
+        """
+        if self.closed:
+            return
+
+        if self.lag > self.max_lag:
+            raise TimeoutError(f"client lags {self.lag:.1f} seconds behind")
+
+        if self._snapshot is not None:
+            self.dropped += 1
+
+        self._snapshot = data
+        self._wakeup.set()
+
+    async def run_sender(self) -> None:
+        """
+        write the queued messages until the connection closes
+        """
+        writer = self.writer
+        loop = asyncio.get_running_loop()
+
+        while not writer.is_closing():
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while self._control or self._snapshot is not None:
+                if self._control:
+                    data = self._control.popleft()
+
+                else:
+                    data = self._snapshot
+                    self._snapshot = None
+
+                writer.write(data)
+                self.sent += 1
+                self.sent_bytes += len(data)
+
+                # wait while the transport buffer is full
+                self._stalled_since = loop.time()
+                try:
+                    await writer.drain()
+
+                except ConnectionError:
+                    return
+
+                finally:
+                    self._stalled_since = None
+
+    def close(self, abort: bool = False) -> None:
+        """
+        :param abort: drop unsent data and close the socket right away
+            (a dead peer would never take it)
+        """
+        if self.state != ConnectionState.CLOSED:
+            self.state = ConnectionState.CLOSED if abort else ConnectionState.CLOSING
+
+        self._control.clear()
+        self._snapshot = None
+
+        if abort:
+            self.writer.transport.abort()
+
+        else:
+            self.writer.close()
+
+        self._wakeup.set()
@@ -0,0 +1,147 @@
+"""
+core/eventqueue.py
+
+bounded thread-safe queue for the events from the clients.
+
+producers never block (the network loop mustn't stall), consumers can
+block until events arrive and take them in batches. events can be
+indexed by a key (e.g. shots by user) to check for pending ones in O(1)
+
+Author:
+Nilusink
+"""
+from collections import deque
+from threading import Condition
+from time import monotonic
+import typing as tp
+
+
+T = tp.TypeVar("T")
+
+
+class EventQueueFull(Exception):
+    """
+    the consumer doesn't keep up with the events
+    """
+
+
+class EventQueue(tp.Generic[T]):
+    maxsize: int
+    dropped: int    # events rejected because the queue was full
+
+    def __init__(
+            self,
+            maxsize: int = 1024,
+            key: tp.Callable[[T], tp.Hashable | None] | None = None,
+    ) -> None:
+        """
+        :param maxsize: maximum number of pending events
+        :param key: index pending events by this key (None: not indexed)
+        """
+        self.maxsize = maxsize
+        self.dropped = 0
+
+        self._key = key
+        self._events: deque[T] = deque()
+        self._pending: dict[tp.Hashable, int] = {}
+        self._ready = Condition()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def put(self, event: T, force: bool = False) -> None:
+        """
+        add an event, never blocks
+
+        :param force: add it even if the queue is full (for events that
+            mustn't get lost, there have to be few of them)
+        :raises EventQueueFull: if maxsize events are pending
+        """
+        with self._ready:
+            if not force and len(self._events) >= self.maxsize:
+                self.dropped += 1
+                raise EventQueueFull(f"{len(self._events)} events pending")
+
+            self._events.append(event)
+
+            if self._key is not None:
+                key = self._key(event)
+                if key is not None:
+                    self._pending[key] = self._pending.get(key, 0) + 1
+
+            self._ready.notify()
+
+    def pending(self, key: tp.Hashable) -> bool:
+        """
+        if an event with this key is waiting
+        """
+        return key in self._pending
+
+    def _taken(self, event: T) -> None:
+        if self._key is None:
+            return
+
+        key = self._key(event)
+        if key is None:
+            return
+
+        count = self._pending[key] - 1
+        if count:
+            self._pending[key] = count
+
+        else:
+            del self._pending[key]
+
+    def _wait(self, timeout: float | None) -> bool:
+        """
+        wait until there are events (the condition has to be held)
+        """
+        if timeout is None:
+            while not self._events:
+                self._ready.wait()
+
+            return True
+
+        deadline = monotonic() + timeout
+        while not self._events:
+            remaining = deadline - monotonic()
+            if remaining <= 0:
+                return False
+
+            self._ready.wait(remaining)
+
+        return True
+
+    def get(self, timeout: float | None = None) -> T | None:
+        """
+        take the oldest event, waits for one if there is none
+
+        :param timeout: maximum time to wait in seconds (None: forever, 0: don't wait)
+        :return: the event or None on timeout
+        """
+        with self._ready:
+            if not self._wait(timeout):
+                return None
+
+            event = self._events.popleft()
+            self._taken(event)
+            return event
+
+    def drain(self, timeout: float | None = 0, max_events: int | None = None) -> list[T]:
+        """
+        take all pending events (up to max_events) at once
+
+        :param timeout: maximum time to wait for the first event (None: forever, 0: don't wait)
+        """
+        with self._ready:
+            if not self._wait(timeout):
+                return []
+
+            events = self._events
+            count = len(events) if max_events is None else min(max_events, len(events))
+
+            out = [events.popleft() for _ in range(count)]
+            for event in out:
+                self._taken(event)
+
+            return out
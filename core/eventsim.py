@@ -0,0 +1,296 @@
+"""
+core/eventsim.py
+
+event driven physics: balls roll in straight lines with constant
+deceleration between bounces, so the time of their next event (wall hit,
+leaving the field, coming to rest) can be calculated directly.
+instead of stepping every ball every tick, the simulation jumps from
+event to event. positions in between are calculated when requested
+(BallWorld.state_at)
+
+Author:
+Nilusink
+"""
+from threading import Condition
+from time import perf_counter
+from enum import Enum
+from .classes import Vec2
+import typing as tp
+import numpy as np
+import heapq
+import math
+
+
+if tp.TYPE_CHECKING:
+    from .objects import Ball, _Walls, _Targets
+    from .collision import Contact
+    from .world import BallWorld
+
+
+class EventKind(Enum):
+    WALL = "wall"       # bounce off a wall
+    LEAVE = "leave"     # left the field, gets reset
+    REST = "rest"       # came to rest (and maybe hit the target)
+
+
+class EventSimulation:
+    events_handled: int
+    now: float
+
+    def __init__(
+            self,
+            world: "BallWorld",
+            walls: "_Walls",
+            targets: "_Targets",
+            max_wait: float = .5,
+            publish_rate: float = 60,
+    ) -> None:
+        """
+        :param world: the balls to simulate, switched to event mode
+        :param max_wait: maximum time run() sleeps without checking running
+        :param publish_rate: how often run() publishes the world state per second
+        """
+        self.world = world
+        self.walls = walls
+        self.targets = targets
+        self.max_wait = max_wait
+        self.publish_rate = publish_rate
+
+        self.events_handled = 0
+        self.now = 0.
+
+        self.__start = perf_counter()
+        self.__queue: list[tuple[float, int, "Ball", int, EventKind, "Contact | None"]] = []
+        self.__versions: dict["Ball", int] = {}
+        self.__zero_bounces: dict["Ball", tuple[float, int]] = {}
+        self.__seq = 0
+        self.__wakeup = Condition()
+
+        with world.lock:
+            world.clock = self.time
+            world.start_times[:world.count] = self.time()
+            world.on_change = self.schedule
+
+            for ball in list(world.views):
+                self.schedule(ball)
+
+    def time(self) -> float:
+        """
+        current simulation time (seconds since the simulation started)
+        """
+        return perf_counter() - self.__start
+
+    @property
+    def next_event(self) -> float:
+        return self.__queue[0][0] if self.__queue else math.inf
+
+    # scheduling
+    def schedule(self, ball: "Ball") -> None:
+        """
+        (re-)calculate the next event of a ball, older events of it are dropped
+        """
+        world = self.world
+        with world.lock:
+            # removed from the world
+            if ball._index < 0:
+                self.__versions.pop(ball, None)
+                self.__zero_bounces.pop(ball, None)
+                return
+
+            version = abs(self.__versions.get(ball, 0)) + 1
+            self.__versions[ball] = version
+
+            index = ball._index
+            event = self._next_event(index)
+
+            if event is None:
+                world.end_times[index] = np.inf
+                self.__versions[ball] = -version    # nothing pending
+                return
+
+            time, kind, contact = event
+            world.end_times[index] = time
+
+            self.__seq += 1
+            heapq.heappush(self.__queue, (time, self.__seq, ball, version, kind, contact))
+
+        with self.__wakeup:
+            self.__wakeup.notify()
+
+    def _next_event(self, index: int) -> tuple[float, EventKind, "Contact | None"] | None:
+        """
+        calculate the first event on the current trajectory of a ball
+        """
+        world = self.world
+        if world.on_target[index]:
+            return None
+
+        vx, vy = world.velocities[index].tolist()
+        speed = math.hypot(vx, vy)
+        if speed == 0:
+            return None
+
+        px, py = world.positions[index].tolist()
+        start = float(world.start_times[index])
+        decel = world.deceleration
+        dx = vx / speed
+        dy = vy / speed
+
+        # come to rest
+        if decel > 0:
+            rest_distance = speed * speed / (2 * decel)
+
+        else:
+            rest_distance = math.inf
+
+        distance = rest_distance
+        kind = EventKind.REST
+        contact = None
+
+        # leave the field
+        exits = []
+        if dx > 0:
+            exits.append((2 - px) / dx)
+
+        elif dx < 0:
+            exits.append(-px / dx)
+
+        if dy > 0:
+            exits.append((1 - py) / dy)
+
+        elif dy < 0:
+            exits.append(-py / dy)
+
+        exit_distance = max(min(exits), 0)
+        if exit_distance < distance:
+            distance = exit_distance
+            kind = EventKind.LEAVE
+
+        # hit a wall
+        hit = self.walls.sweep_circle(
+            Vec2.from_cartesian(px + world.radius, py + world.radius),
+            world.radius,
+            Vec2.from_cartesian(dx, dy),
+            distance,
+        )
+        if hit is not None and hit[0] <= distance:
+            distance, _wall, contact = hit
+            kind = EventKind.WALL
+
+        return start + self._time_for(speed, distance), kind, contact
+
+    def _time_for(self, speed: float, distance: float) -> float:
+        """
+        time needed to travel a distance, starting at speed
+        """
+        decel = self.world.deceleration
+        if decel == 0:
+            return distance / speed
+
+        return (speed - math.sqrt(max(speed * speed - 2 * decel * distance, 0))) / decel
+
+    # simulation
+    def advance(self, until: float = ...) -> int:
+        """
+        handle all events up to a point in time
+
+        :param until: simulation time, defaults to now
+        :return: number of handled events
+        """
+        if until is ...:
+            until = self.time()
+
+        handled = 0
+        world = self.world
+        with world.lock:
+            while self.__queue and self.__queue[0][0] <= until:
+                time, _seq, ball, version, kind, contact = heapq.heappop(self.__queue)
+
+                # dropped event or removed ball
+                if self.__versions.get(ball) != version or ball._index < 0:
+                    continue
+
+                self.__versions[ball] = -version
+                self._handle(ball, time, kind, contact)
+                handled += 1
+
+            self.now = max(self.now, until)
+
+        self.events_handled += handled
+        return handled
+
+    def _handle(self, ball: "Ball", time: float, kind: EventKind, contact: "Contact | None") -> None:
+        world = self.world
+        index = ball._index
+
+        positions, velocities = world.state_at(time, index)
+
+        match kind:
+            case EventKind.LEAVE:
+                world.reset(index)
+                return
+
+            case EventKind.REST:
+                world.positions[index] = positions
+                world.velocities[index] = 0
+                world.start_times[index] = time
+                world.end_times[index] = np.inf
+
+                if self.targets.touching(positions + world.radius, world.radius).any():
+                    world.on_target[index] = True
+
+                    # user thinks it's still traveling
+                    world.velocities[index] = (1, 0)
+
+                return
+
+            case EventKind.WALL:
+                nx, ny = contact.normal.xy
+                vx, vy = velocities.tolist()
+
+                # bounce, move out of the wall if overlapping
+                dot = vx * nx + vy * ny
+                world.positions[index] = positions + (nx * contact.depth, ny * contact.depth)
+                world.velocities[index] = (vx - 2 * dot * nx, vy - 2 * dot * ny)
+                world.start_times[index] = time
+
+                # stuck in a corner (bouncing without moving)
+                if time == self.__zero_bounces.get(ball, (None, 0))[0]:
+                    count = self.__zero_bounces[ball][1] + 1
+
+                else:
+                    count = 0
+
+                self.__zero_bounces[ball] = (time, count)
+                if count >= world.max_bounces:
+                    world.velocities[index] = 0
+                    self.__zero_bounces.pop(ball)
+
+                self.schedule(ball)
+
+    def run(self, running: tp.Callable[[], bool] = ...) -> None:
+        """
+        handle events as they are due, sleeps in between
+        """
+        if running is ...:
+            def running() -> bool:
+                return True
+
+        interval = 1 / self.publish_rate
+        next_publish = self.time()
+
+        while running():
+            timeout = min(self.next_event, next_publish) - self.time()
+            timeout = min(timeout, self.max_wait)
+
+            if timeout > 0:
+                with self.__wakeup:
+                    self.__wakeup.wait(timeout)
+
+            now = self.time()
+            self.advance(now)
+
+            # publish the state in ticks of publish_rate
+            if now >= next_publish:
+                self.world.publish(int(now * self.publish_rate))
+                next_publish = max(next_publish + interval, now)
@@ -0,0 +1,128 @@
+"""
+core/framing.py
+
+length prefixed message framing, shared by the server and the client.
+
+every frame is a 4 byte payload length (big endian), a 1 byte kind and
+the payload. FrameDecoder splits a stream of received chunks into
+complete frames, no matter how the messages got merged or split
+
+Author:
+Nilusink
+"""
+from enum import IntEnum
+import typing as tp
+import struct
+
+
+HEADER = struct.Struct(">IB")   # payload length, kind
+MAX_FRAME_SIZE: int = 1 << 20   # 1 MiB, anything bigger is a broken stream
+READ_SIZE: int = 1 << 16        # bytes read from the socket at once
+
+
+class FrameError(ValueError):
+    """
+    the stream can't be decoded (e.g. a frame is too big)
+    """
+
+
+class FrameKind(IntEnum):
+    JSON = 1
+    SNAPSHOT = 2    # binary ball states (core/snapshot.py)
+    MAP = 3         # zlib compressed map json (core/mapcache.py)
+
+
+class Frame(tp.NamedTuple):
+    kind: int
+    payload: memoryview
+
+
+def encode_frame(payload: bytes, kind: int = FrameKind.JSON) -> bytes:
+    """
+    prefix a payload with its header
+    """
+    if len(payload) > MAX_FRAME_SIZE:
+        raise FrameError(f"frame too big ({len(payload)} bytes)")
+
+    return HEADER.pack(len(payload), kind) + payload
+
+
+class FrameDecoder:
+    """
+    incremental decoder, feed it the received chunks and get the complete frames.
+
+    frames lying completely inside a chunk are returned as views on the chunk
+    (no copy), only frames split across chunks get buffered
+    """
+    max_size: int
+    _buffer: bytearray
+
+    def __init__(self, max_size: int = MAX_FRAME_SIZE) -> None:
+        self.max_size = max_size
+        self._buffer = bytearray()
+
+    @property
+    def pending(self) -> int:
+        """
+        number of buffered bytes (of an incomplete frame)
+        """
+        return len(self._buffer)
+
+    def _frame_size(self, header: bytes | memoryview) -> tuple[int, int]:
+        length, kind = HEADER.unpack(header)
+        if length > self.max_size:
+            raise FrameError(f"frame too big ({length} bytes)")
+
+        return HEADER.size + length, kind
+
+    def _missing(self) -> int:
+        """
+        bytes still needed by the buffered frame (or its header)
+        """
+        buffered = len(self._buffer)
+        if buffered < HEADER.size:
+            return HEADER.size - buffered
+
+        size, _kind = self._frame_size(self._buffer[:HEADER.size])
+        return size - buffered
+
+    def feed(self, data: bytes) -> list[Frame]:
+        """
+        decode a received chunk
+
+        :param data: the chunk, mustn't be changed while the frames are used
+        :return: all frames completed by this chunk, in order
+        """
+        view = memoryview(data)
+        frames: list[Frame] = []
+
+        # finish the frame split across the last chunks
+        while self._buffer and view:
+            missing = self._missing()
+            self._buffer += view[:missing]
+            view = view[missing:]
+
+            if self._missing() == 0:
+                frame = bytes(self._buffer)
+                self._buffer.clear()
+                _size, kind = self._frame_size(frame[:HEADER.size])
+                frames.append(Frame(kind, memoryview(frame)[HEADER.size:]))
+
+        # complete frames inside the chunk
+        offset = 0
+        end = len(view)
+        while end - offset >= HEADER.size:
+            size, kind = self._frame_size(view[offset:offset + HEADER.size])
+            if end - offset < size:
+                break
+
+            frames.append(Frame(kind, view[offset + HEADER.size:offset + size]))
+            offset += size
+
+        # keep the beginning of the next frame
+        self._buffer += view[offset:]
+
+        return frames
+
+    def clear(self) -> None:
+        self._buffer.clear()
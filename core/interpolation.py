@@ -0,0 +1,197 @@
+"""
+core/interpolation.py
+
+client side buffer of received snapshots. balls are drawn a small delay
+behind the newest snapshot, interpolated between the two snapshots around
+that time, so they move smoothly even with few snapshots per second.
+if snapshots are missing, the last one is extrapolated for a short time
+
+Author:
+Nilusink
+"""
+from collections import deque
+from time import time as now_time
+from threading import Lock
+from .snapshot import Snapshot
+import numpy as np
+
+
+class InterpolationBuffer:
+    delay: float
+    max_extrapolation: float
+    deceleration: float
+    clock_offset: float | None  # server time - local time, if known (else estimated)
+
+    def __init__(
+            self,
+            delay: float = .1,
+            max_extrapolation: float = .25,
+            deceleration: float = .25,
+            capacity: int = 32,
+    ) -> None:
+        """
+        :param delay: how far behind the server balls are drawn (seconds)
+        :param max_extrapolation: maximum time to extrapolate past the newest snapshot
+        :param deceleration: speed lost per second (used for extrapolating)
+        :param capacity: number of buffered snapshots
+        """
+        self.delay = delay
+        self.max_extrapolation = max_extrapolation
+        self.deceleration = deceleration
+        self.clock_offset = None
+
+        # pushed by the receiving thread, sampled by the drawing one
+        self._lock = Lock()
+        self._snapshots: deque[Snapshot] = deque(maxlen=capacity)
+        self._offsets: deque[float] = deque(maxlen=capacity)
+
+    def __len__(self) -> int:
+        return len(self._snapshots)
+
+    @property
+    def newest(self) -> Snapshot | None:
+        with self._lock:
+            return self._snapshots[-1] if self._snapshots else None
+
+    @property
+    def offset(self) -> float:
+        """
+        server time - local time. without a synchronized clock this is estimated
+        from the snapshot arrivals (the fastest one had the least latency)
+        """
+        if self.clock_offset is not None:
+            return self.clock_offset
+
+        with self._lock:
+            return max(self._offsets, default=0.)
+
+    def push(self, snapshot: Snapshot, received: float = ...) -> None:
+        """
+        add a received snapshot, older or duplicate ones are ignored
+
+        :param received: local time it arrived at
+        """
+        if received is ...:
+            received = now_time()
+
+        with self._lock:
+            newest = self._snapshots[-1] if self._snapshots else None
+            if newest is not None and (snapshot.time <= newest.time or snapshot.tick < newest.tick):
+                return
+
+            self._snapshots.append(snapshot)
+            self._offsets.append(snapshot.time - received)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._snapshots.clear()
+            self._offsets.clear()
+
+    def sample(self, now: float = ...) -> Snapshot | None:
+        """
+        state of the balls to draw now
+
+        :param now: local time
+        :return: None if nothing was received yet
+        """
+        if now is ...:
+            now = now_time()
+
+        offset = self.offset
+        with self._lock:
+            snapshots = tuple(self._snapshots)
+
+        if not snapshots:
+            return None
+
+        t = now + offset - self.delay
+
+        if t <= snapshots[0].time:
+            return snapshots[0]
+
+        # newest snapshot is too old: extrapolate (a bit)
+        if t >= snapshots[-1].time:
+            return self._extrapolate(snapshots[-1], min(t - snapshots[-1].time, self.max_extrapolation))
+
+        # find the snapshots around t (the newest ones are the most likely)
+        for i in range(len(snapshots) - 1, 0, -1):
+            if snapshots[i - 1].time <= t:
+                before = snapshots[i - 1]
+                after = snapshots[i]
+                break
+
+        else:
+            return snapshots[0]
+
+        alpha = (t - before.time) / (after.time - before.time)
+        return self._interpolate(before, after, alpha)
+
+    @staticmethod
+    def _interpolate(before: Snapshot, after: Snapshot, alpha: float) -> Snapshot:
+        """
+        balls that only exist in one of them aren't interpolated
+        """
+        if before.ids == after.ids:
+            rows = np.arange(len(after))
+            old = rows
+
+        else:
+            index = {ball_id: row for row, ball_id in enumerate(before.ids)}
+            pairs = [(row, index[ball_id]) for row, ball_id in enumerate(after.ids) if ball_id in index]
+            rows = np.array([row for row, _ in pairs], dtype=np.intp)
+            old = np.array([row for _, row in pairs], dtype=np.intp)
+
+        positions = after.positions.copy()
+        velocities = after.velocities.copy()
+        positions[rows] = before.positions[old] + (after.positions[rows] - before.positions[old]) * alpha
+        velocities[rows] = before.velocities[old] + (after.velocities[rows] - before.velocities[old]) * alpha
+
+        # jumps (e.g. a respawn) aren't interpolated
+        distances = after.positions[rows] - before.positions[old]
+        jumped = np.hypot(distances[:, 0], distances[:, 1]) > .25
+        if jumped.any():
+            if alpha < .5:
+                positions[rows[jumped]] = before.positions[old[jumped]]
+
+            else:
+                positions[rows[jumped]] = after.positions[rows[jumped]]
+
+        return Snapshot(
+            ids=after.ids,
+            positions=positions,
+            velocities=velocities,
+            tries=after.tries,
+            on_target=after.on_target,
+            tick=before.tick + round((after.tick - before.tick) * alpha),
+            time=before.time + (after.time - before.time) * alpha,
+        )
+
+    def _extrapolate(self, snapshot: Snapshot, dt: float) -> Snapshot:
+        """
+        continue the trajectories with constant deceleration
+        """
+        if dt <= 0:
+            return snapshot
+
+        velocities = snapshot.velocities
+        speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+        moving = (speeds > 0) & ~snapshot.on_target
+        if not moving.any():
+            return snapshot
+
+        safe = np.where(moving, speeds, 1)
+        decel = self.deceleration
+        t = np.minimum(dt, safe / decel) if decel > 0 else np.full_like(safe, dt)
+        new_speeds = np.where(moving, np.maximum(safe - decel * t, 0), speeds)
+        travel = np.where(moving, (safe + new_speeds) / 2 * t, 0)
+        directions = velocities / safe[:, None]
+
+        return Snapshot(
+            ids=snapshot.ids,
+            positions=snapshot.positions + directions * travel[:, None],
+            velocities=np.where(moving[:, None], directions * new_speeds[:, None], velocities),
+            tries=snapshot.tries,
+            on_target=snapshot.on_target,
+            tick=snapshot.tick,
+            time=snapshot.time + dt,
+        )
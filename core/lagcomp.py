@@ -0,0 +1,97 @@
+"""
+core/lagcomp.py
+
+lag compensation for shots: a shot is applied as if it happened at the
+time the player took it (in server time), not when the simulation gets
+to handle it. late shots are fast-forwarded along their trajectory, so
+the ball ends up where the client predicted it
+
+Author:
+Nilusink
+"""
+from time import time as now_time
+import typing as tp
+
+
+if tp.TYPE_CHECKING:
+    from .objects import Ball
+    from .classes import Vec2
+
+
+class LagCompensator:
+    max_rewind: float
+
+    shots: int              # number of applied shots
+    compensated: float      # total time shots were fast-forwarded by
+    clamped: int            # shots that were older than max_rewind
+    queue_delay: float      # average time between receiving and applying a shot
+    max_queue_delay: float
+
+    def __init__(self, max_rewind: float = .5, smoothing: float = .1) -> None:
+        """
+        :param max_rewind: shots are fast-forwarded by at most this many seconds
+        :param smoothing: weight of a new sample in the average queue delay
+        """
+        self.max_rewind = max_rewind
+        self.smoothing = smoothing
+
+        self.shots = 0
+        self._received = 0
+        self.compensated = 0.
+        self.clamped = 0
+        self.queue_delay = 0.
+        self.max_queue_delay = 0.
+
+    def delay(self, shot_time: float, now: float) -> float:
+        """
+        how long ago a shot happened, limited to 0..max_rewind
+        (shots from the future come from a badly synchronized clock)
+        """
+        delay = now - shot_time
+        if delay > self.max_rewind:
+            self.clamped += 1
+            return self.max_rewind
+
+        return max(delay, 0.)
+
+    def shoot(
+            self,
+            ball: "Ball",
+            velocity: "Vec2",
+            shot_time: float,
+            received: float,
+            world_time: float = ...,
+    ) -> bool:
+        """
+        hit a ball as if it happened at shot_time
+
+        :param shot_time: when the player shot (server time)
+        :param received: when the server received the shot (server time)
+        :param world_time: server time the simulation is at (the last tick), defaults to now
+        :return: if the ball could be hit
+        """
+        now = now_time()
+        if world_time is ...:
+            world_time = now
+
+        queued = max(now - received, 0.)
+        self.queue_delay += (queued - self.queue_delay) * (self.smoothing if self._received else 1)
+        self._received += 1
+        self.max_queue_delay = max(self.max_queue_delay, queued)
+
+        delay = self.delay(shot_time, world_time)
+        if not ball.hit(velocity, delay):
+            return False
+
+        self.shots += 1
+        self.compensated += delay
+        return True
+
+    def stats(self) -> dict[str, float | int]:
+        return {
+            "shots": self.shots,
+            "average_compensation": self.compensated / self.shots if self.shots else 0.,
+            "clamped": self.clamped,
+            "queue_delay": self.queue_delay,
+            "max_queue_delay": self.max_queue_delay,
+        }
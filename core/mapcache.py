@@ -0,0 +1,204 @@
+"""
+core/mapcache.py
+
+content addressed maps: a map is identified by the hash of its
+canonical json, so a client that already has a map only needs its hash.
+maps are sent zlib compressed and cached on the clients disk
+
+Author:
+Nilusink
+"""
+from functools import lru_cache
+import hashlib
+import json
+import re
+import zlib
+import os
+
+
+MAP_CACHE: str = os.path.join(os.path.expanduser("~"), ".cache", "MiniGolfMultiplayer", "maps")
+SUFFIX: str = ".json.z"
+
+_MAP_ID = re.compile(r"[0-9a-f]{64}")
+
+
+class MapError(ValueError):
+    """
+    map data is broken or doesn't match its hash
+    """
+
+
+def canonical_map(game_map: dict) -> bytes:
+    """
+    the same map always gives the same bytes
+    """
+    return json.dumps(game_map, sort_keys=True, separators=(",", ":")).encode("utf-8")
+
+
+@lru_cache(maxsize=8)
+def _hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def map_hash(game_map: dict) -> str:
+    return _hash(canonical_map(game_map))
+
+
+def valid_map_id(map_id) -> bool:
+    """
+    if map_id looks like a map hash (sha256, lowercase hex), anything
+    else mustn't end up in a path
+    """
+    return isinstance(map_id, str) and _MAP_ID.fullmatch(map_id) is not None
+
+
+def compress_map(game_map: dict) -> tuple[str, bytes]:
+    """
+    :return: hash and compressed data of a map
+    """
+    data = canonical_map(game_map)
+    return _hash(data), zlib.compress(data, 9)
+
+
+def decompress_map(data: bytes, expected: str | None = None) -> tuple[str, dict]:
+    """
+    :param expected: hash the map must have
+    :return: hash and map
+    :raises MapError: if the data is broken or has the wrong hash
+    """
+    try:
+        raw = zlib.decompress(data)
+        game_map = json.loads(raw)
+
+    except (zlib.error, ValueError) as error:
+        raise MapError(f"invalid map data: {error}") from error
+
+    # re-encode, the hash must match the canonical form
+    map_id = map_hash(game_map)
+    if expected is not None and map_id != expected:
+        raise MapError(f"map hash mismatch ({map_id} != {expected})")
+
+    return map_id, game_map
+
+
+class MapCache:
+    """
+    compressed maps in a directory, one file per hash.
+    the least recently used ones are deleted if there are more than max_maps
+    """
+    directory: str
+    max_maps: int
+
+    def __init__(self, directory: str = MAP_CACHE, max_maps: int = 32) -> None:
+        self.directory = directory
+        self.max_maps = max_maps
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, map_id: str) -> str:
+        """
+        :raises MapError: if map_id isn't a map hash
+        """
+        if not valid_map_id(map_id):
+            raise MapError(f"invalid map id {map_id!r}")
+
+        return os.path.join(self.directory, map_id + SUFFIX)
+
+    @property
+    def hashes(self) -> list[str]:
+        """
+        hashes of all cached maps
+        """
+        try:
+            names = os.listdir(self.directory)
+
+        except OSError:
+            return []
+
+        hashes = (name[:-len(SUFFIX)] for name in names if name.endswith(SUFFIX))
+        return [map_id for map_id in hashes if valid_map_id(map_id)]
+
+    def __contains__(self, map_id: str) -> bool:
+        return valid_map_id(map_id) and os.path.isfile(self._path(map_id))
+
+    def get(self, map_id: str) -> dict | None:
+        """
+        load a cached map, broken files are deleted
+
+        :return: None if the map isn't cached (or map_id isn't a map hash)
+        """
+        if not valid_map_id(map_id):
+            return None
+
+        path = self._path(map_id)
+        try:
+            with open(path, "rb") as inp:
+                data = inp.read()
+
+            _, game_map = decompress_map(data, map_id)
+
+        except OSError:
+            return None
+
+        except MapError:
+            self._remove(path)
+            return None
+
+        # mark as recently used
+        try:
+            os.utime(path)
+
+        except OSError:
+            pass
+
+        return game_map
+
+    def put(self, data: bytes, map_id: str | None = None) -> tuple[str, dict]:
+        """
+        store a compressed map (as received)
+
+        :param map_id: expected hash
+        :return: hash and map
+        :raises MapError: if the data is broken or has the wrong hash
+        """
+        map_id, game_map = decompress_map(data, map_id)
+
+        # write to a temporary file first, a crash never leaves half a map
+        path = self._path(map_id)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as out:
+                out.write(data)
+
+            os.replace(tmp, path)
+
+        except OSError:
+            self._remove(tmp)
+            return map_id, game_map
+
+        self._evict()
+        return map_id, game_map
+
+    def _evict(self) -> None:
+        paths = [self._path(map_id) for map_id in self.hashes]
+        if len(paths) <= self.max_maps:
+            return
+
+        def last_used(path: str) -> float:
+            try:
+                return os.path.getmtime(path)
+
+            except OSError:
+                return 0
+
+        paths.sort(key=last_used)
+        for path in paths[:len(paths) - self.max_maps]:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+
+        except OSError:
+            pass
@@ -3,21 +3,28 @@ core/objects.py
 
 classes for all walls and balls (sprites) and groups
 
+the sprites only hold simulation state (in map units), drawing is
+done by core/viewer.py if a window is requested
+
 Author:
 Nilusink
 """
 import random
 
-from .basegame import BaseGame
+from .collision import Contact, circle_segment, circle_ellipse, sweep_circle_segment, sweep_circle_ellipse
+from .spatial import UniformGrid, Bounds
+from .world import BallWorld
 from .classes import Vec2
 import pygame as pg
 import typing as tp
 import numpy as np
 import cmath as cm
+import math
 
 
 MAX_SPEED: float = 1    # the maximum player speed
 MAX_TIME: float = 4     # the maximum time a ball is on the move
+BALL_SIZE: float = .025 # diameter of a ball
 
 
 def _is_valid(x: float, y: float) -> bool:
@@ -30,40 +37,154 @@ def _is_valid(x: float, y: float) -> bool:
     return True
 
 
-def _to_screen_size(x: float, y: float) -> tuple[float, float]:
+def shot_velocity(vector: tp.Sequence[float]) -> Vec2 | None:
     """
-    convert from "percent" scheme to actual screen pixels
+    velocity of a shot, the client decides the strength but never more than full
+
+    :param vector: direction and strength (length 0..1) as sent by the client
+    :return: None if the vector isn't two finite numbers
     """
-    # if not _is_valid(x, y):
-    #     raise ValueError("x must be between 0..2. y must be between 0..1")
+    try:
+        x, y = vector
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return None
 
-    x = (x/2) * BaseGame.window_size[0]
-    y *= BaseGame.window_size[1]
+    except (TypeError, ValueError):
+        return None
 
-    return x, y
+    velocity = Vec2.from_cartesian(x, y)
+    if velocity.length > 1:
+        velocity.length = 1
+
+    velocity.length *= MAX_SPEED
+    return velocity
 
 
 # groups
 class _Walls(pg.sprite.Group):
-    def collide(self, ball: "Ball") -> tp.Union[tuple["Wall", tuple[int, int]], None]:
+    index: UniformGrid["Wall | EllipseWall"]
+
+    def __init__(self, cell_size: float = .1) -> None:
+        """
+        :param cell_size: size of the spatial index cells (map units)
+        """
+        self.index = UniformGrid(cell_size)
+        super().__init__()
+
+    def add_internal(self, sprite: "Wall | EllipseWall", layer=None) -> None:
+        super().add_internal(sprite, layer)
+        self.index.insert(sprite, sprite.bounds)
+
+        # resting balls may be affected by the new wall
+        Balls.world.wake_all()
+
+    def remove_internal(self, sprite: "Wall | EllipseWall") -> None:
+        super().remove_internal(sprite)
+        self.index.remove(sprite)
+        Balls.world.wake_all()
+
+    def reindex(self, wall: "Wall | EllipseWall") -> None:
+        """
+        update the spatial index after a wall was moved or resized
+        """
+        self.index.insert(wall, wall.bounds)
+
+    def collide(self, ball: "Ball") -> tp.Union[tuple["Wall", Contact], None]:
         """
         check if a sprite collides with a wall
+
+        :return: the wall that is hit the deepest and the contact with it
+        """
+        return self.collide_circle(ball.center, ball.radius)
+
+    def collide_circle(
+            self,
+            center: Vec2,
+            radius: float,
+            previous_center: Vec2 | None = None,
+    ) -> tp.Union[tuple["Wall", Contact], None]:
         """
-        for wall in self.sprites():
+        check if a circle (in map units) collides with a wall
+
+        :param previous_center: where the circle was before this tick,
+            only walls near the path between both positions are tested
+        :return: the wall that is hit the deepest and the contact with it
+        """
+        x0 = x1 = center.x
+        y0 = y1 = center.y
+        if previous_center is not None:
+            x0 = min(x0, previous_center.x)
+            y0 = min(y0, previous_center.y)
+            x1 = max(x1, previous_center.x)
+            y1 = max(y1, previous_center.y)
+
+        candidates = self.index.query((x0 - radius, y0 - radius, x1 + radius, y1 + radius))
+
+        deepest: tuple[Wall, Contact] | None = None
+        for wall in candidates:
             wall: Wall
 
-            # check if they collide (box)
-            if pg.sprite.collide_rect(wall, ball):
-                # check if they collide (by pixel)
-                pos = pg.sprite.collide_mask(ball, wall)
-                if pos:
-                    return wall, pos
+            contact = wall.collide(center, radius)
+            if contact is not None and (deepest is None or contact.depth > deepest[1].depth):
+                deepest = wall, contact
 
-        return
+        return deepest
+
+    def sweep_circle(
+            self,
+            center: Vec2,
+            radius: float,
+            direction: Vec2,
+            distance: float,
+    ) -> tp.Union[tuple[float, "Wall", Contact], None]:
+        """
+        move a circle along a straight line and find the first wall it hits
+
+        :param direction: unit vector
+        :return: travelled distance until the hit, the wall and the contact
+        """
+        x1 = center.x + direction.x * distance
+        y1 = center.y + direction.y * distance
+        candidates = self.index.query((
+            min(center.x, x1) - radius,
+            min(center.y, y1) - radius,
+            max(center.x, x1) + radius,
+            max(center.y, y1) + radius,
+        ))
+
+        first: tuple[float, Wall, Contact] | None = None
+        for wall in candidates:
+            wall: Wall
+
+            res = wall.sweep(center, radius, direction, distance)
+            if res is not None and (first is None or res[0] < first[0]):
+                first = res[0], wall, res[1]
+
+        return first
 
 
 class _Balls(pg.sprite.Group):
-    def get_user(self, user_id: str) -> "Ball":
+    world: BallWorld
+
+    def __init__(self) -> None:
+        self.world = BallWorld(radius=BALL_SIZE / 2, deceleration=MAX_SPEED / MAX_TIME)
+        super().__init__()
+
+    def add_internal(self, sprite: "Ball", layer=None) -> None:
+        super().add_internal(sprite, layer)
+        sprite._index = self.world.add(sprite, sprite.origin)
+
+    def remove_internal(self, sprite: "Ball") -> None:
+        super().remove_internal(sprite)
+        self.world.remove(sprite)
+
+    def update(self, delta: float) -> None:
+        """
+        simulate all balls at once
+        """
+        self.world.step(delta, Walls, Targets)
+
+    def get_user(self, user_id: str) -> "Ball | None":
         for user in self.sprites():
             user: Balls
 
@@ -72,18 +193,56 @@ class _Balls(pg.sprite.Group):
 
     def rem_user(self, user_id: str) -> None:
         user = self.get_user(user_id=user_id)
-        self.remove(user)
+        if user is not None:
+            self.remove(user)
 
 
 class _Targets(pg.sprite.Group):
+    positions: np.ndarray   # (n, 2) target centers
+    radii: np.ndarray       # (n,)
+
+    def __init__(self) -> None:
+        self.positions = np.zeros((0, 2))
+        self.radii = np.zeros(0)
+        super().__init__()
+
+    def _update_arrays(self) -> None:
+        targets = self.sprites()
+        self.positions = np.array([t.position.xy for t in targets], dtype=np.float64).reshape(-1, 2)
+        self.radii = np.array([t.radius for t in targets], dtype=np.float64)
+
+    def add_internal(self, sprite: "Target", layer=None) -> None:
+        super().add_internal(sprite, layer)
+        self._update_arrays()
+
+    def remove_internal(self, sprite: "Target") -> None:
+        super().remove_internal(sprite)
+        self._update_arrays()
+
+    def touching(self, centers: np.ndarray, radius: float) -> np.ndarray:
+        """
+        check which circles touch any target
+
+        :param centers: (n, 2) or (2,) circle centers
+        :return: (n,) or () bools
+        """
+        if not len(self.positions):
+            return np.zeros(centers.shape[:-1], dtype=np.bool_)
+
+        diff = centers[..., None, :] - self.positions
+        reach = (radius + self.radii) ** 2
+        return ((diff ** 2).sum(axis=-1) < reach).any(axis=-1)
+
     def collide(self, ball: "Ball") -> tp.Union["Target", None]:
         """
-        check if a sprite collides with a wall
+        check if a ball touches a target
         """
+        center = ball.center
         for target in self.sprites():
             target: Target
 
-            if pg.sprite.collide_mask(ball, target):
+            reach = ball.radius + target.radius
+            if (center - target.position).length < reach:
                 return target
 
         return
@@ -97,10 +256,7 @@ Targets = _Targets()
 
 # sprites
 class Wall(pg.sprite.Sprite):
-    extra_size: int = 10
-    ellipse_rect: pg.Rect
-
-    def __init__(self, p0, p1, thickness: int = 1) -> None:
+    def __init__(self, p0: Vec2, p1: Vec2, thickness: int = 1) -> None:
         self.x = min([p0.x, p1.x])
         self.y = min([p0.y, p1.y])
 
@@ -110,113 +266,88 @@ class Wall(pg.sprite.Sprite):
         self.width = x1 - self.x
         self.height = y1 - self.y
 
-        self._collision_vector = (p0 - p1).normalize()
+        self.p0 = p0.copy()
+        self.p1 = p1.copy()
+        self.thickness = thickness
 
         super().__init__(Walls)
 
-        self.update_rect()
-
-        width, height = _to_screen_size(self.width, self.height)
-
-        width += 2 * self.extra_size
-        height += 2 * self.extra_size
-
-        self.image = pg.surface.Surface(
-            (width, height),
-            pg.SRCALPHA, 32
-        )
-
-        x0 = (p0.x - self.x)
-        y0 = (p0.y - self.y)
-
-        x1 = (p1.x - self.x)
-        y1 = (p1.y - self.y)
-
-        (x0, y0) = _to_screen_size(x0, y0)
-        (x1, y1) = _to_screen_size(x1, y1)
-
-        x0 += self.extra_size
-        y0 += self.extra_size
-        x1 += self.extra_size
-        y1 += self.extra_size
-
-        pg.draw.line(self.image, (255, 0, 0, 255), (x0, y0), (x1, y1), width=thickness)
-
-        _pos, (width, height) = self.get_pygame_values()
-        width += 2 * self.extra_size - 2
-        height += 2 * self.extra_size - 2
-        pg.draw.rect(self.image, (125, 0, 0, 125), pg.Rect(1, 1, width, height), width=1)
-
-    def get_pygame_values(self) -> tuple[list[float, float], list[float, float]]:
-        return list(_to_screen_size(self.x, self.y)), list(_to_screen_size(self.width, self.height))
-
-    def get_collision_vector(self, _collision_point: Vec2) -> Vec2:
-        return self._collision_vector.copy()
-
-    def update_rect(self) -> None:
-        (x, y), (width, height) = self.get_pygame_values()
-        x -= self.extra_size  # * 2
-        y -= self.extra_size  # * 2
-
-        width += 2 * self.extra_size
-        height += 2 * self.extra_size
+    @property
+    def bounds(self) -> Bounds:
+        return self.x, self.y, self.x + self.width, self.y + self.height
 
-        self.rect = pg.Rect(x, y, width, height)
+    def collide(self, center: Vec2, radius: float) -> Contact | None:
+        """
+        check if a circle (in map units) touches the wall
+        """
+        return circle_segment(center, radius, self.p0, self.p1)
+
+    def sweep(
+            self,
+            center: Vec2,
+            radius: float,
+            direction: Vec2,
+            distance: float,
+    ) -> tuple[float, Contact] | None:
+        """
+        first contact of a circle moving along direction with the wall
+        """
+        return sweep_circle_segment(center, radius, direction, distance, self.p0, self.p1)
 
 
 class EllipseWall(pg.sprite.Sprite):
-    ellipse_rect: pg.Rect
-
     def __init__(self, x: float, y: float, width: float, height: float, thickness: int = 1) -> None:
         self.height = height
         self.width = width
         self.x = x
         self.y = y
+        self.thickness = thickness
 
         super().__init__(Walls)
 
-        self.update_rect()
-        self.image = pg.surface.Surface(
-            _to_screen_size(self.width, self.height),
-            pg.SRCALPHA, 32
-        )
-
-        pg.draw.ellipse(self.image, (255, 0, 0, 255), self.ellipse_rect, width=thickness)
-
-    def get_pygame_values(self) -> tuple[list[float, float], list[float, float]]:
-        return list(_to_screen_size(self.x, self.y)), list(_to_screen_size(self.width, self.height))
-
-    def get_collision_vector(self, collision_point: Vec2) -> Vec2:
-        p1, p2 = self.focal_points
-
-        p1 = Vec2.from_cartesian(*p1)
-        p2 = Vec2.from_cartesian(*p2)
-
-        to_p1 = collision_point - p1
-        to_p2 = collision_point - p2
-
-        coll = Vec2.from_polar(angle=(to_p1.angle + to_p2.angle) / 2, length=500)
-        coll.angle += np.pi / 2
+    @property
+    def bounds(self) -> Bounds:
+        return self.x, self.y, self.x + self.width, self.y + self.height
 
-        return coll.normalize()
+    @property
+    def center(self) -> Vec2:
+        return Vec2.from_cartesian(self.x + self.width / 2, self.y + self.height / 2)
 
-    def update_rect(self) -> None:
-        (x, y), (width, height) = self.get_pygame_values()
-        self.rect = pg.Rect(x, y, width, height)
-        self.ellipse_rect = pg.Rect(0, 0, width, height)
+    def collide(self, center: Vec2, radius: float) -> Contact | None:
+        """
+        check if a circle (in map units) touches the outline of the ellipse
+        """
+        return circle_ellipse(center, radius, self.center, self.width / 2, self.height / 2)
+
+    def sweep(
+            self,
+            center: Vec2,
+            radius: float,
+            direction: Vec2,
+            distance: float,
+    ) -> tuple[float, Contact] | None:
+        """
+        first contact of a circle moving along direction with the outline
+        """
+        return sweep_circle_ellipse(
+            center,
+            radius,
+            direction,
+            distance,
+            self.center,
+            self.width / 2,
+            self.height / 2,
+        )
 
     @property
     def focal_points(self) -> tuple[list[float, float], list[float, float]]:
         """
         calculate the focal points of the ellipsis
         """
-        (x0, y0), (width, height) = self.get_pygame_values()
-
-        x_c = x0 + width / 2
-        y_c = y0 + height / 2
+        x_c, y_c = self.center.xy
 
-        a = width / 2
-        b = height / 2
+        a = self.width / 2
+        b = self.height / 2
 
         e = cm.sqrt(a**2 - b**2)
 
@@ -230,12 +361,13 @@ class EllipseWall(pg.sprite.Sprite):
 
 
 class Ball(pg.sprite.Sprite):
+    """
+    view on a single row of Balls.world
+    """
     loss_per_sec: float = .000025
-    __was_target: bool = False
-    size: float = .025
-    _velocity: Vec2
-    _tries: int = 0
-    position: Vec2
+    size: float = BALL_SIZE
+    _index: int
+    origin: Vec2
     id: str
 
     def __init__(self, origin: Vec2, user_id: str = ...) -> None:
@@ -243,113 +375,81 @@ class Ball(pg.sprite.Sprite):
             user_id = str(random.randint(0, 1_000_000))
 
         self.id = user_id
+        self.origin = origin.copy()
 
-        self.position = origin.copy()
-        self._origin = origin.copy()
-        self._velocity = Vec2()
-
+        # adding to the group allocates the row
         super().__init__(Balls)
 
-        self.image = pg.surface.Surface([self.screen_size] * 2, pg.SRCALPHA, 32)
-        pg.draw.circle(self.image, (255, 0, 0, 255), [self.screen_size / 2] * 2, radius=self.screen_size / 2)
-
-        identifier = user_id[-1]
+    @property
+    def _world(self) -> BallWorld:
+        return Balls.world
 
-        text = BaseGame.font.render(identifier, False, (0, 0, 0, 255))
+    @property
+    def position(self) -> Vec2:
+        """
+        top left corner of the ball (copy)
+        """
+        world = self._world
+        if world.clock is not None:
+            positions, _ = world.state_at(world.clock(), self._index)
+            return Vec2.from_cartesian(*positions.tolist())
 
-        self.image.blit(text, (6, 5))
+        return Vec2.from_cartesian(*world.positions[self._index].tolist())
 
-        self.update_rect()
+    @position.setter
+    def position(self, value: Vec2) -> None:
+        self._world.move(self._index, value)
 
     @property
-    def screen_size(self) -> float:
-        s = _to_screen_size(self.size, 0)[0]
-        return s
+    def radius(self) -> float:
+        return self.size / 2
 
     @property
-    def screen_position(self) -> tuple[float, float]:
-        return _to_screen_size(self.position.x, self.position.y)
+    def center(self) -> Vec2:
+        """
+        center of the ball (position is the top left corner)
+        """
+        x, y = self.position.xy
+        return Vec2.from_cartesian(x + self.radius, y + self.radius)
 
     @property
     def tries(self) -> int:
         """
         how often the ball was hit to this point
         """
-        return self._tries
+        return int(self._world.tries[self._index])
 
     @property
     def on_target(self) -> bool:
-        return self.__was_target
+        return bool(self._world.on_target[self._index])
 
     @property
     def velocity(self) -> Vec2:
-        return self._velocity
-
-    def update_rect(self) -> None:
-        self.rect = pg.Rect(
-            *_to_screen_size(*self.position.xy),
-            *[self.screen_size] * 2,
-        )
-
-    def update(self, delta: float) -> None:
-        # check for hitting the target
-        if self.__was_target:
-            # user thinks it's still traveling
-            self._velocity = Vec2.from_polar(0, 1)
-            return
-
-        target = Targets.collide(self)
-
-        if target is not None and self._velocity.length < 0.001:
-            self._velocity = Vec2()
-            self.__was_target = True
-
-        if self._velocity.length == 0:
-            return
-
-        self.position += self._velocity * delta
-
-        if self._velocity.length > 0:
-            self._velocity.length -= (MAX_SPEED / MAX_TIME) * delta
-
-        else:
-            self._velocity.length = 0
-
-        # check for collision
-        res = Walls.collide(self)
-
-        if res is not None:
-            wall, pos = res
-            self.position -= self._velocity * delta
-            self._velocity.reflect(wall.get_collision_vector(Vec2.from_cartesian(*pos)))
-            self.position += self._velocity * delta
-
-        # check if the ball is out of screen
-        if not _is_valid(*self.position.xy):
-            self.reset()
+        """
+        current velocity (copy)
+        """
+        world = self._world
+        if world.clock is not None:
+            _, velocities = world.state_at(world.clock(), self._index)
+            return Vec2.from_cartesian(*velocities.tolist())
 
-        self.update_rect()
+        return Vec2.from_cartesian(*world.velocities[self._index].tolist())
 
-    def hit(self, speed: Vec2) -> None:
+    def hit(self, speed: Vec2, elapsed: float = 0.) -> bool:
         """
         "hit" a ball with a cup.
         A ball can only be hit if it stands still (velocity = 0)
-        """
-        if not self._velocity.length == 0:
-            return
 
-        self._tries += 1
-        self._velocity = speed.copy()
+        :param elapsed: the hit happened this many seconds ago (lag compensation)
+        :return: if the ball could be hit
+        """
+        return self._world.hit(self._index, speed, elapsed, Walls)
 
     def reset(self) -> None:
         """
         but a ball back to its original position (without any velocity
         """
-        self.position = self._origin.copy()
-        self.update_rect()
-
-        self.__was_target = False
-        self._velocity = Vec2()
+        self._world.reset(self._index)
         print(f"{self.id} reset")
 
 
@@ -362,28 +462,22 @@ class Target(pg.sprite.Sprite):
 
         super().__init__(Targets)
 
-        self.image = pg.surface.Surface(
-            (self.screen_size,) * 2,
-            pg.SRCALPHA, 32,
-        )
-
-        self.update_rect()
-
-        pg.draw.circle(self.image, (255, 255, 0, 255), (self.screen_size / 2,) * 2, self.screen_size / 2)
-
     @property
-    def screen_size(self) -> float:
-        s = _to_screen_size(self.size, 0)[0]
-        return s
+    def radius(self) -> float:
+        return self.size / 2
 
-    @property
-    def screen_position(self) -> tuple[float, float]:
-        return _to_screen_size(self.position.x, self.position.y)
 
-    def update_rect(self) -> None:
-        x, y = self.screen_position
+def load_map(config: dict) -> None:
+    """
+    create the target and walls of a map (Maps/*.json format).
+    the map's x coordinates go from 0..1 and get stretched to 0..2
+    """
+    pos = config["target"]
+    Target(Vec2.from_cartesian(pos[0] * 2, pos[1]))
 
-        x -= self.screen_size / 2
-        y -= self.screen_size / 2
+    for i in range(1, config["total"] + 1):
+        points = config[str(i)]
+        p0 = Vec2.from_cartesian(points["p1_x"] * 2, points["p1_y"])
+        p1 = Vec2.from_cartesian(points["p2_x"] * 2, points["p2_y"])
 
-        self.rect = pg.Rect(x, y, *(self.screen_size,) * 2)
+        Wall(p0, p1, 1)
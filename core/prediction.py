@@ -0,0 +1,211 @@
+"""
+core/prediction.py
+
+client side prediction of the own ball after a shot: the ball starts
+moving right away, simulated with the same physics and map as the server.
+snapshots from the server are authoritative, the prediction is restarted
+from every confirmed server state and the difference is blended out
+
+Author:
+Nilusink
+"""
+from .objects import Walls, Balls, Targets, Ball, load_map, shot_velocity
+from .snapshot import Snapshot
+from .world import BallWorld
+from time import time as now_time
+from .classes import Vec2
+import numpy as np
+import math
+
+
+class ShotPredictor:
+    user_id: str
+    active: bool            # a shot is being predicted
+    corrections: int        # number of reconciliations with the server
+    tick_rate: float
+    smoothing: float
+    confirm_timeout: float
+
+    def __init__(
+            self,
+            user_id: str,
+            game_map: dict,
+            tick_rate: float = 60,
+            smoothing: float = .15,
+            confirm_timeout: float = 1,
+    ) -> None:
+        """
+        :param user_id: id of the own ball
+        :param game_map: map (Maps/*.json format) the server simulates
+        :param tick_rate: physics steps per second (same as the server)
+        :param smoothing: time constant (seconds) corrections are blended out with
+        :param confirm_timeout: give up if the server doesn't confirm a shot in time
+        """
+        self.user_id = user_id
+        self.tick_rate = tick_rate
+        self.smoothing = smoothing
+        self.confirm_timeout = confirm_timeout
+
+        self.active = False
+        self.corrections = 0
+
+        self._ball: Ball | None = None
+        self._time = 0.                 # local time of the simulated state
+        self._shot_time = 0.
+        self._drawn = 0.                # local time of the last apply
+        self._tries = 0                 # tries of the predicted shot
+        self._confirmed = False
+        self._last_server = -math.inf   # time of the last reconciled snapshot
+        self._offset = np.zeros(2)      # visual correction
+
+        self.load_map(game_map)
+
+    def load_map(self, game_map: dict) -> None:
+        Walls.empty()
+        Targets.empty()
+        load_map(game_map)
+
+    @property
+    def _world(self) -> BallWorld:
+        return Balls.world
+
+    def _advance(self, until: float) -> None:
+        """
+        simulate in fixed steps up to a local time
+        """
+        delta = 1 / self.tick_rate
+        while self._time + delta <= until:
+            self._world.step(delta, Walls, Targets)
+            self._time += delta
+
+    def _position(self) -> np.ndarray:
+        return self._world.positions[self._ball._index].copy()
+
+    def shoot(self, vector: tuple[float, float], server_state: Snapshot, now: float = ...) -> None:
+        """
+        start predicting a shot
+
+        :param vector: the shot as sent to the server
+        :param server_state: newest state from the server (the own ball is at rest)
+        """
+        if now is ...:
+            now = now_time()
+
+        # same as the server
+        velocity = shot_velocity(vector)
+        if velocity is None:
+            return
+
+        try:
+            row = server_state.ids.index(self.user_id)
+
+        except ValueError:
+            return
+
+        if self._ball is None:
+            self._ball = Ball(Vec2.from_cartesian(*server_state.positions[row].tolist()), user_id=self.user_id)
+
+        index = self._ball._index
+        self._world.set_state(index, server_state.positions[row].tolist(), velocity.xy)
+
+        self.active = True
+        self._time = self._shot_time = self._drawn = now
+        self._tries = int(server_state.tries[row]) + 1
+        self._confirmed = False
+        self._last_server = server_state.time
+        self._offset[:] = 0
+
+    def reconcile(self, snapshot: Snapshot, clock_offset: float) -> None:
+        """
+        restart the prediction from a server state
+
+        :param snapshot: received snapshot
+        :param clock_offset: server time - local time
+        """
+        if not self.active or snapshot.time <= self._last_server:
+            return
+
+        try:
+            row = snapshot.ids.index(self.user_id)
+
+        except ValueError:
+            return
+
+        # the server didn't handle the shot yet
+        if int(snapshot.tries[row]) < self._tries:
+            return
+
+        self._last_server = snapshot.time
+        self._confirmed = True
+        self.corrections += 1
+
+        before = self._position()
+
+        # replay from the server state up to the current local time
+        index = self._ball._index
+        self._world.set_state(
+            index,
+            snapshot.positions[row].tolist(),
+            snapshot.velocities[row].tolist(),
+            bool(snapshot.on_target[row]),
+        )
+
+        now = self._time
+        self._time = snapshot.time - clock_offset
+        self._advance(now)
+
+        # blend from the old to the new prediction
+        self._offset += before - self._position()
+
+    def apply(self, state: Snapshot | None, now: float = ...) -> Snapshot | None:
+        """
+        replace the own ball in a (interpolated) state with the prediction
+
+        :return: the state to draw
+        """
+        if not self.active or state is None:
+            return state
+
+        if now is ...:
+            now = now_time()
+
+        # the server ignored the shot
+        if not self._confirmed and now - self._shot_time > self.confirm_timeout:
+            self.active = False
+            return state
+
+        try:
+            row = state.ids.index(self.user_id)
+
+        except ValueError:
+            return state
+
+        self._advance(now)
+        self._offset *= math.exp(-max(now - self._drawn, 0) / self.smoothing)
+        self._drawn = now
+
+        index = self._ball._index
+        predicted = self._world.positions[index] + self._offset
+        velocity = self._world.velocities[index]
+        at_rest = not velocity.any() or self._world.on_target[index]
+
+        # done once the server state (that is drawn) caught up
+        server_at_rest = not state.velocities[row].any() or state.on_target[row]
+        if self._confirmed and at_rest and server_at_rest:
+            self.active = False
+            return state
+
+        positions = state.positions.copy()
+        velocities = state.velocities.copy()
+        positions[row] = predicted
+        velocities[row] = velocity
+
+        return Snapshot(
+            ids=state.ids,
+            positions=positions,
+            velocities=velocities,
+            tries=state.tries,
+            on_target=state.on_target,
+            tick=state.tick,
+            time=state.time,
+        )
@@ -0,0 +1,130 @@
+"""
+core/scheduler.py
+
+fixed timestep scheduler for the physics simulation
+
+Author:
+Nilusink
+"""
+from time import perf_counter, sleep
+import typing as tp
+
+
+class TickScheduler:
+    """
+    calls a step function with a constant delta.
+
+    time that passed is collected in an accumulator and worked off in
+    fixed steps, if the simulation falls behind by more than
+    max_catch_up steps, the rest is dropped (and counted as overrun)
+    """
+    tick: int           # number of simulated ticks
+    overruns: int       # how often the simulation couldn't keep up
+    dropped_time: float # simulation time skipped because of overruns
+    busy_time: float    # real time spent inside the step function
+
+    def __init__(
+            self,
+            tick_rate: float = 60,
+            max_catch_up: int = 5,
+            spin_time: float = .0005,
+    ) -> None:
+        """
+        :param tick_rate: simulation steps per second
+        :param max_catch_up: maximum number of steps run back to back
+        :param spin_time: the last part of each wait is busy-waited
+            for a more precise wakeup
+        """
+        if tick_rate <= 0:
+            raise ValueError("tick_rate must be greater than 0")
+
+        if max_catch_up < 1:
+            raise ValueError("max_catch_up must be at least 1")
+
+        self.tick_rate = tick_rate
+        self.max_catch_up = max_catch_up
+        self.spin_time = spin_time
+
+        self.tick = 0
+        self.overruns = 0
+        self.dropped_time = 0
+        self.busy_time = 0
+
+        self.__running = False
+        self.__started = 0.
+
+    @property
+    def delta(self) -> float:
+        """
+        simulation time per tick in seconds
+        """
+        return 1 / self.tick_rate
+
+    @property
+    def load(self) -> float:
+        """
+        fraction of the real time spent simulating (1 = one full core)
+        """
+        if not self.__started:
+            return 0
+
+        elapsed = perf_counter() - self.__started
+        return self.busy_time / elapsed if elapsed > 0 else 0
+
+    def _sleep_until(self, deadline: float) -> None:
+        """
+        sleep until the deadline, busy-wait for the last spin_time seconds
+        """
+        remaining = deadline - perf_counter()
+        if remaining > self.spin_time:
+            sleep(remaining - self.spin_time)
+
+        while perf_counter() < deadline:
+            pass
+
+    def run(
+            self,
+            step: tp.Callable[[float], tp.Any],
+            running: tp.Callable[[], bool] = ...,
+    ) -> None:
+        """
+        run the scheduler until running returns False or stop is called
+
+        :param step: called with the fixed delta once per tick
+        :param running: additional stop condition
+        """
+        if running is ...:
+            def running() -> bool:
+                return True
+
+        delta = self.delta
+        self.__running = True
+        self.__started = last_time = perf_counter()
+        accumulator = 0.
+
+        while self.__running and running():
+            now = perf_counter()
+            accumulator += now - last_time
+            last_time = now
+
+            steps = 0
+            while accumulator >= delta and steps < self.max_catch_up:
+                step(delta)
+
+                self.tick += 1
+                accumulator -= delta
+                steps += 1
+
+            self.busy_time += perf_counter() - now
+
+            # couldn't keep up, drop the ticks that are left over
+            if accumulator >= delta:
+                self.overruns += 1
+                dropped = accumulator - accumulator % delta
+                self.dropped_time += dropped
+                accumulator -= dropped
+
+            self._sleep_until(last_time + delta - accumulator)
+
+    def stop(self) -> None:
+        self.__running = False
@@ -11,11 +11,19 @@ Date:   29.06.2022
 #                                Import Modules                                #
 ################################################################################
 
+from core.framing import FrameDecoder, FrameError, FrameKind, encode_frame, READ_SIZE
+from core.snapshot import Snapshot, SnapshotEncoder, FORMATS
+from core.connection import Connection, ConnectionState, QueueFull
+from core.clocksync import ClockSync
+from core.mapcache import compress_map, valid_map_id
+from core.eventqueue import EventQueue, EventQueueFull
 from core.debug import all_callables, debug
+from concurrent.futures import Future
 from dataclasses import dataclass
 from threading import Thread
 from typing import Union
 from time import time
+import asyncio
 import socket
 import json
 
@@ -25,6 +33,7 @@ import json
 
 ENCRYPTION: str = "UTF-8"
 PORT: int = 8888
+MAX_MAPS: int = 64      # cached maps a client can announce
 
 
 ################################################################################
@@ -60,11 +69,13 @@ class UserRem: # noqa
 @dataclass(frozen=True)
 class UserShoot: # noqa
     """
-    Event for user shoots
+    Event for user shoots, time is when the user shot (converted to the
+    server clock), received when the server got it
     """
     user_id: str
     time: float
     msg: dict
+    received: float = 0.
 
 
 @dataclass(frozen=True)
@@ -80,44 +91,106 @@ class UserRespawn:
 #                                   Server                                     #
 ################################################################################
 
+def _event_key(event: Union[UserAdd, UserRem, UserShoot, UserRespawn]) -> str | None:
+    """
+    Pending shots and respawns are indexed by user (one per user)
+    """
+    return event.user_id if type(event) in (UserShoot, UserRespawn) else None
+
+
+def _encode(msg: dict | str, msg_type: str) -> bytes:
+    """
+    Build the bytes of a message
+    """
+    msg_dict = {"type": msg_type, "content": msg}
+    msg_str = json.dumps(msg_dict)
+    return encode_frame(msg_str.encode(ENCRYPTION), FrameKind.JSON)
+
+
 @all_callables(debug)
-class Server(socket.socket):
-    __clients: dict[str, socket.socket]
-    __events: list[Union[UserAdd, UserRem, UserShoot, UserRespawn]]
+class Server:
+    __clients: dict[str, Connection]
+    __snapshots: SnapshotEncoder
+    keyframe_interval: int
+    max_queue: int
+    max_lag: float
+    ping_interval: float
+    heartbeat_timeout: float
+    connected: int      # number of accepted connections
+    disconnected: int   # ... that were closed and removed again
+    reaped: int         # ... of which stopped answering (dead peers)
+    __events: EventQueue[Union[UserAdd, UserRem, UserShoot, UserRespawn]]
+    __loop: asyncio.AbstractEventLoop
     __id_counter: int
     debug_mode: int
     __running: bool
     game_map: dict
-
-    def __init__(self, game_map: dict | None = None, debug_mode: int | None = 0) -> None:
+    map_id: str | None
+    __map_frame: bytes | None
+
+    def __init__(
+            self,
+            game_map: dict | None = None,
+            debug_mode: int | None = 0,
+            host: str | None = "0.0.0.0",
+            port: int | None = PORT,
+            keyframe_interval: int | None = 60,
+            max_queue: int | None = 64,
+            max_lag: float | None = 5,
+            max_events: int | None = 1024,
+            ping_interval: float | None = 1,
+            heartbeat_timeout: float | None = 10,
+    ) -> None:
         """
         Server for communicating between game calculating and game GUI
 
+        All connections are handled by one asyncio event loop running in
+        a background thread, the public methods can be called from any thread
+
         :param game_map: Map of the game
         :param debug_mode: 0 - NoDebug, 1 - OnlyImportantInformations, 2 - LightDebug, 3 - FullDebug
+        :param host: Address to listen on
+        :param port: Port to listen on
+        :param keyframe_interval: Send a full snapshot at least every n snapshots
+        :param max_queue: Maximum number of messages queued for a client
+        :param max_lag: Disconnect clients that can't receive for this many seconds
+        :param max_events: Maximum number of events waiting to be handled
+        :param ping_interval: Seconds between the pings measuring latency and clock offset of each client
+        :param heartbeat_timeout: Disconnect clients that didn't send anything (not even a pong) for this many seconds
         """
-        super().__init__(socket.AF_INET, socket.SOCK_STREAM)
-        self.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.debug_mode = debug_mode
 
         self._print(f"<<<<<<<<<<<<<<<<<<<<>>>>>>>>>>>>>>>>>>>>")
         self._print()
         self._print(f"SERVER STARTED:")
         self._print(f" - IP:     {socket.gethostbyname(socket.gethostname())}")
-        self._print(f" - PORT:   {PORT}")
+        self._print(f" - PORT:   {port}")
         self._print()
         self._print(f"<<<<<<<<<<<<<<<<<<<<>>>>>>>>>>>>>>>>>>>>")
 
-        self.bind(("0.0.0.0", PORT))
-        self.listen()
-
         self.__running = True
         self.__clients = {}
-        self.__events = []
+        self.__snapshots = SnapshotEncoder()
+        self.keyframe_interval = keyframe_interval
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.ping_interval = ping_interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.connected = 0
+        self.disconnected = 0
+        self.reaped = 0
+        self.__events = EventQueue(max_events, key=_event_key)
         self.__id_counter = 0
-        self.game_map = game_map
+        self.game_map = None
+        self.map_id = None
+        self.__map_frame = None
+        self.__set_map(game_map)
 
-        Thread(target=self.__new_clients, args=()).start()
+        # start the event loop and wait until the server is listening
+        self.__loop = asyncio.new_event_loop()
+        started = Future()
+        Thread(target=self.__run_loop, args=(host, port, started), daemon=True).start()
+        started.result()
 
     @property
     def events(self) -> list[UserAdd, UserRem, UserShoot, UserRespawn]:
@@ -127,9 +200,51 @@ class Server(socket.socket):
 
         :return List of all different events
         """
-        events = self.__events
-        self.__events = []
-        return events
+        return self.__events.drain()
+
+    def wait_events(self, timeout: float | None = None) -> list[UserAdd, UserRem, UserShoot, UserRespawn]:
+        """
+        Waits until there are events and returns all of them
+
+        :param timeout: Maximum time to wait in seconds, None waits forever
+        :return List of all different events, empty on timeout
+        """
+        return self.__events.drain(timeout)
+
+    @property
+    def clients(self) -> list[str]:
+        """
+        IDs of the connected users/clients
+        """
+        return list(self.__clients)
+
+    def connection_state(self, user_id: str) -> ConnectionState:
+        """
+        State of the connection to a user/client, CLOSED if it is gone
+        """
+        connection = self.__clients.get(user_id)
+        return ConnectionState.CLOSED if connection is None else connection.state
+
+    def connection_stats(self, user_id: str) -> dict[str, float | int] | None:
+        """
+        Latency (rtt, jitter in seconds), clock offset (client - server) and
+        traffic of a client
+
+        :param user_id: ID of the user/client
+        :return: None if the client isn't connected
+        """
+        connection = self.__clients.get(user_id)
+        return None if connection is None else connection.stats
+
+    def server_time(self, user_id: str, client_time: float) -> float:
+        """
+        Converts a timestamp of a client to the server clock
+
+        :param user_id: ID of the user/client
+        :param client_time: time() on the client
+        """
+        connection = self.__clients.get(user_id)
+        return client_time if connection is None else connection.clock.local_time(client_time)
 
     def send_user(self, user_id: str, msg: dict | str, msg_type: str | None = "msg") -> None:
         """
@@ -139,16 +254,7 @@ class Server(socket.socket):
         :param msg: Message to send to all users/clients
         :param msg_type: Type of the message (e.g.: map)
         """
-        msg_dict = {"type": msg_type, "content": msg}
-        msg_str = f'@{json.dumps(msg_dict)}#'
-        msg_byte = msg_str.encode(ENCRYPTION)
-
-        try:
-            self.__clients[user_id].settimeout(None)
-            self.__clients[user_id].send(msg_byte)
-            self.__clients[user_id].settimeout(.1)
-        except OSError:
-            return
+        self.__call(self.__write, user_id, _encode(msg, msg_type))
 
     def send_all(self, msg: dict | str, msg_type: str | None = "msg") -> None:
         """
@@ -157,105 +263,339 @@ class Server(socket.socket):
         :param msg: Message to send to all users/clients
         :param msg_type: Type of the message (e.g.: map)
         """
-        msg_dict = {"type": msg_type, "content": msg}
-        msg_str = f'@{json.dumps(msg_dict)}#'
-        msg_byte = msg_str.encode(ENCRYPTION)
-        for client in self.__clients.copy():
-            try:
-                self.__clients[client].settimeout(None)
-                self.__clients[client].sendall(msg_byte)
-                self.__clients[client].settimeout(.1)
+        self.__call(self.__write_all, _encode(msg, msg_type))
 
-            except OSError:
-                continue
+    def send_snapshot(self, snapshot: Snapshot) -> None:
+        """
+        Sends the state of all balls to all clients/users in the format they
+        negotiated (json by default). Binary clients get the changes since the
+        last snapshot they acknowledged, or a full one every keyframe_interval
+
+        :param snapshot: state of the balls
+        """
+        formats = {connection.format for connection in list(self.__clients.values())}
+        json_msg = None
+
+        if "binary" in formats:
+            self.__snapshots.push(snapshot)
+
+        if "json" in formats:
+            json_msg = _encode(snapshot.to_dict(), "msg")
+
+        self.__call(self.__write_snapshot, json_msg)
 
     def change_map(self, game_map: dict) -> None:
         """
-        Change the game map
+        Change the game map, clients that have it cached only get its hash
 
         :param game_map: map dictonary
         """
+        self.__set_map(game_map)
+        self.__call(self.__send_map_all)
+
+    def __set_map(self, game_map: dict | None) -> None:
+        """
+        Compress a map once for all clients
+        """
         self.game_map = game_map
-        self.send_all(game_map, "map")
+        if not game_map:
+            self.map_id = self.__map_frame = None
+            return
 
-    def __client_receive_handler(self, user_id: str, client: socket.socket) -> None:
+        self.map_id, data = compress_map(game_map)
+        self.__map_frame = encode_frame(data, FrameKind.MAP)
+
+    def __send_map(self, connection: Connection) -> None:
         """
-        Receives messages from the clients and saves it as events
+        Send the hash of the map if the client has it, else the (compressed) map
+        """
+        if self.map_id is None:
+            return
 
-        :param user_id: ID of the user/client
-        :param client: Socket of the user/client
+        if self.map_id in connection.maps:
+            self.__write(connection.user_id, _encode(self.map_id, "map_hash"))
+            return
+
+        connection.maps.add(self.map_id)
+        self.__write(connection.user_id, self.__map_frame)
+
+    def __send_map_all(self) -> None:
+        for connection in list(self.__clients.values()):
+            self.__send_map(connection)
+
+    def __call(self, func, *args) -> None:
+        """
+        Run a function in the event loop (directly if already in it)
         """
-        client.settimeout(.1)
+        try:
+            in_loop = asyncio.get_running_loop() is self.__loop
+
+        except RuntimeError:
+            in_loop = False
+
+        if in_loop:
+            func(*args)
+
+        elif self.__running:
+            self.__loop.call_soon_threadsafe(func, *args)
+
+    def __write(self, user_id: str, data: bytes) -> None:
+        connection = self.__clients.get(user_id)
+        if connection is None:
+            return
+
+        try:
+            connection.send(data)
+
+        except QueueFull as error:
+            self._print(f"{user_id}: {error}, disconnecting")
+            connection.close(abort=True)
+
+    def __write_all(self, data: bytes) -> None:
+        for user_id in list(self.__clients):
+            self.__write(user_id, data)
+
+    def __write_snapshot(self, json_msg: bytes | None) -> None:
+        snapshots = self.__snapshots
+        sequence = snapshots.sequence
+        frames: dict[int | None, bytes] = {}    # by baseline, shared by all connections
+
+        for connection in list(self.__clients.values()):
+            match connection.format:
+                case "json":
+                    if json_msg is None:
+                        continue
+
+                    data = json_msg
+
+                case "binary":
+                    if sequence == 0:
+                        continue
+
+                    baseline = connection.ack
+                    if (
+                            connection.keyframe is None
+                            or sequence - connection.keyframe >= self.keyframe_interval
+                            or not snapshots.has_baseline(baseline)
+                    ):
+                        baseline = None
+                        connection.keyframe = sequence
+
+                    if baseline not in frames:
+                        frames[baseline] = encode_frame(snapshots.encode(baseline), FrameKind.SNAPSHOT)
+
+                    data = frames[baseline]
+
+                case _:
+                    continue
 
-        while self.__running:
             try:
-                msg = client.recv(1024)
+                connection.send_snapshot(data)
 
-                if msg == b"":
-                    client.close()
-                    raise ConnectionResetError  # to disconnect the user (event)
+            except TimeoutError as error:
+                self._print(f"{connection.user_id}: {error}, disconnecting")
+                connection.close(abort=True)
 
-                msg_str = msg.decode(ENCRYPTION)
-                msg = json.loads(msg_str)
+    def __run_loop(self, host: str, port: int, started: Future) -> None:
+        """
+        Runs the event loop (in its own thread)
+        """
+        asyncio.set_event_loop(self.__loop)
 
-                event = None
+        try:
+            server = self.__loop.run_until_complete(
+                asyncio.start_server(self.__new_client, host, port, reuse_address=True)
+            )
+
+        except OSError as error:
+            started.set_exception(error)
+            return
 
-                match msg["type"]:
-                    case "shoot":
-                        event = UserShoot(user_id=user_id, time=msg["time"], msg=msg["content"])
+        started.set_result(None)
+        try:
+            self.__loop.run_forever()
 
-                    case "respawn":
-                        event = UserRespawn(user_id=user_id, time=msg["time"])
+        finally:
+            server.close()
+            for connection in self.__clients.values():
+                connection.close()
 
-                    case "PING":
-                        self.send_user(user_id, {}, "PONG")
+            self.__loop.run_until_complete(server.wait_closed())
+            self.__loop.close()
 
-                    case _:
-                        raise NotImplementedError(f"Unknown event type: {msg['type']}")
+    async def __new_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Handles a new connection until it disconnects
+        """
+        user_id = "user_{:03d}".format(self.__id_counter)
+        self.__id_counter += 1
 
-                for single_event in self.__events:
-                    if type(single_event) == UserShoot and single_event.user_id == user_id:
-                        raise MultipleDataReceivedError("Client already sent data")
+        connection = Connection(user_id, writer, max_queue=self.max_queue, max_lag=self.max_lag)
+        self.__clients[user_id] = connection
+        self.connected += 1
+        sender = asyncio.create_task(connection.run_sender())
+        heartbeat = asyncio.create_task(self.__heartbeat(connection))
+        self._print("NEW CLIENT: ", user_id, writer.get_extra_info("peername"))
 
-                if event:
-                    self.__events.append(event)
-                self._print(f"{user_id} SENT: {msg}", min_debug=2)
+        self.send_user(user_id, user_id, "ID")
+        self.__put_event(UserAdd(user_id=user_id, time=time()))
 
-            except ConnectionResetError:
-                self._print(f"USER DISCONNECTED: {user_id}")
-                self.__events.append(UserRem(user_id=user_id, time=time()))
+        try:
+            await self.__client_receive_handler(connection, reader)
+
+        finally:
+            # forget everything about the client, however it disconnected
+            self._print(f"DISCONNECT USER: {user_id}")
+            self.__clients.pop(user_id, None)
+            connection.close(abort=True)
+            sender.cancel()
+            heartbeat.cancel()
+            self.disconnected += 1
+            self.__put_event(UserRem(user_id=user_id, time=time()))
+
+    async def __heartbeat(self, connection: Connection) -> None:
+        """
+        Pings a client regularly to measure its latency and clock offset,
+        disconnects it if it doesn't answer anymore
+        """
+        while not connection.closed:
+            if connection.idle > self.heartbeat_timeout:
+                self._print(f"{connection.user_id}: no heartbeat for {connection.idle:.1f} seconds, disconnecting")
+                self.reaped += 1
+                connection.close(abort=True)
                 return
 
-            except (TimeoutError, json.decoder.JSONDecodeError):
-                continue
+            self.__write(connection.user_id, _encode(connection.clock.request(time()), "PING"))
+            await asyncio.sleep(self.ping_interval)
+
+    async def __client_receive_handler(self, connection: Connection, reader: asyncio.StreamReader) -> None:
+        """
+        Receives messages from the clients and saves it as events
+
+        :param connection: Connection of the user/client
+        :param reader: Stream of the user/client
+        """
+        user_id = connection.user_id
+        decoder = FrameDecoder()
+
+        while self.__running and not connection.closed:
+            try:
+                data = await reader.read(READ_SIZE)
+
+                if data == b"":
+                    raise ConnectionResetError  # to disconnect the user (event)
+
+                frames = decoder.feed(data)
+                received = time()
+                connection.seen()
+
+            except (ConnectionResetError, asyncio.IncompleteReadError, FrameError):
+                self._print(f"USER DISCONNECTED: {user_id}")
+                return
 
             except OSError:
                 return
 
-        self._print(f"DISCONNECT USER: {user_id}")
-        client.close()
+            for frame in frames:
+                if frame.kind != FrameKind.JSON:
+                    continue
 
-    def __new_clients(self) -> None:
+                try:
+                    self.__handle_message(user_id, json.loads(str(frame.payload, ENCRYPTION)), received)
+
+                except (json.decoder.JSONDecodeError, UnicodeDecodeError, KeyError):
+                    continue
+
+                except (MultipleDataReceivedError, NotImplementedError) as error:
+                    self._print(f"{user_id}: {error}", min_debug=2)
+                    continue
+
+    def __handle_message(self, user_id: str, msg: dict, received: float) -> None:
         """
-        Looks for new clients and assigns them a new thread
+        Saves a received message as event
+
+        :param user_id: ID of the user/client
+        :param msg: decoded message
+        :param received: time the message was received at
         """
-        while self.__running:
-            try:
-                cl, add = self.accept()
-            except OSError:
+        event = None
+
+        match msg["type"]:
+            case "shoot":
+                event = UserShoot(
+                    user_id=user_id,
+                    time=self.server_time(user_id, msg["time"]),
+                    msg=msg["content"],
+                    received=received,
+                )
+
+            case "respawn":
+                event = UserRespawn(user_id=user_id, time=msg["time"])
+
+            case "PING":
+                self.send_user(user_id, ClockSync.reply(msg["content"], received, time()), "PONG")
                 return
 
-            user_id = "user_{:03d}".format(self.__id_counter)
-            self.__clients[user_id] = cl
-            self._print("NEW CLIENT: ", user_id, cl, add)
+            case "PONG":
+                self.__clients[user_id].clock.response(msg["content"], received)
+                return
 
-            self.send_user(user_id, user_id, "ID")
-            if self.game_map:
-                self.send_user(user_id, self.game_map, "map")
-            self.__events.append(UserRem(user_id=user_id, time=time()))
-            Thread(target=self.__client_receive_handler, args=(user_id, cl,)).start()
+            case "hello":
+                # choose the snapshot format (older clients don't say hello and get json)
+                connection = self.__clients[user_id]
+                offered = msg["content"].get("formats", ())
+                chosen = next((f for f in FORMATS if f in offered), "json")
+                connection.format = chosen
+                connection.state = ConnectionState.ACTIVE
+                self.send_user(user_id, {"format": chosen}, "hello")
+
+                # the map is only sent if the client doesn't have it cached
+                maps = msg["content"].get("maps", ())
+                if isinstance(maps, list):
+                    connection.maps = set(filter(valid_map_id, maps[:MAX_MAPS]))
+
+                self.__send_map(connection)
+                return
+
+            case "get_map":
+                # the client lost its cached map
+                connection = self.__clients[user_id]
+                map_id = msg["content"]["hash"]
+                if valid_map_id(map_id):
+                    connection.maps.discard(map_id)
+
+                self.__send_map(connection)
+                return
+
+            case "ack":
+                # None: the client lost its baseline, send a keyframe
+                connection = self.__clients[user_id]
+                sequence = msg["content"]["sequence"]
+                if sequence is None:
+                    connection.ack = None
+
+                else:
+                    connection.ack = max(sequence, connection.ack or 0)
+
+                return
 
-            self.__id_counter += 1
+            case _:
+                raise NotImplementedError(f"Unknown event type: {msg['type']}")
+
+        if self.__events.pending(user_id):
+            raise MultipleDataReceivedError("Client already sent data")
+
+        if event:
+            self.__put_event(event)
+        self._print(f"{user_id} SENT: {msg}", min_debug=2)
+
+    def __put_event(self, event: Union[UserAdd, UserRem, UserShoot, UserRespawn]) -> None:
+        try:
+            # connects and disconnects must never get lost
+            self.__events.put(event, force=type(event) in (UserAdd, UserRem))
+
+        except EventQueueFull as error:
+            self._print(f"dropped {event}: {error}")
 
     def _print(self, *msg: any, min_debug: int | None = 1) -> None:
         """
@@ -269,10 +609,13 @@ class Server(socket.socket):
 
     def end(self) -> None:
         """
-        Close all connections to the clients/users and end the new_clients-Thread
+        Close all connections to the clients/users and stop the event loop
         """
+        if not self.__running:
+            return
+
         self.__running = False
-        self.close()
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
 
 
 if __name__ == "__main__":
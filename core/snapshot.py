@@ -0,0 +1,373 @@
+"""
+core/snapshot.py
+
+state of all balls as sent to the clients, with a compact binary
+wire format (fixed size records, quantized positions and velocities).
+json is kept as fallback for clients that don't support it
+
+binary snapshots are numbered, a snapshot is either a keyframe (all balls)
+or a delta against an older snapshot the client acknowledged (baseline)
+
+Author:
+Nilusink
+"""
+from collections import deque
+from dataclasses import dataclass
+from functools import lru_cache
+from threading import Lock
+import numpy as np
+import struct
+import re
+
+
+SNAPSHOT_VERSION: int = 3
+FORMATS: tuple[str, ...] = ("binary", "json")   # by preference
+
+# version, flags, number of balls, sequence, baseline, number of removed balls,
+# simulation tick, server time
+HEADER = struct.Struct("<BBHIIHId")
+RECORD = np.dtype([
+    ("id", "<u4"),
+    ("x", "<u2"),           # 0..1 (client units) -> 0..65535
+    ("y", "<u2"),
+    ("vx", "<i2"),          # map units / second * VELOCITY_STEPS
+    ("vy", "<i2"),
+    ("tries", "<u2"),
+    ("flags", "u1"),
+])
+
+POSITION_STEPS: int = 0xffff
+VELOCITY_STEPS: int = 1 << 12   # +-8 map units / second
+
+FLAG_ON_TARGET: int = 1     # record flags
+FLAG_DELTA: int = 1         # header flags, only changes since the baseline
+
+_USER_ID = re.compile(r"(\d+)$")
+
+
+class SnapshotError(ValueError):
+    """
+    a snapshot can't be decoded
+    """
+
+
+class MissingBaseline(SnapshotError):
+    """
+    a delta snapshot is based on a state the decoder doesn't know (anymore)
+    """
+
+
+@lru_cache(maxsize=4096)
+def user_number(user_id: str) -> int:
+    """
+    integer id of a user ("user_007" -> 7)
+    """
+    match = _USER_ID.search(user_id)
+    if match is None:
+        raise ValueError(f"user id without a number: {user_id!r}")
+
+    return int(match.group(1))
+
+
+def user_id(number: int) -> str:
+    """
+    inverse of user_number
+    """
+    return "user_{:03d}".format(number)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """
+    state of all balls at one point in time (map units)
+    """
+    ids: tuple[str, ...]
+    positions: np.ndarray   # (n, 2) top left corner of each ball
+    velocities: np.ndarray  # (n, 2)
+    tries: np.ndarray       # (n,)
+    on_target: np.ndarray   # (n,)
+    tick: int = 0           # simulation tick the snapshot was taken at
+    time: float = 0.        # server time (unix timestamp)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_dict(cls, dictionary: dict) -> "Snapshot":
+        """
+        inverse of to_dict
+        """
+        balls = dictionary["balls"]
+        n = len(balls)
+
+        return cls(
+            ids=tuple(ball["id"] for ball in balls),
+            positions=np.array([(ball["x"] * 2, ball["y"]) for ball in balls], dtype=np.float64).reshape(n, 2),
+            velocities=np.array([ball["vel"] for ball in balls], dtype=np.float64).reshape(n, 2),
+            tries=np.array([ball["tries"] for ball in balls], dtype=np.int32),
+            on_target=np.array([ball["on_target"] for ball in balls], dtype=np.bool_),
+            tick=dictionary.get("tick", 0),
+            time=dictionary.get("time", 0.),
+        )
+
+    def to_dict(self) -> dict:
+        """
+        the snapshot as it's sent in json
+        """
+        return {
+            "tick": self.tick,
+            "time": self.time,
+            "balls": [
+                {
+                    "id": ball_id,
+                    "x": x / 2,
+                    "y": y,
+                    "vel": (vx, vy),
+                    "tries": tries,
+                    "on_target": on_target,
+                }
+                for ball_id, (x, y), (vx, vy), tries, on_target in zip(
+                    self.ids,
+                    self.positions.tolist(),
+                    self.velocities.tolist(),
+                    self.tries.tolist(),
+                    self.on_target.tolist(),
+                )
+            ]
+        }
+
+
+def _to_records(snapshot: Snapshot) -> np.ndarray:
+    """
+    quantize a snapshot, sorted by id
+    """
+    n = len(snapshot)
+    records = np.empty(n, dtype=RECORD)
+    records["id"] = np.fromiter(map(user_number, snapshot.ids), dtype=np.uint32, count=n)
+
+    positions = np.clip(snapshot.positions * (.5, 1), 0, 1) * POSITION_STEPS
+    records["x"] = np.rint(positions[:, 0])
+    records["y"] = np.rint(positions[:, 1])
+
+    velocities = np.clip(np.rint(snapshot.velocities * VELOCITY_STEPS), -0x8000, 0x7fff)
+    records["vx"] = velocities[:, 0]
+    records["vy"] = velocities[:, 1]
+
+    records["tries"] = np.clip(snapshot.tries, 0, 0xffff)
+    records["flags"] = np.where(snapshot.on_target, FLAG_ON_TARGET, 0)
+
+    return records[np.argsort(records["id"], kind="stable")]
+
+
+def _from_records(records: np.ndarray, tick: int, time: float) -> Snapshot:
+    n = len(records)
+
+    positions = np.empty((n, 2), dtype=np.float64)
+    positions[:, 0] = records["x"] * (2 / POSITION_STEPS)
+    positions[:, 1] = records["y"] * (1 / POSITION_STEPS)
+
+    velocities = np.empty((n, 2), dtype=np.float64)
+    velocities[:, 0] = records["vx"] * (1 / VELOCITY_STEPS)
+    velocities[:, 1] = records["vy"] * (1 / VELOCITY_STEPS)
+
+    return Snapshot(
+        ids=tuple(map(user_id, records["id"].tolist())),
+        positions=positions,
+        velocities=velocities,
+        tries=records["tries"].astype(np.int32),
+        on_target=(records["flags"] & FLAG_ON_TARGET).astype(np.bool_),
+        tick=tick,
+        time=time,
+    )
+
+
+def _pack(
+        sequence: int,
+        baseline: int | None,
+        records: np.ndarray,
+        tick: int,
+        time: float,
+        removed: np.ndarray | None = None,
+) -> bytes:
+    if len(records) > 0xffff or (removed is not None and len(removed) > 0xffff):
+        raise ValueError(f"too many balls for one snapshot ({len(records)})")
+
+    tick &= 0xffffffff
+    if baseline is None:
+        header = HEADER.pack(SNAPSHOT_VERSION, 0, len(records), sequence, 0, 0, tick, time)
+        return header + records.tobytes()
+
+    header = HEADER.pack(
+        SNAPSHOT_VERSION, FLAG_DELTA, len(records), sequence, baseline, len(removed), tick, time,
+    )
+    return header + records.tobytes() + removed.astype("<u4").tobytes()
+
+
+def _unpack(data: bytes | memoryview) -> tuple[int, int | None, np.ndarray, np.ndarray, int, float]:
+    """
+    :return: sequence, baseline (None for keyframes), records, removed ids, tick and time
+    """
+    if len(data) < HEADER.size:
+        raise SnapshotError("snapshot too short")
+
+    version, flags, n, sequence, baseline, n_removed, tick, time = HEADER.unpack_from(data)
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"unsupported snapshot version {version}")
+
+    if len(data) != HEADER.size + n * RECORD.itemsize + n_removed * 4:
+        raise SnapshotError("snapshot size doesn't match its number of balls")
+
+    records = np.frombuffer(data, dtype=RECORD, count=n, offset=HEADER.size)
+    removed = np.frombuffer(data, dtype="<u4", count=n_removed, offset=HEADER.size + n * RECORD.itemsize)
+
+    return sequence, baseline if flags & FLAG_DELTA else None, records, removed, tick, time
+
+
+def encode_snapshot(snapshot: Snapshot, sequence: int = 0) -> bytes:
+    """
+    binary encoding of a snapshot (keyframe)
+    """
+    return _pack(sequence, None, _to_records(snapshot), snapshot.tick, snapshot.time)
+
+
+def decode_snapshot(data: bytes | memoryview) -> Snapshot:
+    """
+    inverse of encode_snapshot (up to the quantization)
+    """
+    _sequence, baseline, records, _removed, tick, time = _unpack(data)
+    if baseline is not None:
+        raise SnapshotError("delta snapshot needs a SnapshotDecoder")
+
+    return _from_records(records, tick, time)
+
+
+class SnapshotEncoder:
+    """
+    server side: numbers the snapshots and encodes them relative to
+    a baseline (the last snapshot a client acknowledged).
+    balls that didn't change since the baseline aren't sent
+    """
+    sequence: int
+    history: int
+    _records: dict[int, np.ndarray]
+    _cache: dict[int | None, bytes]
+
+    def __init__(self, history: int = 32) -> None:
+        """
+        :param history: number of snapshots that can be used as baseline
+        """
+        self.history = history
+        self.sequence = 0
+        self._records = {}
+        self._cache = {}
+        self._clock = (0, 0.)
+        self._lock = Lock()
+
+    def push(self, snapshot: Snapshot) -> int:
+        """
+        add the newest snapshot
+
+        :return: its sequence number
+        """
+        records = _to_records(snapshot)
+
+        with self._lock:
+            self.sequence += 1
+            self._records[self.sequence] = records
+            self._records.pop(self.sequence - self.history, None)
+            self._clock = snapshot.tick, snapshot.time
+            self._cache = {}
+
+            return self.sequence
+
+    def has_baseline(self, sequence: int | None) -> bool:
+        return sequence in self._records and sequence != self.sequence
+
+    def encode(self, baseline: int | None = None) -> bytes:
+        """
+        encode the newest snapshot, the bytes are cached per baseline
+
+        :param baseline: sequence the delta is based on, None (or an unknown one) for a keyframe
+        """
+        with self._lock:
+            if not self.has_baseline(baseline):
+                baseline = None
+
+            data = self._cache.get(baseline)
+            if data is not None:
+                return data
+
+            current = self._records[self.sequence]
+            tick, time = self._clock
+            if baseline is None:
+                data = _pack(self.sequence, None, current, tick, time)
+
+            else:
+                old = self._records[baseline]
+                _common, ci, oi = np.intersect1d(
+                    current["id"], old["id"], assume_unique=True, return_indices=True,
+                )
+
+                changed = np.ones(len(current), dtype=np.bool_)
+                changed[ci] = current[ci] != old[oi]
+                removed = np.setdiff1d(old["id"], current["id"], assume_unique=True)
+
+                data = _pack(self.sequence, baseline, current[changed], tick, time, removed)
+
+            self._cache[baseline] = data
+            return data
+
+
+class SnapshotDecoder:
+    """
+    client side: rebuilds the full states from keyframes and deltas
+    """
+    sequence: int | None
+    history: int
+    _records: dict[int, np.ndarray]
+    _order: deque[int]
+
+    def __init__(self, history: int = 64) -> None:
+        """
+        :param history: number of decoded states kept as possible baselines
+        """
+        self.history = history
+        self.sequence = None
+        self._records = {}
+        self._order = deque()
+
+    def decode(self, data: bytes | memoryview) -> Snapshot:
+        """
+        :raises MissingBaseline: if a delta is based on an unknown state
+        """
+        sequence, baseline, records, removed, tick, time = _unpack(data)
+
+        if baseline is not None:
+            old = self._records.get(baseline)
+            if old is None:
+                raise MissingBaseline(f"unknown baseline {baseline}")
+
+            # keep the unchanged balls of the baseline, add the changed ones
+            keep = ~np.isin(old["id"], records["id"]) & ~np.isin(old["id"], removed)
+            records = np.concatenate((old[keep], records))
+            records = records[np.argsort(records["id"], kind="stable")]
+
+        else:
+            records = records.copy()    # don't keep the received buffer
+
+        if sequence not in self._records:
+            self._order.append(sequence)
+        self._records[sequence] = records
+
+        # sequences can be skipped, drop everything that's too old
+        while self._order and (self._order[0] <= sequence - self.history or len(self._order) > self.history):
+            del self._records[self._order.popleft()]
+
+        self.sequence = sequence
+
+        return _from_records(records, tick, time)
+
+    def clear(self) -> None:
+        self._records.clear()
+        self._order.clear()
+        self.sequence = None
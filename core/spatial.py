@@ -0,0 +1,116 @@
+"""
+core/spatial.py
+
+uniform grid for looking up objects by their bounding box (map units)
+
+Author:
+Nilusink
+"""
+import typing as tp
+import math
+
+
+Bounds = tuple[float, float, float, float]  # min x, min y, max x, max y
+T = tp.TypeVar("T")
+
+
+class UniformGrid(tp.Generic[T]):
+    """
+    every object is stored in all cells its bounding box touches
+    """
+    cell_size: float
+    _cells: dict[tuple[int, int], list[T]]
+    _items: dict[T, list[tuple[int, int]]]
+    _extent: tuple[int, int, int, int] | None   # cells ever used (min x, min y, max x, max y)
+
+    def __init__(self, cell_size: float = .1) -> None:
+        if cell_size <= 0:
+            raise ValueError("cell_size must be greater than 0")
+
+        self.cell_size = cell_size
+        self._cells = {}
+        self._items = {}
+        self._extent = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, item: T) -> bool:
+        return item in self._items
+
+    def _cell_range(self, bounds: Bounds, clip: bool = False) -> tp.Iterator[tuple[int, int]]:
+        """
+        all cells touched by the bounds
+
+        :param clip: only cells inside the extent of the grid (there are
+            no objects outside), so huge bounds don't cost anything
+        """
+        x0, y0, x1, y1 = bounds
+        size = self.cell_size
+
+        ix0, iy0 = math.floor(x0 / size), math.floor(y0 / size)
+        ix1, iy1 = math.floor(x1 / size), math.floor(y1 / size)
+
+        if clip:
+            if self._extent is None:
+                return
+
+            ex0, ey0, ex1, ey1 = self._extent
+            ix0, iy0 = max(ix0, ex0), max(iy0, ey0)
+            ix1, iy1 = min(ix1, ex1), min(iy1, ey1)
+
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                yield ix, iy
+
+    def insert(self, item: T, bounds: Bounds) -> None:
+        """
+        add an object (or move it, if it already is in the grid)
+        """
+        if item in self._items:
+            self.remove(item)
+
+        cells = list(self._cell_range(bounds))
+        for cell in cells:
+            self._cells.setdefault(cell, []).append(item)
+
+        self._items[item] = cells
+
+        # the extent only grows (until clear)
+        if cells:
+            xs = [ix for ix, _ in cells]
+            ys = [iy for _, iy in cells]
+            if self._extent is not None:
+                ex0, ey0, ex1, ey1 = self._extent
+                xs += [ex0, ex1]
+                ys += [ey0, ey1]
+
+            self._extent = min(xs), min(ys), max(xs), max(ys)
+
+    def remove(self, item: T) -> None:
+        """
+        remove an object, does nothing if it isn't in the grid
+        """
+        for cell in self._items.pop(item, ()):
+            items = self._cells[cell]
+            items.remove(item)
+
+            if not items:
+                del self._cells[cell]
+
+    def clear(self) -> None:
+        self._cells.clear()
+        self._items.clear()
+        self._extent = None
+
+    def query(self, bounds: Bounds) -> list[T]:
+        """
+        all objects whose cells overlap the bounds (each one only once)
+        """
+        found: dict[T, None] = {}
+        cells = self._cells
+        for cell in self._cell_range(bounds, clip=True):
+            for item in cells.get(cell, ()):
+                found[item] = None
+
+        return list(found)
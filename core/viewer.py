@@ -0,0 +1,117 @@
+"""
+core/viewer.py
+
+optional debug window for the server, draws the simulation state.
+only importing this module doesn't open a window
+
+Author:
+Nilusink
+"""
+from .objects import Walls, Balls, Targets, Wall, EllipseWall, Target
+from .basegame import BaseGame
+import typing as tp
+import pygame as pg
+
+
+class DebugViewer:
+    base: BaseGame
+
+    def __init__(self, window_size: tuple[int, int] = (1500, 750), fps: int = 60) -> None:
+        self.base = BaseGame(window_size)
+        self.fps = fps
+        self._clock = pg.time.Clock()
+
+    def to_screen_size(self, x: float, y: float) -> tuple[float, float]:
+        """
+        convert from "percent" scheme to actual screen pixels
+        """
+        x = (x/2) * self.base.window_size[0]
+        y *= self.base.window_size[1]
+
+        return x, y
+
+    def draw_wall(self, wall: Wall | EllipseWall) -> None:
+        if isinstance(wall, EllipseWall):
+            x, y = self.to_screen_size(wall.x, wall.y)
+            width, height = self.to_screen_size(wall.width, wall.height)
+            pg.draw.ellipse(
+                self.base.wall_layer,
+                (255, 0, 0, 255),
+                pg.Rect(x, y, width, height),
+                width=wall.thickness,
+            )
+            return
+
+        pg.draw.line(
+            self.base.wall_layer,
+            (255, 0, 0, 255),
+            self.to_screen_size(*wall.p0.xy),
+            self.to_screen_size(*wall.p1.xy),
+            width=wall.thickness,
+        )
+
+    def draw_ball(self, ball_id: str, position: tuple[float, float], radius: float) -> None:
+        """
+        :param position: top left corner of the ball
+        """
+        center = self.to_screen_size(position[0] + radius, position[1] + radius)
+        radius = self.to_screen_size(radius, 0)[0]
+        pg.draw.circle(self.base.middle_layer, (255, 0, 0, 255), center, radius)
+
+        text = self.base.font.render(ball_id[-1], False, (0, 0, 0, 255))
+        self.base.middle_layer.blit(text, (center[0] - radius + 6, center[1] - radius + 5))
+
+    def draw_target(self, target: Target) -> None:
+        center = self.to_screen_size(*target.position.xy)
+        radius = self.to_screen_size(target.radius, 0)[0]
+        pg.draw.circle(self.base.lowest_layer, (255, 255, 0, 255), center, radius)
+
+    def draw(self) -> None:
+        """
+        draw one frame
+        """
+        base = self.base
+
+        # clear layers
+        base.screen.fill((0, 0, 0, 0))
+        base.lowest_layer.fill((0, 0, 0, 0))
+        base.wall_layer.fill((0, 0, 0, 0))
+        base.middle_layer.fill((0, 0, 0, 0))
+        base.top_layer.fill((0, 0, 0, 0))
+
+        # draw groups
+        for wall in Walls.sprites():
+            self.draw_wall(wall)
+
+        # balls from the published state (consistent, doesn't block the physics)
+        snapshot = Balls.world.published
+        for ball_id, position in zip(snapshot.ids, snapshot.positions.tolist()):
+            self.draw_ball(ball_id, position, Balls.world.radius)
+
+        for target in Targets.sprites():
+            self.draw_target(target)
+
+        # draw to draw
+        for function, args in base.to_draw:
+            function(*args)
+
+        # draw layers
+        base.screen.blit(base.lowest_layer, (0, 0))
+        base.screen.blit(base.wall_layer, (0, 0))
+        base.screen.blit(base.middle_layer, (0, 0))
+        base.screen.blit(base.top_layer, (0, 0))
+
+        pg.display.flip()
+
+    def run(self, running: tp.Callable[[], bool]) -> None:
+        """
+        draw frames (capped at fps) until running returns False
+        or the window is closed
+        """
+        while running():
+            for event in pg.event.get():
+                if event.type == pg.QUIT:
+                    return
+
+            self.draw()
+            self._clock.tick(self.fps)
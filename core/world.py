@@ -0,0 +1,556 @@
+"""
+core/world.py
+
+state of all balls, stored as contiguous arrays (one row per ball)
+so the physics can be done for all balls at once
+
+Author:
+Nilusink
+"""
+from .snapshot import Snapshot
+from threading import RLock
+from time import time
+from .classes import Vec2
+import typing as tp
+import numpy as np
+
+
+if tp.TYPE_CHECKING:
+    from .objects import Ball, _Walls, _Targets
+
+
+class BallWorld:
+    """
+    in tick mode (step) positions and velocities are the current state.
+    in event mode (see core/eventsim.py) they are the state at the start
+    of each ball's trajectory, the current state is calculated from them
+    """
+    positions: np.ndarray   # (n, 2) top left corner of each ball
+    velocities: np.ndarray  # (n, 2)
+    origins: np.ndarray     # (n, 2) reset positions
+    tries: np.ndarray       # (n,)
+    on_target: np.ndarray   # (n,)
+    start_times: np.ndarray # (n,) event mode: start of the current trajectory
+    end_times: np.ndarray   # (n,) event mode: next event of the ball
+    views: list["Ball"]     # the Ball object belonging to each row
+    count: int
+    active_count: int       # rows 0..active_count are awake, the rest sleeps
+    tick: int               # number of simulated ticks
+    published: Snapshot     # state after the last tick, replaced (never changed) by publish
+    _ids: tuple[str, ...] | None    # cached ids of the rows (None: changed)
+
+    # event mode: current simulation time and a callback for changed balls
+    clock: tp.Callable[[], float] | None = None
+    on_change: tp.Callable[["Ball"], None] | None = None
+
+    # called with every published snapshot
+    on_publish: tp.Callable[[Snapshot], None] | None = None
+
+    _arrays: tuple[str, ...] = (
+        "positions", "velocities", "origins", "tries", "on_target", "start_times", "end_times",
+    )
+
+    def __init__(
+            self,
+            radius: float,
+            deceleration: float,
+            capacity: int = 16,
+            max_bounces: int = 8,
+    ) -> None:
+        """
+        :param radius: radius of a ball (map units)
+        :param deceleration: speed lost per second
+        :param capacity: initial number of rows
+        :param max_bounces: maximum wall contacts per ball and tick
+        """
+        self.radius = radius
+        self.deceleration = deceleration
+        self.max_bounces = max_bounces
+        self.lock = RLock()
+
+        self.count = 0
+        self.active_count = 0
+        self.tick = 0
+        self.views = []
+        self._ids = None
+        self._allocate(capacity)
+        self.publish()
+
+    def _allocate(self, capacity: int) -> None:
+        """
+        (re-)allocate the arrays, keeping the current rows
+        """
+        n = self.count
+
+        def grow(old: np.ndarray | None, shape: tuple, dtype) -> np.ndarray:
+            new = np.zeros(shape, dtype=dtype)
+            if old is not None:
+                new[:n] = old[:n]
+
+            return new
+
+        self.positions = grow(getattr(self, "positions", None), (capacity, 2), np.float64)
+        self.velocities = grow(getattr(self, "velocities", None), (capacity, 2), np.float64)
+        self.origins = grow(getattr(self, "origins", None), (capacity, 2), np.float64)
+        self.tries = grow(getattr(self, "tries", None), (capacity,), np.int32)
+        self.on_target = grow(getattr(self, "on_target", None), (capacity,), np.bool_)
+        self.start_times = grow(getattr(self, "start_times", None), (capacity,), np.float64)
+        self.end_times = grow(getattr(self, "end_times", None), (capacity,), np.float64)
+
+    # ball management
+    def add(self, ball: "Ball", origin: Vec2) -> int:
+        """
+        add a new row for a ball
+
+        :return: index of the row
+        """
+        with self.lock:
+            if self.count == len(self.positions):
+                self._allocate(len(self.positions) * 2)
+
+            index = self.count
+            self.positions[index] = origin.xy
+            self.origins[index] = origin.xy
+            self.velocities[index] = 0
+            self.tries[index] = 0
+            self.on_target[index] = False
+            self.start_times[index] = self.clock() if self.clock is not None else 0
+            self.end_times[index] = np.inf
+
+            self.views.append(ball)
+            self.count += 1
+            self._ids = None
+
+            return index
+
+    @property
+    def sleeping_count(self) -> int:
+        return self.count - self.active_count
+
+    def _swap(self, i: int, j: int) -> None:
+        """
+        swap two rows (and update the views)
+        """
+        if i == j:
+            return
+
+        for name in self._arrays:
+            array = getattr(self, name)
+            array[[i, j]] = array[[j, i]]
+
+        views = self.views
+        views[i], views[j] = views[j], views[i]
+        self._ids = None
+        views[i]._index = i
+        views[j]._index = j
+
+    def wake(self, index: int) -> int:
+        """
+        move a ball into the awake partition
+
+        :return: the new index of the ball
+        """
+        with self.lock:
+            if index >= self.active_count:
+                self._swap(index, self.active_count)
+                index = self.active_count
+                self.active_count += 1
+
+            return index
+
+    def sleep(self, index: int) -> int:
+        """
+        move a ball into the sleeping partition, it won't be simulated
+        until it gets woken up again
+
+        :return: the new index of the ball
+        """
+        with self.lock:
+            if index < self.active_count:
+                self.active_count -= 1
+                self._swap(index, self.active_count)
+                index = self.active_count
+
+            return index
+
+    def wake_all(self) -> None:
+        with self.lock:
+            self.active_count = self.count
+
+    def remove(self, ball: "Ball") -> None:
+        """
+        remove the row of a ball, the last row is moved into the gap
+        """
+        with self.lock:
+            index = self.sleep(ball._index)
+            last = self.count - 1
+
+            if index != last:
+                for name in self._arrays:
+                    array = getattr(self, name)
+                    array[index] = array[last]
+
+                moved = self.views[last]
+                self.views[index] = moved
+                moved._index = index
+
+            self.views.pop()
+            self.count -= 1
+            self._ids = None
+            ball._index = -1
+
+            if self.on_change is not None:
+                self.on_change(ball)
+
+    def hit(
+            self,
+            index: int,
+            velocity: Vec2,
+            elapsed: float = 0.,
+            walls: "_Walls | None" = None,
+    ) -> bool:
+        """
+        give a resting ball a new velocity
+
+        :param elapsed: the hit happened this many seconds ago, the ball
+            is moved to where it would be by now
+        :param walls: walls to bounce off while catching up (tick mode)
+        :return: if the ball could be hit
+        """
+        with self.lock:
+            if self.velocities[index].any():
+                return False
+
+            self.tries[index] += 1
+            self.velocities[index] = velocity.xy
+
+            # tick mode: move the ball to where it is by now,
+            # event mode: start the trajectory in the past
+            if elapsed > 0 and self.clock is None:
+                if not self._fast_forward(index, elapsed, walls):
+                    self.reset(index)
+                    return True
+
+            self._changed(index, elapsed)
+            return True
+
+    def _fast_forward(self, index: int, elapsed: float, walls: "_Walls | None") -> bool:
+        """
+        move a single ball along its trajectory (balls don't collide with
+        each other, so the others don't have to be rewound)
+
+        :return: False if the ball left the field
+        """
+        velocity = self.velocities[index]
+        speed = float(np.hypot(*velocity))
+        if speed == 0:
+            return True
+
+        if self.deceleration > 0:
+            elapsed = min(elapsed, speed / self.deceleration)
+
+        new_speed = max(speed - self.deceleration * elapsed, 0)
+        travel = (speed + new_speed) / 2 * elapsed
+        dx, dy = (velocity / speed).tolist()
+
+        cx, cy = (self.positions[index] + self.radius).tolist()
+        res = None
+        if walls is not None:
+            res = self._sweep(walls, (cx, cy), (dx, dy), travel)
+
+        if res is None:
+            cx += dx * travel
+            cy += dy * travel
+
+        else:
+            (cx, cy), (dx, dy) = res
+
+        x, y = cx - self.radius, cy - self.radius
+        self.positions[index] = (x, y)
+        self.velocities[index] = (dx * new_speed, dy * new_speed)
+
+        return 0 <= x <= 2 and 0 <= y <= 1
+
+    def move(self, index: int, position: Vec2) -> None:
+        """
+        put a ball somewhere else, keeping its velocity
+        """
+        with self.lock:
+            if self.clock is not None:
+                # start a new trajectory with the current velocity
+                _, self.velocities[index] = self.state_at(self.clock(), index)
+
+            self.positions[index] = position.xy
+            self._changed(index)
+
+    def set_state(
+            self,
+            index: int,
+            position: tuple[float, float],
+            velocity: tuple[float, float],
+            on_target: bool = False,
+    ) -> None:
+        """
+        overwrite the state of a ball (e.g. with the one from the server)
+        """
+        with self.lock:
+            self.positions[index] = position
+            self.velocities[index] = velocity
+            self.on_target[index] = on_target
+            self._changed(index)
+
+    def reset(self, index: int | np.ndarray) -> None:
+        """
+        put balls back to their origin
+        """
+        with self.lock:
+            self.positions[index] = self.origins[index]
+            self.velocities[index] = 0
+            self.on_target[index] = False
+
+            # waking up balls can move rows around
+            for ball in [self.views[i] for i in np.atleast_1d(index).tolist()]:
+                self._changed(ball._index)
+
+    def _changed(self, index: int, elapsed: float = 0.) -> None:
+        """
+        a ball got a new trajectory from outside the simulation
+
+        :param elapsed: event mode: the trajectory started this many seconds ago
+        """
+        index = self.wake(index)
+
+        if self.clock is not None:
+            self.start_times[index] = self.clock() - elapsed
+            self.end_times[index] = np.inf
+
+        if self.on_change is not None:
+            self.on_change(self.views[index])
+
+    def state_at(
+            self,
+            t: float,
+            index: int | slice | np.ndarray = ...,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """
+        event mode: evaluate the trajectories of balls at time t
+        (never past their next event)
+
+        :return: positions and velocities
+        """
+        with self.lock:
+            if index is ...:
+                index = slice(0, self.count)
+
+            positions = self.positions[index].copy()
+            velocities = self.velocities[index].copy()
+            on_target = self.on_target[index]
+            start = self.start_times[index]
+
+            dt = np.clip(np.minimum(t, self.end_times[index]) - start, 0, None)
+
+        speeds = np.hypot(velocities[..., 0], velocities[..., 1])
+        moving = ~on_target & (speeds > 0)
+        if not np.any(moving):
+            return positions, velocities
+
+        speeds = np.where(moving, speeds, 1)
+        if self.deceleration > 0:
+            dt = np.minimum(dt, speeds / self.deceleration)
+
+        new_speeds = np.where(moving, speeds - self.deceleration * dt, 0)
+        travel = np.where(moving, (speeds + new_speeds) / 2 * dt, 0)
+        directions = velocities / speeds[..., None]
+
+        positions += directions * travel[..., None]
+        velocities = np.where(moving[..., None], directions * new_speeds[..., None], velocities)
+
+        return positions, velocities
+
+    def snapshot(self, tick: int = 0, time: float = 0.) -> Snapshot:
+        """
+        copy of the current state of all balls, the arrays are read-only
+
+        :param tick: simulation tick, stored in the snapshot
+        :param time: server time, stored in the snapshot
+        """
+        with self.lock:
+            n = self.count
+            if self.clock is not None:
+                positions, velocities = self.state_at(self.clock())
+
+            else:
+                positions = self.positions[:n].copy()
+                velocities = self.velocities[:n].copy()
+
+            arrays = positions, velocities, self.tries[:n].copy(), self.on_target[:n].copy()
+            if self._ids is None:
+                self._ids = tuple(ball.id for ball in self.views)
+
+            ids = self._ids
+
+        for array in arrays:
+            array.flags.writeable = False
+
+        positions, velocities, tries, on_target = arrays
+        return Snapshot(
+            ids=ids,
+            positions=positions,
+            velocities=velocities,
+            tries=tries,
+            on_target=on_target,
+            tick=tick,
+            time=time,
+        )
+
+    def publish(self, tick: int | None = None) -> Snapshot:
+        """
+        take a snapshot and make it the published one.
+        readers only ever see complete ticks and never need the lock
+
+        :param tick: defaults to the number of simulated ticks
+        """
+        snapshot = self.snapshot(tick=self.tick if tick is None else tick, time=time())
+        self.published = snapshot
+
+        if self.on_publish is not None:
+            self.on_publish(snapshot)
+
+        return snapshot
+
+    # simulation
+    def step(self, delta: float, walls: "_Walls", targets: "_Targets") -> None:
+        """
+        advance all awake balls by delta seconds, balls that come to rest
+        are put to sleep. publishes the new state
+        """
+        with self.lock:
+            self._step(delta, walls, targets)
+            self.tick += 1
+            self.publish()
+
+    def _step(self, delta: float, walls: "_Walls", targets: "_Targets") -> None:
+        with self.lock:
+            n = self.active_count
+            if n == 0:
+                return
+
+            positions = self.positions[:n]
+            velocities = self.velocities[:n]
+            on_target = self.on_target[:n]
+
+            speeds = np.hypot(velocities[:, 0], velocities[:, 1])
+            self._capture(targets, speeds)
+
+            moving = np.flatnonzero(~on_target & (speeds > 0))
+            if len(moving):
+                # move (with constant deceleration) and slow down
+                old_speeds = speeds[moving]
+                new_speeds = np.maximum(old_speeds - self.deceleration * delta, 0)
+                if self.deceleration > 0:
+                    travel = (old_speeds + new_speeds) / 2 * np.minimum(delta, old_speeds / self.deceleration)
+
+                else:
+                    travel = old_speeds * delta
+
+                directions = velocities[moving] / old_speeds[:, None]
+                starts = positions[moving] + self.radius
+                positions[moving] += directions * travel[:, None]
+
+                # bounce off the walls on the way
+                for row, index in enumerate(moving.tolist()):
+                    res = self._sweep(walls, starts[row].tolist(), directions[row].tolist(), float(travel[row]))
+
+                    if res is not None:
+                        (cx, cy), directions[row] = res
+                        positions[index] = (cx - self.radius, cy - self.radius)
+
+                velocities[moving] = directions * new_speeds[:, None]
+                speeds[moving] = new_speeds
+
+                # check if the ball is out of screen
+                x = positions[moving, 0]
+                y = positions[moving, 1]
+                invalid = moving[(x < 0) | (x > 2) | (y < 0) | (y > 1)]
+                if len(invalid):
+                    self.reset(invalid)
+                    speeds[invalid] = 0
+
+            # balls that stopped (on the target or not) go to sleep
+            self._capture(targets, speeds)
+            resting = np.flatnonzero(on_target | (speeds == 0))
+            for index in resting[::-1].tolist():
+                self.sleep(index)
+
+    def _capture(self, targets: "_Targets", speeds: np.ndarray) -> None:
+        """
+        awake balls that (almost) stopped on a target are done
+        """
+        if not len(targets):
+            return
+
+        n = self.active_count
+        on_target = self.on_target[:n]
+        candidates = np.flatnonzero(~on_target & (speeds < .001))
+        if not len(candidates):
+            return
+
+        touching = targets.touching(self.positions[candidates] + self.radius, self.radius)
+        captured = candidates[touching]
+        if len(captured):
+            on_target[captured] = True
+
+            # user thinks it's still traveling
+            self.velocities[captured] = (1, 0)
+
+    def _sweep(
+            self,
+            walls: "_Walls",
+            start: tuple[float, float],
+            direction: tuple[float, float],
+            distance: float,
+    ) -> tuple[tuple[float, float], tuple[float, float]] | None:
+        """
+        move a single ball along its path, bouncing off every wall it meets
+
+        :param start: center of the ball
+        :param direction: unit vector
+        :return: None if no wall was hit, else the new center and direction
+        """
+        cx, cy = start
+        dx, dy = direction
+        remaining = distance
+
+        hit = False
+        for _ in range(self.max_bounces):
+            res = walls.sweep_circle(
+                Vec2.from_cartesian(cx, cy),
+                self.radius,
+                Vec2.from_cartesian(dx, dy),
+                remaining,
+            )
+
+            if res is None:
+                break
+
+            hit = True
+            t, _wall, contact = res
+            nx, ny = contact.normal.xy
+
+            # move to the contact (out of the wall if overlapping) and bounce
+            cx += dx * t + nx * contact.depth
+            cy += dy * t + ny * contact.depth
+            remaining -= t
+
+            dot = dx * nx + dy * ny
+            dx -= 2 * dot * nx
+            dy -= 2 * dot * ny
+
+        else:
+            # stuck in a corner, stop at the last contact
+            remaining = 0
+
+        if not hit:
+            return None
+
+        return (cx + dx * remaining, cy + dy * remaining), (dx, dy)
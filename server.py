@@ -3,50 +3,95 @@ server.py
 
 Runs the program, simulates collision and targets
 
+runs headless by default, start with "--viewer" to open a debug window
+
 Author:
 Nilusink
 """
 from core.server import Server, Thread, UserRem, UserAdd, UserShoot, UserRespawn
-from core.basegame import BaseGame
+from core.broadcaster import SnapshotBroadcaster
+from core.scheduler import TickScheduler
+from core.lagcomp import LagCompensator
+from core.snapshot import Snapshot
+from core.eventsim import EventSimulation
 from core.objects import *
+import argparse
 import time
 import json
 
 
+TICK_RATE: float = 60     # physics steps per second
+MAX_CATCH_UP: int = 5     # maximum steps to simulate back to back if lagging
+MAX_REWIND: float = .5    # late shots are fast-forwarded by at most this many seconds
+SNAPSHOT_RATE: float = 20 # snapshots per second while balls are moving
+IDLE_RATE: float = 1      # snapshots per second while all balls are at rest
+
+
 running: bool = True
 
 
-def main() -> None:
+def main(
+        viewer: bool = False,
+        tick_rate: float = TICK_RATE,
+        event_driven: bool = False,
+        snapshot_rate: float = SNAPSHOT_RATE,
+        idle_rate: float = IDLE_RATE,
+        max_rewind: float = MAX_REWIND,
+) -> None:
+    """
+    :param viewer: open a debug window showing the simulation
+    :param tick_rate: physics steps per second
+    :param event_driven: jump from event to event instead of fixed ticks
+    :param snapshot_rate: snapshots per second while balls are moving
+    :param idle_rate: snapshots per second while all balls are at rest
+    :param max_rewind: maximum lag compensation for shots in seconds (0 to disable)
+    """
     global running
 
     # load map
     with open("./Maps/Map1.json", "r") as inp:
         config = json.load(inp)
 
-    num_points = config["total"]
+    load_map(config)
 
-    # draw target
-    pos = config["target"]
-    Target(Vec2.from_cartesian(pos[0] * 2, pos[1]))
+    # Create Server
+    server = Server(debug_mode=True, game_map=config)
+    print("started server")
 
-    # draw walls
-    for i in range(1, num_points + 1):
-        points = config[str(i)]
-        p0 = Vec2.from_cartesian(points["p1_x"] * 2, points["p1_y"])
-        p1 = Vec2.from_cartesian(points["p2_x"] * 2, points["p2_y"])
+    scheduler = TickScheduler(tick_rate=tick_rate, max_catch_up=MAX_CATCH_UP)
+    simulation = None
+    if event_driven:
+        simulation = EventSimulation(Balls.world, Walls, Targets, publish_rate=tick_rate)
 
-        Wall(p0, p1, 1)
+    def take_snapshot() -> Snapshot:
+        # the state published by the physics after its last tick
+        return Balls.world.published
 
-    # Create Server
-    server = Server(debug_mode=True, game_map=config)
-    print("started server, running pygame")
+    lag_compensation = LagCompensator(max_rewind=max_rewind)
+
+    def world_time() -> float:
+        # tick mode: the state is the one of the last tick
+        if simulation is not None:
+            return time.time()
+
+        return Balls.world.published.time
+
+    broadcaster = SnapshotBroadcaster(
+        take_snapshot,
+        server.send_snapshot,
+        active_rate=snapshot_rate,
+        idle_rate=idle_rate,
+    )
+
+    # changes are only sent once the physics published them
+    Balls.world.on_publish = broadcaster.published
 
     def server_handler() -> None:
         """
         ment to be executed as thread
         """
         while running:
-            events = server.events
+            events = server.wait_events(timeout=.5)
 
             for event in events:
                 match event:
@@ -61,87 +106,101 @@ def main() -> None:
                     case UserShoot(user_id=_, time=_):
                         event: UserShoot
                         user = Balls.get_user(event.user_id)
-                        direction = Vec2.from_cartesian(*event.msg["vector"])
+                        if user is None:    # disconnected in the meantime
+                            continue
 
-                        direction.length *= MAX_SPEED
+                        # nan or inf would end up in the physics
+                        velocity = shot_velocity(event.msg["vector"])
+                        if velocity is None:
+                            continue
 
-                        user.hit(direction)
+                        lag_compensation.shoot(user, velocity, event.time, event.received, world_time())
 
                     case UserRespawn(user_id=_, time=_):
                         print("got respawn")
                         event: UserRespawn
 
                         user = Balls.get_user(event.user_id)
-                        user.reset()
+                        if user is not None:
+                            user.reset()
 
                     case _:
                         raise NotImplementedError(f"unknown event type {type(event)}")
 
+            # send the result with the next published state
+            if events:
+                broadcaster.poke(after_publish=True)
+
     def send_updates() -> None:
         """
         send updated ball positions to clients
         """
-        while running:
-            out: dict[str, list] = {"balls": []}
-            for ball in Balls.sprites().copy():
-                ball: Ball
-
-                out["balls"].append({
-                    "id": ball.id,
-                    "x": ball.position.x / 2,
-                    "y": ball.position.y,
-                    "vel": ball.velocity.xy,
-                    "tries": ball.tries,
-                    "on_target": ball.on_target,
-                })
-
-            server.send_all(out)
+        broadcaster.run(lambda: running)
 
     def calculator() -> None:
         """
         calculate the ball positions
         """
-        last_time = time.perf_counter()
-        while running:
-            this_time = time.perf_counter()
-            time_delta = this_time - last_time
-            last_time = this_time
+        if simulation is not None:
+            simulation.run(lambda: running)
 
-            Balls.update(time_delta)
+        else:
+            scheduler.run(Balls.update, lambda: running)
 
     Thread(target=server_handler).start()
     Thread(target=send_updates).start()
     Thread(target=calculator).start()
 
-    # pygame loop
-    while running:
-        # clear layers
-        BaseGame.screen.fill((0, 0, 0, 0))
-        BaseGame.lowest_layer.fill((0, 0, 0, 0))
-        BaseGame.wall_layer.fill((0, 0, 0, 0))
-        BaseGame.middle_layer.fill((0, 0, 0, 0))
-        BaseGame.top_layer.fill((0, 0, 0, 0))
-
-        # draw groups
-        Walls.draw(BaseGame.wall_layer)
-        Balls.draw(BaseGame.middle_layer)
-        Targets.draw(BaseGame.lowest_layer)
-
-        # draw to draw
-        for function, args in BaseGame.to_draw:
-            function(*args)
+    try:
+        if viewer:
+            # only import pygame display stuff if a window is requested
+            from core.viewer import DebugViewer
+            DebugViewer().run(lambda: running)
 
-        # draw layers
-        BaseGame.screen.blit(BaseGame.lowest_layer, (0, 0))
-        BaseGame.screen.blit(BaseGame.wall_layer, (0, 0))
-        BaseGame.screen.blit(BaseGame.middle_layer, (0, 0))
-        BaseGame.screen.blit(BaseGame.top_layer, (0, 0))
+        else:
+            while running:
+                time.sleep(.5)
 
-        pg.display.flip()
+    except KeyboardInterrupt:
+        pass
 
     running = False
+    server.end()
+
+    print(f"sent {broadcaster.sent} snapshots ({broadcaster.active_sent} active)")
+    print(
+        f"applied {lag_compensation.shots} shots, "
+        f"compensated {lag_compensation.stats()['average_compensation'] * 1000:.1f} ms on average, "
+        f"queue delay {lag_compensation.queue_delay * 1000:.1f} ms "
+        f"(max {lag_compensation.max_queue_delay * 1000:.1f} ms)"
+    )
+    if simulation is not None:
+        print(f"handled {simulation.events_handled} events")
+
+    else:
+        print(
+            f"simulated {scheduler.tick} ticks, "
+            f"{scheduler.overruns} overruns, "
+            f"load {scheduler.load:.1%}"
+        )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="MiniGolf server")
+    parser.add_argument("--viewer", action="store_true", help="open a debug window")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE, help="physics steps per second")
+    parser.add_argument("--event-driven", action="store_true", help="event driven instead of fixed ticks")
+    parser.add_argument("--snapshot-rate", type=float, default=SNAPSHOT_RATE, help="snapshots per second while balls move")
+    parser.add_argument("--idle-rate", type=float, default=IDLE_RATE, help="snapshots per second while balls rest")
+    parser.add_argument("--max-rewind", type=float, default=MAX_REWIND, help="maximum lag compensation for shots in seconds")
+    args = parser.parse_args()
+
+    main(
+        viewer=args.viewer,
+        tick_rate=args.tick_rate,
+        event_driven=args.event_driven,
+        snapshot_rate=args.snapshot_rate,
+        idle_rate=args.idle_rate,
+        max_rewind=args.max_rewind,
+    )
     running = False
@@ -0,0 +1,111 @@
+"""
+tests/test_collision.py
+
+sweeps compared with a brute force search along the path
+
+Author:
+Nilusink
+"""
+from core.collision import circle_segment, circle_ellipse, sweep_circle_segment, sweep_circle_ellipse
+from core.classes import Vec2
+import random
+import math
+
+
+RADIUS = .0125
+
+
+def _brute_force(touching, center, direction, distance, steps=2000):
+    """
+    first distance at which the circle touches the wall while moving into it
+    """
+    for i in range(steps + 1):
+        t = distance * i / steps
+        contact = touching(Vec2.from_cartesian(center[0] + direction[0] * t, center[1] + direction[1] * t))
+        if contact is not None and direction[0] * contact.normal.x + direction[1] * contact.normal.y < 0:
+            return t
+
+    return None
+
+
+def _rays(rng, n, x, y):
+    for _ in range(n):
+        angle = rng.uniform(0, 2 * math.pi)
+        yield (rng.uniform(*x), rng.uniform(*y)), (math.cos(angle), math.sin(angle))
+
+
+def test_segment_no_hit_next_to_the_end():
+    # next to the end of the wall, closer to its line than the radius, moving away
+    p0 = Vec2.from_cartesian(.5, .5)
+    p1 = Vec2.from_cartesian(1., .5)
+    center = Vec2.from_cartesian(1.015, .505)
+    angle = math.radians(-10)
+
+    assert circle_segment(center, RADIUS, p0, p1) is None
+    assert sweep_circle_segment(
+        center, RADIUS, Vec2.from_cartesian(math.cos(angle), math.sin(angle)), .05, p0, p1,
+    ) is None
+
+
+def test_segment_head_on():
+    p0 = Vec2.from_cartesian(.5, .5)
+    p1 = Vec2.from_cartesian(1., .5)
+
+    res = sweep_circle_segment(Vec2.from_cartesian(.75, .45), RADIUS, Vec2.from_cartesian(0, 1), .1, p0, p1)
+    assert res is not None
+    assert math.isclose(res[0], .05 - RADIUS)
+    assert math.isclose(res[1].normal.y, -1)
+
+
+def test_segment_matches_brute_force():
+    rng = random.Random(1)
+    p0 = Vec2.from_cartesian(.5, .5)
+    p1 = Vec2.from_cartesian(1., .5)
+    distance = .05
+
+    for center, direction in _rays(rng, 1000, (.4, 1.1), (.45, .55)):
+        if circle_segment(Vec2.from_cartesian(*center), RADIUS, p0, p1) is not None:
+            continue
+
+        res = sweep_circle_segment(
+            Vec2.from_cartesian(*center), RADIUS, Vec2.from_cartesian(*direction), distance, p0, p1,
+        )
+        expected = _brute_force(lambda c: circle_segment(c, RADIUS, p0, p1), center, direction, distance)
+
+        assert (res is None) == (expected is None), (center, direction)
+        if res is not None:
+            assert abs(res[0] - expected) <= distance / 1000, (center, direction)
+
+
+def test_ellipse_not_converged_still_hits():
+    # head on, but not enough iterations to converge
+    res = sweep_circle_ellipse(
+        Vec2.from_cartesian(1, .2), RADIUS, Vec2.from_cartesian(0, 1), .2,
+        Vec2.from_cartesian(1, .5), .1, .2,
+        max_iterations=1,
+    )
+    assert res is not None
+    assert res[0] <= .1 - RADIUS + 1e-9
+
+
+def test_ellipse_matches_brute_force():
+    rng = random.Random(1)
+    ellipse_center = Vec2.from_cartesian(1, .5)
+    a, b = .1, .2
+    distance = .05
+
+    for center, direction in _rays(rng, 400, (.85, 1.15), (.25, .75)):
+        if circle_ellipse(Vec2.from_cartesian(*center), RADIUS, ellipse_center, a, b) is not None:
+            continue
+
+        res = sweep_circle_ellipse(
+            Vec2.from_cartesian(*center), RADIUS, Vec2.from_cartesian(*direction), distance, ellipse_center, a, b,
+        )
+        expected = _brute_force(
+            lambda c: circle_ellipse(c, RADIUS, ellipse_center, a, b), center, direction, distance,
+        )
+
+        assert (res is None) == (expected is None), (center, direction)
+        if res is not None:
+            # grazing rays stop a bit early
+            assert abs(res[0] - expected) <= distance / 100, (center, direction)
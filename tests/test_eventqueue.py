@@ -0,0 +1,75 @@
+"""
+tests/test_eventqueue.py
+
+Author:
+Nilusink
+"""
+from core.eventqueue import EventQueue, EventQueueFull
+from threading import Timer
+import pytest
+
+
+def _user(event: tuple[str, str]) -> str | None:
+    """
+    events are (kind, user), only shots are indexed
+    """
+    return event[1] if event[0] == "shoot" else None
+
+
+def test_pending_by_key():
+    queue = EventQueue(key=_user)
+    queue.put(("shoot", "a"))
+    queue.put(("add", "b"))
+
+    assert queue.pending("a")
+    assert not queue.pending("b")
+
+    assert queue.get() == ("shoot", "a")
+    assert not queue.pending("a")
+
+
+def test_pending_counts_every_event():
+    queue = EventQueue(key=_user)
+    queue.put(("shoot", "a"))
+    queue.put(("shoot", "a"))
+
+    queue.get()
+    assert queue.pending("a")
+    queue.get()
+    assert not queue.pending("a")
+
+
+def test_drain():
+    queue = EventQueue(key=_user)
+    for i in range(5):
+        queue.put(("shoot", str(i)))
+
+    assert queue.drain(max_events=2) == [("shoot", "0"), ("shoot", "1")]
+    assert queue.drain() == [("shoot", "2"), ("shoot", "3"), ("shoot", "4")]
+    assert queue.drain() == []
+    assert not any(queue.pending(str(i)) for i in range(5))
+
+
+def test_drain_waits_for_events():
+    queue = EventQueue()
+    assert queue.drain(timeout=.01) == []
+
+    Timer(.05, queue.put, (("add", "a"),)).start()
+    assert queue.drain(timeout=5) == [("add", "a")]
+
+
+def test_full_queue():
+    queue = EventQueue(maxsize=2, key=_user)
+    queue.put(("shoot", "a"))
+    queue.put(("shoot", "b"))
+
+    with pytest.raises(EventQueueFull):
+        queue.put(("shoot", "c"))
+
+    assert queue.dropped == 1
+    assert not queue.pending("c")
+
+    # forced events are never dropped
+    queue.put(("add", "d"), force=True)
+    assert len(queue) == 3
+    assert queue.drain()[-1] == ("add", "d")
@@ -0,0 +1,51 @@
+"""
+tests/test_framing.py
+
+Author:
+Nilusink
+"""
+from core.framing import FrameDecoder, FrameError, FrameKind, encode_frame
+import pytest
+
+
+def _frames(frames) -> list[tuple[int, bytes]]:
+    return [(kind, bytes(payload)) for kind, payload in frames]
+
+
+def test_several_frames_in_one_chunk():
+    decoder = FrameDecoder()
+    data = encode_frame(b"a") + encode_frame(b"", FrameKind.MAP) + encode_frame(b"bc", FrameKind.SNAPSHOT)
+
+    assert _frames(decoder.feed(data)) == [
+        (FrameKind.JSON, b"a"), (FrameKind.MAP, b""), (FrameKind.SNAPSHOT, b"bc"),
+    ]
+    assert decoder.pending == 0
+
+
+def test_split_frames():
+    decoder = FrameDecoder()
+    data = encode_frame(b"hello") + encode_frame(b"world", FrameKind.SNAPSHOT)
+
+    # byte by byte, the header is split as well
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+
+    assert _frames(frames) == [(FrameKind.JSON, b"hello"), (FrameKind.SNAPSHOT, b"world")]
+    assert decoder.pending == 0
+
+
+def test_frame_split_across_chunks_with_more_frames():
+    decoder = FrameDecoder()
+    data = encode_frame(b"first") + encode_frame(b"second") + encode_frame(b"third")
+    cut = len(encode_frame(b"first")) + 3
+
+    assert _frames(decoder.feed(data[:cut])) == [(FrameKind.JSON, b"first")]
+    assert decoder.pending == 3
+    assert _frames(decoder.feed(data[cut:])) == [(FrameKind.JSON, b"second"), (FrameKind.JSON, b"third")]
+
+
+def test_frame_too_big():
+    decoder = FrameDecoder(max_size=4)
+    with pytest.raises(FrameError):
+        decoder.feed(encode_frame(b"12345"))
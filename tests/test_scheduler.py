@@ -0,0 +1,99 @@
+"""
+tests/test_scheduler.py
+
+runs the scheduler on a fake clock, so slow steps can be simulated exactly
+
+Author:
+Nilusink
+"""
+from core.scheduler import TickScheduler
+import core.scheduler
+import pytest
+
+
+class _Clock:
+    def __init__(self) -> None:
+        self.now = 0.
+
+    def perf_counter(self) -> float:
+        # time always passes a little, the busy-wait ends
+        self.now += 1e-9
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += max(seconds, 0)
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(core.scheduler, "perf_counter", clock.perf_counter)
+    monkeypatch.setattr(core.scheduler, "sleep", clock.sleep)
+    return clock
+
+
+def test_fixed_delta(clock):
+    scheduler = TickScheduler(tick_rate=50, spin_time=0)
+    deltas = []
+    scheduler.run(deltas.append, lambda: scheduler.tick < 100)
+
+    assert deltas == [1 / 50] * 100
+    assert clock.now == pytest.approx(2, abs=.03)
+    assert scheduler.overruns == 0
+    assert scheduler.dropped_time == 0
+
+
+def test_catch_up(clock):
+    scheduler = TickScheduler(tick_rate=50, max_catch_up=5, spin_time=0)
+    bursts = []
+
+    def step(_delta: float) -> None:
+        bursts.append(clock.now)
+
+        # one slow step, worth 3 ticks
+        if scheduler.tick == 10:
+            clock.now += 3 / 50
+
+    scheduler.run(step, lambda: scheduler.tick < 30)
+
+    # the missed ticks are run back to back
+    assert bursts[11] == pytest.approx(bursts[12], abs=1e-6)
+    assert bursts[12] == pytest.approx(bursts[13], abs=1e-6)
+    assert scheduler.overruns == 0
+    assert scheduler.dropped_time == 0
+    assert clock.now == pytest.approx(30 / 50, abs=.03)
+
+
+def test_overrun(clock):
+    scheduler = TickScheduler(tick_rate=50, max_catch_up=5, spin_time=0)
+
+    def step(_delta: float) -> None:
+        # stalls for 20 ticks once
+        if scheduler.tick == 10:
+            clock.now += 20 / 50
+
+    scheduler.run(step, lambda: scheduler.tick < 30)
+
+    # 5 of the missed ticks are caught up, the rest is dropped
+    assert scheduler.overruns == 1
+    assert scheduler.dropped_time == pytest.approx(15 / 50, abs=1e-6)
+    assert clock.now == pytest.approx(45 / 50, abs=.03)
+
+
+def test_stop(clock):
+    scheduler = TickScheduler(tick_rate=50, spin_time=0)
+
+    def step(_delta: float) -> None:
+        if scheduler.tick == 4:
+            scheduler.stop()
+
+    scheduler.run(step)
+    assert scheduler.tick == 5
+
+
+def test_invalid_arguments():
+    with pytest.raises(ValueError):
+        TickScheduler(tick_rate=0)
+
+    with pytest.raises(ValueError):
+        TickScheduler(max_catch_up=0)
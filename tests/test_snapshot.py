@@ -0,0 +1,107 @@
+"""
+tests/test_snapshot.py
+
+Author:
+Nilusink
+"""
+from core.snapshot import Snapshot, SnapshotEncoder, SnapshotDecoder, MissingBaseline, encode_snapshot
+import numpy as np
+import pytest
+
+
+def _snapshot(tick: int, balls: dict[int, tuple[float, float]]) -> Snapshot:
+    """
+    :param balls: user number -> position (client units)
+    """
+    return Snapshot.from_dict({
+        "tick": tick,
+        "time": 100. + tick,
+        "balls": [
+            {"id": f"user_{n:03d}", "x": x, "y": y, "vel": (0., 0.), "tries": n, "on_target": False}
+            for n, (x, y) in sorted(balls.items())
+        ],
+    })
+
+
+def _assert_same(decoded: Snapshot, expected: Snapshot) -> None:
+    assert decoded.ids == expected.ids
+    assert decoded.tick == expected.tick
+    assert decoded.time == expected.time
+    assert np.allclose(decoded.positions, expected.positions, atol=1e-4)
+    assert decoded.tries.tolist() == expected.tries.tolist()
+
+
+STATES = [
+    _snapshot(1, {1: (.1, .1), 2: (.2, .2), 3: (.3, .3)}),
+    _snapshot(2, {1: (.15, .1), 2: (.2, .2), 3: (.3, .3)}),                 # one moved
+    _snapshot(3, {1: (.2, .1), 3: (.3, .3)}),                               # one left
+    _snapshot(4, {1: (.25, .1), 3: (.3, .3), 4: (.4, .4)}),                 # one joined
+]
+
+
+def test_keyframe_round_trip():
+    decoder = SnapshotDecoder()
+    _assert_same(decoder.decode(encode_snapshot(STATES[0], 7)), STATES[0])
+    assert decoder.sequence == 7
+
+
+def test_delta_round_trip():
+    encoder = SnapshotEncoder()
+    decoder = SnapshotDecoder()
+
+    sequence = encoder.push(STATES[0])
+    decoder.decode(encoder.encode())
+
+    for state in STATES[1:]:
+        keyframe = len(encode_snapshot(state))
+        baseline = sequence
+        sequence = encoder.push(state)
+
+        data = encoder.encode(baseline)
+        assert len(data) < keyframe     # unchanged balls aren't sent
+        _assert_same(decoder.decode(data), state)
+        assert decoder.sequence == sequence
+
+
+def test_delta_with_skipped_sequences():
+    encoder = SnapshotEncoder()
+    decoder = SnapshotDecoder()
+
+    baseline = encoder.push(STATES[0])
+    decoder.decode(encoder.encode())
+
+    # the client only gets the last one, based on the first
+    for state in STATES[1:]:
+        encoder.push(state)
+
+    _assert_same(decoder.decode(encoder.encode(baseline)), STATES[-1])
+
+
+def test_unknown_baseline():
+    encoder = SnapshotEncoder()
+    encoder.push(STATES[0])
+    encoder.push(STATES[1])
+
+    with pytest.raises(MissingBaseline):
+        SnapshotDecoder().decode(encoder.encode(1))
+
+    # a baseline the encoder doesn't know gives a keyframe
+    _assert_same(SnapshotDecoder().decode(encoder.encode(123)), STATES[1])
+
+
+def test_decoder_forgets_old_states():
+    decoder = SnapshotDecoder(history=4)
+    encoder = SnapshotEncoder(history=64)
+
+    baseline = encoder.push(STATES[0])
+    decoder.decode(encoder.encode())
+
+    # skipped sequences, the first state is too old afterwards
+    for _ in range(10):
+        encoder.push(STATES[1])
+
+    decoder.decode(encoder.encode())
+    encoder.push(STATES[2])
+
+    with pytest.raises(MissingBaseline):
+        decoder.decode(encoder.encode(baseline))
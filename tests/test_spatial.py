@@ -0,0 +1,36 @@
+"""
+tests/test_spatial.py
+
+Author:
+Nilusink
+"""
+from core.spatial import UniformGrid
+
+
+def test_query_finds_overlapping_items():
+    grid = UniformGrid(.1)
+    grid.insert("a", (.05, .05, .15, .15))
+    grid.insert("b", (1.5, .5, 1.6, .6))
+
+    assert grid.query((0, 0, .1, .1)) == ["a"]
+    assert sorted(grid.query((0, 0, 2, 1))) == ["a", "b"]
+    assert grid.query((.5, .5, .6, .6)) == []
+
+
+def test_huge_query_is_clipped():
+    grid = UniformGrid(.1)
+    grid.insert("a", (.05, .05, .15, .15))
+    huge = (-1e6, -1e6, 1e6, 1e6)
+
+    # only the 2x2 cells the item is in are visited
+    assert sorted(grid._cell_range(huge, clip=True)) == [(0, 0), (0, 1), (1, 0), (1, 1)]
+    assert grid.query(huge) == ["a"]
+
+
+def test_empty_grid():
+    grid = UniformGrid(.1)
+    assert grid.query((0, 0, 1e9, 1e9)) == []
+
+    grid.insert("a", (0, 0, .1, .1))
+    grid.clear()
+    assert grid.query((0, 0, 1, 1)) == []
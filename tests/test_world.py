@@ -0,0 +1,102 @@
+"""
+tests/test_world.py
+
+Author:
+Nilusink
+"""
+from core.classes import Vec2
+from core.world import BallWorld
+
+
+class _View:
+    """
+    stands in for a Ball sprite, the world only uses its id and row
+    """
+    def __init__(self, world: BallWorld, ball_id: str, x: float, y: float) -> None:
+        self.id = ball_id
+        self._index = world.add(self, Vec2.from_cartesian(x, y))
+
+
+class _NoWalls:
+    def sweep_circle(self, *_args, **_kwargs):
+        return None
+
+
+def _world(n: int) -> tuple[BallWorld, list[_View]]:
+    world = BallWorld(radius=.0125, deceleration=.25, capacity=2)
+    return world, [_View(world, f"user_{i:03d}", (i + 1) / 10, .5) for i in range(n)]
+
+
+def _check_rows(world: BallWorld) -> None:
+    assert len(world.views) == world.count
+    for index, view in enumerate(world.views):
+        assert view._index == index
+
+
+def test_added_balls_sleep():
+    world, views = _world(5)     # grows past the capacity
+
+    assert world.count == 5
+    assert world.active_count == 0
+    assert world.positions[:5, 0].tolist() == [(i + 1) / 10 for i in range(5)]
+    _check_rows(world)
+
+
+def test_wake_and_sleep_keep_the_rows():
+    world, views = _world(4)
+
+    assert world.wake(views[2]._index) == 0
+    assert world.active_count == 1
+    assert world.views[0] is views[2]
+    assert world.positions[0].tolist() == [.3, .5]
+
+    world.wake(views[3]._index)
+    assert world.active_count == 2
+
+    index = world.sleep(views[2]._index)
+    assert index == 1
+    assert world.active_count == 1
+    assert world.views[0] is views[3]
+    assert world.positions[views[2]._index].tolist() == [.3, .5]
+    _check_rows(world)
+
+    # waking an awake ball doesn't change anything
+    assert world.wake(views[3]._index) == views[3]._index
+    assert world.active_count == 1
+
+
+def test_hit_balls_come_to_rest():
+    world, views = _world(3)
+    world.hit(views[1]._index, Vec2.from_cartesian(.1, 0))
+
+    assert world.active_count == 1
+    assert world.tries[views[1]._index] == 1
+
+    for _ in range(100):
+        world.step(.01, _NoWalls(), [])
+
+    # stopped after .4s, moved .1 / 2 * .4 and went to sleep
+    assert world.active_count == 0
+    assert abs(world.positions[views[1]._index, 0] - .22) < 1e-9
+    assert not world.velocities[views[1]._index].any()
+    assert world.published.tick == world.tick == 100
+
+
+def test_remove():
+    world, views = _world(4)
+    world.wake(views[0]._index)
+    world.wake(views[3]._index)
+
+    world.remove(views[0])
+    assert views[0]._index == -1
+    assert world.count == 3
+    assert world.active_count == 1
+    _check_rows(world)
+
+    # the rows still belong to their balls
+    for view in views[1:]:
+        assert world.positions[view._index, 0] == (int(view.id[-3:]) + 1) / 10
+
+    world.remove(views[3])
+    assert world.active_count == 0
+    assert sorted(world.snapshot().ids) == ["user_001", "user_002"]